@@ -0,0 +1,89 @@
+"""Measure the memory used by each buffered frame, both received frames and frames created for sending.
+
+Compares the current Frame implementation with the previous one (a frame with a per-instance __dict__, eagerly
+parsed headers and an eager copy of those headers in original_headers).
+
+Usage (from the project root): python -m benchmarks.frame_memory [frame count]
+"""
+
+import copy
+import sys
+import tracemalloc
+
+from stomp.utils import Frame, parse_frame, parse_headers, PREAMBLE_END_RE, LINE_END_RE, decode
+
+FRAME = (b"MESSAGE\n"
+         b"subscription:sub-1\n"
+         b"message-id:ID:broker-12345-1700000000000-1:1:1:1:1\n"
+         b"destination:/queue/reports\n"
+         b"content-type:text/plain\n"
+         b"priority:4\n"
+         b"timestamp:1700000000000\n"
+         b"expires:0\n"
+         b"\n"
+         b"hello world")
+
+
+class LegacyFrame(object):
+    def __init__(self, cmd, headers=None, body=None):
+        self.cmd = cmd
+        self.headers = headers if headers is not None else {}
+        self.original_headers = copy.copy(self.headers)
+        self.body = body
+
+
+def legacy_parse_frame(frame):
+    mat = PREAMBLE_END_RE.search(frame)
+    preamble_lines = LINE_END_RE.split(decode(frame[0:mat.start()]))
+    return LegacyFrame(preamble_lines[0], parse_headers(preamble_lines, 1), frame[mat.end():])
+
+
+def send_headers():
+    # the headers of a frame created by send (a new dict for each frame)
+    return {"destination": "/queue/reports", "content-type": "text/plain", "content-length": 11,
+            "persistent": "true", "priority": "4"}
+
+
+def measure_send(frame_class, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    frames = [frame_class("SEND", send_headers(), "hello world") for _ in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / count
+
+
+def measure(parse, count, read_headers=True):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # each frame is parsed from its own copy of the received data (as returned by the decoder), which only stays
+    # alive if the parsed frame refers to it
+    frames = [parse(bytes(bytearray(FRAME))) for _ in range(count)]
+    if read_headers:
+        for f in frames:
+            # a typical consumer reads a couple of headers
+            f.headers["subscription"]
+            f.headers["message-id"]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("frames buffered: %d" % count)
+    for read_headers in (True, False):
+        before = measure(legacy_parse_frame, count, read_headers)
+        after = measure(parse_frame, count, read_headers)
+        print("%s headers:" % ("reading" if read_headers else "not reading"))
+        print("    bytes per frame before: %.0f" % before)
+        print("    bytes per frame after:  %.0f" % after)
+    before = measure_send(LegacyFrame, count)
+    after = measure_send(Frame, count)
+    print("frames created for sending:")
+    print("    bytes per frame before: %.0f" % before)
+    print("    bytes per frame after:  %.0f" % after)
+
+
+if __name__ == "__main__":
+    main()
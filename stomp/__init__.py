@@ -11,6 +11,7 @@ Project Page: https://github.com/jasonrbriggs/stomp.py
 
 import stomp.adapter as adapter
 import stomp.connect as connect
+import stomp.hosts as hosts
 import stomp.listener as listener
 import stomp.logging as logging
 
@@ -41,6 +42,21 @@ WSStompConnection = WSConnection
 #
 Connection = connect.StompConnection11
 
+##
+# Publisher keeping a window of messages waiting for receipts.
+#
+ConfirmedPublisher = connect.ConfirmedPublisher
+
+##
+# Batches acknowledgements of received messages.
+#
+AckBatcher = connect.AckBatcher
+
+##
+# Connection with a warm standby, for failing over to another broker.
+#
+FailoverConnection = connect.FailoverConnection
+
 ##
 # Access to the default connection listener.
 #
@@ -59,6 +75,10 @@ WaitingListener = listener.WaitingListener
 # Access to the printing listener
 PrintingListener = listener.PrintingListener
 
+##
+# Access to the flow control (adaptive prefetch) listener
+FlowControlListener = listener.FlowControlListener
+
 def tuple_version():
     global __version__
     if type(__version__) != tuple:
@@ -49,6 +49,14 @@ class MulticastTransport(Transport):
         """
         self.socket.sendto(encoded_frame, (MCAST_GRP, MCAST_PORT))
 
+    def send_buffers(self, buffers):
+        """
+        Each frame has to go out as a single datagram, so join the buffers together.
+
+        :param list buffers:
+        """
+        self.send(pack(buffers))
+
     def receive(self):
         """
         Receive 1024 bytes from the multicast receiver socket.
@@ -73,15 +81,24 @@ class MulticastTransport(Transport):
 
         if frame_type in ["connected", "message", "receipt", "error", "heartbeat"]:
             if frame_type == "message":
-                if f.headers["destination"] not in self.subscriptions.values():
+                subscription = self.__find_subscription(f.headers["destination"])
+                if subscription is None:
                     return
+                f.set_header(HDR_SUBSCRIPTION, str(subscription))
                 self.notify("before_message", f)
             self.notify(frame_type, f)
         if "receipt" in f.headers:
             receipt_frame = Frame("RECEIPT", {"receipt-id": f.headers["receipt"]})
             lines = convert_frame(receipt_frame)
             self.send(encode(pack(lines)))
-        logging.debug("received frame: %r, headers=%r, body=%r", f.cmd, f.headers, f.body)
+        if logging.isEnabledFor(logging.DEBUG):
+            logging.debug("received frame: %r, headers=%r, body=%r", f.cmd, f.headers, f.body)
+
+    def __find_subscription(self, destination):
+        for (id, subscribed_destination) in self.subscriptions.items():
+            if subscribed_destination == destination:
+                return id
+        return None
 
     def stop(self):
         self.running = False
@@ -109,14 +126,17 @@ class MulticastConnection(BaseConnection, Protocol12):
         """
         self.transport.start()
 
-    def subscribe(self, destination, id, ack="auto", headers=None, **keyword_headers):
+    def subscribe(self, destination, id, ack="auto", headers=None, callback=None, **keyword_headers):
         """
         :param str destination:
         :param str id:
         :param str ack:
         :param dict headers:
+        :param function callback:
         :param keyword_headers:
         """
+        if callback is not None:
+            self._add_subscription_handler(id, callback)
         self.transport.subscriptions[id] = destination
 
     def unsubscribe(self, id, headers=None, **keyword_headers):
@@ -126,6 +146,9 @@ class MulticastConnection(BaseConnection, Protocol12):
         :param keyword_headers:
         """
         del self.transport.subscriptions[id]
+        router = self.transport.get_listener(SUBSCRIPTION_ROUTER_NAME)
+        if router is not None:
+            router.remove_handler(id)
 
     def disconnect(self, receipt=None, headers=None, **keyword_headers):
         """
@@ -136,11 +159,19 @@ class MulticastConnection(BaseConnection, Protocol12):
         Protocol12.disconnect(self, receipt, headers, **keyword_headers)
         self.transport.stop()
 
-    def send_frame(self, cmd, headers=None, body=""):
+    def send_frames(self, frames):
+        """
+        :param list((str,dict,body)) frames:
+        """
+        for (cmd, headers, body) in frames:
+            self.send_frame(cmd, headers, body)
+
+    def send_frame(self, cmd, headers=None, body="", sync=False):
         """
         :param str cmd:
         :param dict headers:
         :param body:
+        :param bool sync:
         """
         if headers is None:
             headers = {}
@@ -0,0 +1,4 @@
+"""asyncio support: connections which run on an event loop rather than using a receiver thread.
+"""
+
+from stomp.aio.connection import AsyncStompConnection, Subscription
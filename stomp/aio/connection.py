@@ -0,0 +1,552 @@
+"""An asyncio STOMP 1.2 connection.
+
+The connection uses asyncio streams (rather than a blocking socket and receiver thread), runs heartbeats as event
+loop timers, and reuses the frame encoding and parsing code of the threaded connections - so many connections can be
+handled by a single thread.
+"""
+
+import asyncio
+
+from stomp.constants import *
+from stomp.exception import ConnectFailedException, ConnectionClosedException, ErrorFrameException, \
+    NotConnectedException
+from stomp.framing import FrameDecoder, FrameEncoder
+from stomp.protocol import Protocol12
+from stomp.utils import Frame, calculate_heartbeats, get_uuid, merge_headers, parse_frame
+from stomp import logging
+
+
+def _is_eol(c):
+    return c == b"\x0a" or c == b"\x0d\x0a"
+
+
+class Subscription(object):
+    """
+    The messages received on a subscription, as an asynchronous iterator::
+
+        subscription = await conn.subscribe("/queue/test", ack="client-individual")
+        async for frame in subscription:
+            ...
+            await conn.ack(frame.headers["ack"])
+
+    Iteration stops when the subscription is unsubscribed, and raises
+    :py:class:`stomp.exception.ConnectionClosedException` if the connection is lost.
+
+    :param AsyncStompConnection connection: the connection
+    :param str id: the subscription id
+    :param str destination: the destination subscribed to
+    :param str ack: the acknowledgement mode
+    :param int max_queued: the maximum number of received messages waiting to be consumed, after which the
+        connection stops reading from the server until they have been (0 means no limit)
+    """
+
+    def __init__(self, connection, id, destination, ack, max_queued=0):
+        self.connection = connection
+        self.id = id
+        self.destination = destination
+        self.ack = ack
+        self.__queue = asyncio.Queue(max_queued)
+        self.__closed = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.__queue.empty() and self.__closed is not None:
+            self.__raise_closed()
+        frame = await self.__queue.get()
+        if frame is None:
+            self.__raise_closed()
+        return frame
+
+    def __raise_closed(self):
+        if isinstance(self.__closed, Exception):
+            raise self.__closed
+        raise StopAsyncIteration()
+
+    async def unsubscribe(self, headers=None, **keyword_headers):
+        """
+        :param dict headers: a map of any additional headers to send with the unsubscribe
+        :param keyword_headers: any additional headers to send with the unsubscribe
+        """
+        await self.connection.unsubscribe(self.id, headers, **keyword_headers)
+
+    async def _put(self, frame):
+        await self.__queue.put(frame)
+
+    def _close(self, error=None):
+        """
+        Stop the iteration, once the queued messages have been consumed.
+        """
+        if self.__closed is not None:
+            return
+        self.__closed = error if error is not None else True
+        if not self.__queue.full():
+            # wake up a waiting consumer
+            self.__queue.put_nowait(None)
+
+
+class AsyncStompConnection(object):
+    """
+    A STOMP 1.2 connection for use with asyncio::
+
+        conn = AsyncStompConnection([("localhost", 61613)], heartbeats=(10000, 10000))
+        await conn.connect("admin", "password")
+        receipt = await conn.send("/queue/test", "hello", receipt=True)
+        await receipt
+
+    :param list((str,int)) host_and_ports: the (host, port) tuples to try connecting to, in order
+    :param (int,int) heartbeats: the heartbeats (in milliseconds) to request from the server
+    :param ssl: passed to asyncio.open_connection (an SSLContext, or True for the default context)
+    :param bool auto_decode: decode message bodies to strings using the encoding, rather than leaving them as bytes
+    :param str encoding: the character encoding of message bodies
+    :param bool auto_content_length: add the content-length header to sent messages, if not specified
+    :param float heart_beat_receive_scale: how long to wait for a heartbeat before timing out, as a scale factor
+        of the receive heartbeat time
+    :param str vhost: the virtual host to specify in the 'host' header of the CONNECT frame
+    :param int recv_bytes: the maximum size of each read from the server
+    """
+
+    def __init__(self,
+                 host_and_ports=None,
+                 heartbeats=(0, 0),
+                 ssl=None,
+                 auto_decode=True,
+                 encoding="utf-8",
+                 auto_content_length=True,
+                 heart_beat_receive_scale=1.5,
+                 vhost=None,
+                 recv_bytes=65536):
+        if host_and_ports is None:
+            host_and_ports = [("localhost", 61613)]
+        self.host_and_ports = host_and_ports
+        self.heartbeats = heartbeats
+        self.ssl = ssl
+        self.auto_decode = auto_decode
+        self.encoding = encoding
+        self.auto_content_length = auto_content_length
+        self.heart_beat_receive_scale = heart_beat_receive_scale
+        self.vhost = vhost
+        self.recv_bytes = recv_bytes
+        self.version = "1.2"
+        self.current_host_and_port = None
+        self.connected = False
+        # the last ERROR frame received from the server
+        self.last_error = None
+        self.frame_encoder = FrameEncoder()
+        self.__decoder = FrameDecoder(_is_eol)
+        self.__reader = None
+        self.__writer = None
+        self.__reader_task = None
+        self.__connected_future = None
+        self.__receipts = {}
+        self.__subscriptions = {}
+        self.__send_heartbeat_handle = None
+        self.__receive_heartbeat_handle = None
+        self.__last_sent = 0
+        self.__last_received = 0
+        # set while the read loop is waiting for room in a subscription's queue (see __check_heartbeat)
+        self.__receive_paused = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.connected:
+            await self.disconnect()
+
+    def is_connected(self):
+        """
+        :rtype: bool
+        """
+        return self.connected
+
+    async def connect(self, username=None, passcode=None, headers=None, timeout=None, **keyword_headers):
+        """
+        Open a connection to the first server (in host_and_ports) which accepts it, send a STOMP frame, and wait
+        for the server to respond with CONNECTED.
+
+        :param str username: optionally specify the login user
+        :param str passcode: optionally specify the user password
+        :param dict headers: a map of any additional headers to send with the connect
+        :param float timeout: how long to wait for each server to accept the connection and respond, in seconds
+        :param keyword_headers: any additional headers to send with the connect
+        """
+        for host_and_port in self.host_and_ports:
+            try:
+                (self.__reader, self.__writer) = await asyncio.wait_for(
+                    asyncio.open_connection(host_and_port[0], host_and_port[1], ssl=self.ssl), timeout)
+                self.current_host_and_port = host_and_port
+                break
+            except (OSError, asyncio.TimeoutError):
+                logging.warning("could not connect to host %s, port %s", host_and_port[0], host_and_port[1],
+                                exc_info=logging.verbose)
+        else:
+            raise ConnectFailedException()
+
+        loop = asyncio.get_running_loop()
+        self.__decoder.reset()
+        self.__connected_future = loop.create_future()
+        self.__reader_task = loop.create_task(self.__read_loop())
+
+        headers = merge_headers([headers, keyword_headers])
+        headers[HDR_ACCEPT_VERSION] = self.version
+        headers[HDR_HOST] = self.vhost or self.current_host_and_port[0]
+        if username is not None:
+            headers[HDR_LOGIN] = username
+        if passcode is not None:
+            headers[HDR_PASSCODE] = passcode
+        if self.heartbeats != (0, 0):
+            headers[HDR_HEARTBEAT] = "%s,%s" % self.heartbeats
+        await self.send_frame(CMD_STOMP, headers)
+
+        try:
+            frame = await asyncio.wait_for(self.__connected_future, timeout)
+        except (ErrorFrameException, ConnectionClosedException, asyncio.TimeoutError):
+            await self.__close()
+            raise ConnectFailedException()
+        self.__start_heartbeats(frame)
+
+    async def disconnect(self, receipt=None, headers=None, timeout=None, **keyword_headers):
+        """
+        Send a DISCONNECT frame, wait for its receipt, and then close the connection.
+
+        :param str receipt: the receipt to use (generated if not specified)
+        :param dict headers: a map of any additional headers to send with the disconnect
+        :param float timeout: how long to wait for the receipt, in seconds
+        :param keyword_headers: any additional headers to send with the disconnect
+        """
+        if not self.connected:
+            return
+        headers = merge_headers([headers, keyword_headers])
+        headers[HDR_RECEIPT] = receipt or get_uuid()
+        try:
+            future = await self.__send_with_receipt(CMD_DISCONNECT, headers)
+            await asyncio.wait_for(future, timeout)
+        except (ConnectionClosedException, ErrorFrameException, asyncio.TimeoutError):
+            logging.debug("no receipt for disconnect", exc_info=logging.verbose)
+        finally:
+            await self.__close()
+
+    async def send_frame(self, cmd, headers=None, body=""):
+        """
+        Encode and send a frame, waiting until the data has been passed to the network (if the write buffer
+        is full).
+
+        :param str cmd: the protocol command
+        :param dict headers: a map of headers to include in the frame
+        :param body: the content of the message
+        """
+        if self.__writer is None:
+            raise NotConnectedException()
+        if headers is None:
+            headers = {}
+        if cmd not in (CMD_CONNECT, CMD_STOMP):
+            Protocol12._escape_headers(headers)
+        frame = Frame(cmd, headers, body)
+        self.__writer.writelines(self.frame_encoder.encode(frame))
+        self.__last_sent = asyncio.get_running_loop().time()
+        await self.__writer.drain()
+
+    async def send(self, destination, body, content_type=None, headers=None, receipt=None, **keyword_headers):
+        """
+        Send a message to a destination.
+
+        :param str destination: the destination of the message
+        :param body: the content of the message
+        :param str content_type: the MIME type of the message
+        :param dict headers: additional headers to send in the message frame
+        :param receipt: a receipt id, or True to have one generated
+        :param keyword_headers: any additional headers the broker requires
+
+        :return: if a receipt was requested, a Future which is resolved with the RECEIPT frame
+        :rtype: asyncio.Future
+        """
+        assert destination is not None, "'destination' is required"
+        assert body is not None, "'body' is required"
+        headers = merge_headers([headers, keyword_headers])
+        headers[HDR_DESTINATION] = destination
+        if content_type:
+            headers[HDR_CONTENT_TYPE] = content_type
+        if self.auto_content_length and body and HDR_CONTENT_LENGTH not in headers:
+            headers[HDR_CONTENT_LENGTH] = len(body)
+        return await self.__send_optional_receipt(CMD_SEND, headers, body, receipt)
+
+    async def subscribe(self, destination, id=None, ack="auto", headers=None, max_queued=0, **keyword_headers):
+        """
+        Subscribe to a destination.
+
+        :param str destination: the topic or queue to subscribe to
+        :param str id: the identifier of the subscription (generated if not specified)
+        :param str ack: either auto, client or client-individual
+        :param dict headers: a map of any additional headers to send with the subscription
+        :param int max_queued: the maximum number of messages waiting to be consumed (see :py:class:`Subscription`)
+        :param keyword_headers: any additional headers to send with the subscription
+
+        :rtype: Subscription
+        """
+        assert destination is not None, "'destination' is required"
+        id = str(id) if id is not None else get_uuid()
+        subscription = Subscription(self, id, destination, ack, max_queued)
+        self.__subscriptions[id] = subscription
+        headers = merge_headers([headers, keyword_headers])
+        headers[HDR_DESTINATION] = destination
+        headers[HDR_ID] = id
+        headers[HDR_ACK] = ack
+        try:
+            await self.send_frame(CMD_SUBSCRIBE, headers)
+        except Exception:
+            del self.__subscriptions[id]
+            raise
+        return subscription
+
+    async def unsubscribe(self, id, headers=None, **keyword_headers):
+        """
+        :param str id: the identifier of the subscription
+        :param dict headers: a map of any additional headers to send with the unsubscribe
+        :param keyword_headers: any additional headers to send with the unsubscribe
+        """
+        subscription = self.__subscriptions.pop(str(id), None)
+        if subscription is not None:
+            subscription._close()
+        headers = merge_headers([headers, keyword_headers])
+        headers[HDR_ID] = id
+        await self.send_frame(CMD_UNSUBSCRIBE, headers)
+
+    async def ack(self, id, transaction=None, receipt=None):
+        """
+        Acknowledge a message.
+
+        :param str id: the 'ack' header of the message
+        :param str transaction: include the acknowledgement in the specified transaction
+        :param receipt: a receipt id, or True to have one generated
+
+        :rtype: asyncio.Future
+        """
+        return await self.__send_ack(CMD_ACK, id, transaction, receipt)
+
+    async def nack(self, id, transaction=None, receipt=None):
+        """
+        Let the server know that a message was not consumed.
+
+        :param str id: the 'ack' header of the message
+        :param str transaction: include the acknowledgement in the specified transaction
+        :param receipt: a receipt id, or True to have one generated
+
+        :rtype: asyncio.Future
+        """
+        return await self.__send_ack(CMD_NACK, id, transaction, receipt)
+
+    async def begin(self, transaction=None, headers=None, **keyword_headers):
+        """
+        :param str transaction: the identifier of the transaction (generated if not specified)
+        :param dict headers: a map of any additional headers the broker requires
+        :param keyword_headers: any additional headers the broker requires
+
+        :return: the transaction id
+        :rtype: str
+        """
+        headers = merge_headers([headers, keyword_headers])
+        transaction = transaction or get_uuid()
+        headers[HDR_TRANSACTION] = transaction
+        await self.send_frame(CMD_BEGIN, headers)
+        return transaction
+
+    async def commit(self, transaction, headers=None, receipt=None, **keyword_headers):
+        """
+        :param str transaction: the identifier of the transaction
+        :param dict headers: a map of any additional headers the broker requires
+        :param receipt: a receipt id, or True to have one generated
+        :param keyword_headers: any additional headers the broker requires
+
+        :rtype: asyncio.Future
+        """
+        headers = merge_headers([headers, keyword_headers])
+        headers[HDR_TRANSACTION] = transaction
+        return await self.__send_optional_receipt(CMD_COMMIT, headers, "", receipt)
+
+    async def abort(self, transaction, headers=None, **keyword_headers):
+        """
+        :param str transaction: the identifier of the transaction
+        :param dict headers: a map of any additional headers the broker requires
+        :param keyword_headers: any additional headers the broker requires
+        """
+        headers = merge_headers([headers, keyword_headers])
+        headers[HDR_TRANSACTION] = transaction
+        await self.send_frame(CMD_ABORT, headers)
+
+    async def __send_ack(self, cmd, id, transaction, receipt):
+        assert id is not None, "'id' is required"
+        headers = {HDR_ID: id}
+        if transaction:
+            headers[HDR_TRANSACTION] = transaction
+        return await self.__send_optional_receipt(cmd, headers, "", receipt)
+
+    async def __send_optional_receipt(self, cmd, headers, body, receipt):
+        if receipt is True:
+            receipt = get_uuid()
+        if not receipt:
+            await self.send_frame(cmd, headers, body)
+            return None
+        headers[HDR_RECEIPT] = receipt
+        return await self.__send_with_receipt(cmd, headers, body)
+
+    async def __send_with_receipt(self, cmd, headers, body=""):
+        receipt = headers[HDR_RECEIPT]
+        future = asyncio.get_running_loop().create_future()
+        self.__receipts[receipt] = future
+        try:
+            await self.send_frame(cmd, headers, body)
+        except Exception:
+            del self.__receipts[receipt]
+            raise
+        return future
+
+    async def __read_loop(self):
+        loop = asyncio.get_running_loop()
+        error = ConnectionClosedException()
+        try:
+            while True:
+                data = await self.__reader.read(self.recv_bytes)
+                if not data:
+                    break
+                self.__last_received = loop.time()
+                if _is_eol(data) and not len(self.__decoder):
+                    continue
+                self.__decoder.feed(data)
+                for raw in self.__decoder.decode():
+                    frame = parse_frame(raw, self.encoding if self.auto_decode else None)
+                    if frame is not None:
+                        await self.__process_frame(frame)
+        except (OSError, asyncio.IncompleteReadError):
+            logging.debug("error reading from server", exc_info=logging.verbose)
+        except asyncio.CancelledError:
+            # closed by disconnect
+            error = None
+        finally:
+            self.__connection_lost(error)
+
+    async def __process_frame(self, frame):
+        cmd = frame.cmd
+        if cmd == "MESSAGE":
+            subscription = self.__subscriptions.get(frame.headers.get(HDR_SUBSCRIPTION))
+            if subscription is not None:
+                self.__receive_paused = True
+                try:
+                    await subscription._put(frame)
+                finally:
+                    self.__receive_paused = False
+            else:
+                logging.debug("message received for unknown subscription %s", frame.headers.get(HDR_SUBSCRIPTION))
+        elif cmd == "RECEIPT":
+            future = self.__receipts.pop(frame.headers.get(HDR_RECEIPT_ID), None)
+            if future is not None and not future.done():
+                future.set_result(frame)
+        elif cmd == "CONNECTED":
+            self.connected = True
+            if not self.__connected_future.done():
+                self.__connected_future.set_result(frame)
+        elif cmd == "ERROR":
+            logging.warning("error frame received: %s", frame.headers.get("message"))
+            self.last_error = frame
+            error = ErrorFrameException(frame)
+            if not self.__connected_future.done():
+                self.__connected_future.set_exception(error)
+            self.__fail_receipts(error, frame.headers.get(HDR_RECEIPT_ID))
+
+    def __fail_receipts(self, error, receipt_id=None):
+        if receipt_id is not None:
+            futures = [self.__receipts.pop(receipt_id, None)]
+        else:
+            futures = list(self.__receipts.values())
+            self.__receipts.clear()
+        for future in futures:
+            if future is not None and not future.done():
+                future.set_exception(error)
+
+    def __connection_lost(self, error=None):
+        """
+        Clean up after the connection has been closed. Subscriptions end with the error, or end normally if there
+        isn't one (the connection was closed by disconnect).
+        """
+        self.connected = False
+        self.__stop_heartbeats()
+        not_connected = error or NotConnectedException()
+        if self.__connected_future is not None and not self.__connected_future.done():
+            self.__connected_future.set_exception(not_connected)
+        self.__fail_receipts(not_connected)
+        for subscription in self.__subscriptions.values():
+            subscription._close(error)
+        self.__subscriptions.clear()
+        if self.__writer is not None:
+            self.__writer.close()
+            self.__writer = None
+
+    async def __close(self):
+        writer = self.__writer
+        if self.__reader_task is not None and self.__reader_task is not asyncio.current_task():
+            self.__reader_task.cancel()
+            try:
+                await self.__reader_task
+            except asyncio.CancelledError:
+                pass
+        self.__reader_task = None
+        self.__connection_lost()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    #
+    # Heartbeats are run using event loop timers, rather than a thread
+    #
+
+    def __start_heartbeats(self, frame):
+        if HDR_HEARTBEAT not in frame.headers or self.heartbeats == (0, 0):
+            return
+        (send_ms, receive_ms) = calculate_heartbeats(frame.headers[HDR_HEARTBEAT].replace(" ", "").split(","),
+                                                     self.heartbeats)
+        loop = asyncio.get_running_loop()
+        self.__last_received = loop.time()
+        if send_ms:
+            self.__send_heartbeat_handle = loop.call_later(send_ms / 1000.0, self.__send_heartbeat, send_ms / 1000.0)
+        if receive_ms:
+            timeout = receive_ms / 1000.0 * self.heart_beat_receive_scale
+            self.__receive_heartbeat_handle = loop.call_later(timeout, self.__check_heartbeat, timeout)
+
+    def __stop_heartbeats(self):
+        for handle in (self.__send_heartbeat_handle, self.__receive_heartbeat_handle):
+            if handle is not None:
+                handle.cancel()
+        self.__send_heartbeat_handle = None
+        self.__receive_heartbeat_handle = None
+
+    def __send_heartbeat(self, interval):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.__writer is None:
+            return
+        if now - self.__last_sent >= interval:
+            self.__writer.write(b"\x0a")
+            self.__last_sent = now
+            delay = interval
+        else:
+            delay = self.__last_sent + interval - now
+        self.__send_heartbeat_handle = loop.call_later(delay, self.__send_heartbeat, interval)
+
+    def __check_heartbeat(self, timeout):
+        loop = asyncio.get_running_loop()
+        if self.__receive_paused:
+            #
+            # Nothing is being read from the server until the consumer catches up, so data (including heartbeats)
+            # may well have been received - start timing again from now
+            #
+            self.__last_received = loop.time()
+        elapsed = loop.time() - self.__last_received
+        if elapsed > timeout:
+            logging.warning("heartbeat timeout: nothing received for %s seconds", elapsed)
+            if self.__writer is not None:
+                self.__writer.close()
+            return
+        self.__receive_heartbeat_handle = loop.call_later(timeout - elapsed, self.__check_heartbeat, timeout)
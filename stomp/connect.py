@@ -6,6 +6,7 @@ Provides connection classes for `1.0 <http://stomp.github.io/stomp-specification
 """
 
 from stomp.protocol import *
+from stomp.supervisor import SUPERVISOR_NAME, ReconnectSupervisor
 from stomp.transport import *
 from stomp.utils import get_uuid
 
@@ -14,12 +15,19 @@ class BaseConnection(Publisher):
     """
     Base class for all connection classes.
     """
+    receive_queue = None
+    supervisor = None
 
-    def __init__(self, transport):
+    def __init__(self, transport, receive_queue_size=None):
         """
         :param Transport transport:
+        :param int receive_queue_size: if set, received messages are also added to a queue of this size (0 means no
+            limit), to be taken using :py:meth:`receive` - see :py:class:`stomp.listener.MessageQueue`
         """
         self.transport = transport
+        if receive_queue_size is not None:
+            self.receive_queue = MessageQueue(transport, receive_queue_size)
+            self.set_listener("receive-queue", self.receive_queue)
 
     def __enter__(self):
         self.disconnect_receipt_id = get_uuid()
@@ -61,9 +69,63 @@ class BaseConnection(Publisher):
         """
         return self.transport.is_connected()
 
+    def set_message_dispatcher(self, dispatcher):
+        """
+        :param dispatcher: see :py:meth:`stomp.transport.BaseTransport.set_message_dispatcher`
+        """
+        self.transport.set_message_dispatcher(dispatcher)
+
+    def set_ack_batcher(self, batcher):
+        """
+        Batch acknowledgements, rather than sending each one straight away (see :py:class:`AckBatcher`).
+
+        :param AckBatcher batcher: the batcher to use, or None to stop batching
+        """
+        if self.ack_batcher is not None:
+            self.ack_batcher.close()
+            self.remove_listener("ack-batcher")
+        self.ack_batcher = batcher
+        if batcher is not None:
+            self.set_listener("ack-batcher", batcher)
+
+    def flush_acks(self):
+        """
+        Send any batched acknowledgements.
+        """
+        if self.ack_batcher is not None:
+            self.ack_batcher.flush_acks()
+
     def set_receipt(self, receipt_id, value):
         self.transport.set_receipt(receipt_id, value)
 
+    def receive(self, timeout=None):
+        """
+        Take the next message from the receive queue (requires the `receive_queue_size` parameter).
+
+        :param float timeout: how long to wait for a message, in seconds (None to wait until one is received or the
+            connection is disconnected)
+
+        :return: the message, or None if the timeout expired or the connection has been disconnected
+        :rtype: Frame
+        """
+        assert self.receive_queue is not None, "'receive_queue_size' is required to receive messages"
+        return self.receive_queue.get(timeout)
+
+    def messages(self):
+        """
+        Iterate over the messages in the receive queue, until the connection is disconnected.
+
+        :rtype: iter(Frame)
+        """
+        assert self.receive_queue is not None, "'receive_queue_size' is required to receive messages"
+        return iter(self.receive_queue)
+
+    def flush(self):
+        """
+        Send any frames which are queued for coalescing (see the `coalesce_writes` parameter).
+        """
+        self.transport.flush()
+
     def set_ssl(self, *args, **kwargs):
         self.transport.set_ssl(*args, **kwargs)
 
@@ -90,12 +152,20 @@ class StompConnection10(BaseConnection, Protocol10):
                  auto_decode=True,
                  encoding="utf-8",
                  auto_content_length=True,
-                 bind_host_port=None):
+                 bind_host_port=None,
+                 recv_into=False,
+                 coalesce_writes=False,
+                 receive_queue_size=None,
+                 reactor=None,
+                 connect_stagger=None,
+                 host_selector=None):
         transport = Transport(host_and_ports, prefer_localhost, try_loopback_connect,
                               reconnect_sleep_initial, reconnect_sleep_increase, reconnect_sleep_jitter,
                               reconnect_sleep_max, reconnect_attempts_max, timeout,
-                              keepalive, None, auto_decode, encoding, bind_host_port=bind_host_port)
-        BaseConnection.__init__(self, transport)
+                              keepalive, None, auto_decode, encoding, bind_host_port=bind_host_port,
+                              recv_into=recv_into, coalesce_writes=coalesce_writes, reactor=reactor,
+                              connect_stagger=connect_stagger, host_selector=host_selector)
+        BaseConnection.__init__(self, transport, receive_queue_size)
         Protocol10.__init__(self, transport, auto_content_length)
 
     def connect(self, *args, **kwargs):
@@ -119,6 +189,9 @@ class StompConnection11(BaseConnection, Protocol11):
     """
     Represents a 1.1 connection (comprising transport plus 1.1 protocol class)
     See :py:class:`stomp.transport.Transport` for details on the initialisation parameters.
+
+    :param bool auto_reconnect: if True, reconnect (and subscribe again) when the connection is lost - see
+        :py:class:`stomp.supervisor.ReconnectSupervisor`
     """
     def __init__(self,
                  host_and_ports=None,
@@ -137,14 +210,26 @@ class StompConnection11(BaseConnection, Protocol11):
                  encoding="utf-8",
                  auto_content_length=True,
                  heart_beat_receive_scale=1.5,
-                 bind_host_port=None):
+                 bind_host_port=None,
+                 recv_into=False,
+                 coalesce_writes=False,
+                 receive_queue_size=None,
+                 reactor=None,
+                 connect_stagger=None,
+                 auto_reconnect=False,
+                 host_selector=None):
         transport = Transport(host_and_ports, prefer_localhost, try_loopback_connect,
                               reconnect_sleep_initial, reconnect_sleep_increase, reconnect_sleep_jitter,
                               reconnect_sleep_max, reconnect_attempts_max, timeout,
-                              keepalive, vhost, auto_decode, encoding, bind_host_port=bind_host_port)
-        BaseConnection.__init__(self, transport)
+                              keepalive, vhost, auto_decode, encoding, bind_host_port=bind_host_port,
+                              recv_into=recv_into, coalesce_writes=coalesce_writes, reactor=reactor,
+                              connect_stagger=connect_stagger, host_selector=host_selector)
+        BaseConnection.__init__(self, transport, receive_queue_size)
         Protocol11.__init__(self, transport, heartbeats, auto_content_length,
                             heart_beat_receive_scale=heart_beat_receive_scale)
+        if auto_reconnect:
+            self.supervisor = ReconnectSupervisor(self)
+            self.set_listener(SUPERVISOR_NAME, self.supervisor)
 
     def connect(self, *args, **kwargs):
         self.transport.start()
@@ -158,6 +243,8 @@ class StompConnection11(BaseConnection, Protocol11):
         :param dict headers: a map of any additional headers to send with the disconnection
         :param keyword_headers: any additional headers to send with the disconnection
         """
+        if self.supervisor is not None:
+            self.supervisor.close()
         Protocol11.disconnect(self, receipt, headers, **keyword_headers)
         if receipt is not None:
             self.transport.stop()
@@ -167,6 +254,9 @@ class StompConnection12(BaseConnection, Protocol12):
     """
     Represents a 1.2 connection (comprising transport plus 1.2 protocol class).
     See :py:class:`stomp.transport.Transport` for details on the initialisation parameters.
+
+    :param bool auto_reconnect: if True, reconnect (and subscribe again) when the connection is lost - see
+        :py:class:`stomp.supervisor.ReconnectSupervisor`
     """
     def __init__(self,
                  host_and_ports=None,
@@ -185,14 +275,26 @@ class StompConnection12(BaseConnection, Protocol12):
                  encoding="utf-8",
                  auto_content_length=True,
                  heart_beat_receive_scale=1.5,
-                 bind_host_port=None):
+                 bind_host_port=None,
+                 recv_into=False,
+                 coalesce_writes=False,
+                 receive_queue_size=None,
+                 reactor=None,
+                 connect_stagger=None,
+                 auto_reconnect=False,
+                 host_selector=None):
         transport = Transport(host_and_ports, prefer_localhost, try_loopback_connect,
                               reconnect_sleep_initial, reconnect_sleep_increase, reconnect_sleep_jitter,
                               reconnect_sleep_max, reconnect_attempts_max, timeout,
-                              keepalive, vhost, auto_decode, encoding, bind_host_port=bind_host_port)
-        BaseConnection.__init__(self, transport)
+                              keepalive, vhost, auto_decode, encoding, bind_host_port=bind_host_port,
+                              recv_into=recv_into, coalesce_writes=coalesce_writes, reactor=reactor,
+                              connect_stagger=connect_stagger, host_selector=host_selector)
+        BaseConnection.__init__(self, transport, receive_queue_size)
         Protocol12.__init__(self, transport, heartbeats, auto_content_length,
                             heart_beat_receive_scale=heart_beat_receive_scale)
+        if auto_reconnect:
+            self.supervisor = ReconnectSupervisor(self)
+            self.set_listener(SUPERVISOR_NAME, self.supervisor)
 
     def connect(self, *args, **kwargs):
         self.transport.start()
@@ -206,6 +308,8 @@ class StompConnection12(BaseConnection, Protocol12):
         :param dict headers: a map of any additional headers to send with the disconnection
         :param keyword_headers: any additional headers to send with the disconnection
         """
+        if self.supervisor is not None:
+            self.supervisor.close()
         Protocol12.disconnect(self, receipt, headers, **keyword_headers)
         if receipt is not None:
             self.transport.stop()
@@ -213,3 +317,578 @@ class StompConnection12(BaseConnection, Protocol12):
     @staticmethod
     def is_eol(c):
         return c == b"\x0a" or c == b"\x0d\x0a"
+
+
+class ConfirmedPublisher(object):
+    """
+    Publishes messages with receipts, keeping up to `window` of them unconfirmed at a time, rather than waiting for
+    each receipt before sending the next message. When the window is full, `send` waits for a receipt to arrive.
+
+    Failures (an ERROR frame, or losing the connection, before the receipt arrives) are collected, and raised by
+    :py:meth:`wait`.
+
+    :param connection: the (connected) connection to publish on
+    :param int window: the maximum number of messages waiting for a receipt
+    """
+
+    def __init__(self, connection, window=100):
+        self.connection = connection
+        self.window = window
+        self.errors = []
+        self.__window_semaphore = threading.BoundedSemaphore(window)
+        self.__pending = set()
+        self.__pending_condition = threading.Condition()
+
+    def send(self, destination, body, content_type=None, headers=None, **keyword_headers):
+        """
+        Send a message, waiting first if the window of unconfirmed messages is full.
+
+        :param str destination: the destination of the message
+        :param body: the content of the message
+        :param str content_type: the content type of the message
+        :param dict headers: a map of any additional headers the broker requires
+        :param keyword_headers: any additional headers the broker requires
+
+        :return: a Future which is resolved with the RECEIPT frame
+        :rtype: concurrent.futures.Future
+        """
+        self.__window_semaphore.acquire()
+        keyword_headers[HDR_RECEIPT] = True
+        try:
+            future = self.connection.send(destination, body, content_type, headers, **keyword_headers)
+        except Exception:
+            self.__window_semaphore.release()
+            raise
+        with self.__pending_condition:
+            self.__pending.add(future)
+        future.add_done_callback(self.__confirmed)
+        return future
+
+    def pending(self):
+        """
+        :return: the number of messages waiting for a receipt
+        :rtype: int
+        """
+        with self.__pending_condition:
+            return len(self.__pending)
+
+    def wait(self, timeout=None):
+        """
+        Wait until all the messages sent have been confirmed, then raise the first failure (if any).
+
+        :param float timeout: how long to wait, in seconds
+
+        :return: True if all messages were confirmed, False if the timeout expired first
+        :rtype: bool
+        """
+        end = None if timeout is None else monotonic() + timeout
+        with self.__pending_condition:
+            while self.__pending:
+                remaining = None if end is None else end - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__pending_condition.wait(remaining)
+            if self.errors:
+                error = self.errors[0]
+                self.errors = []
+                raise error
+        return True
+
+    def __confirmed(self, future):
+        with self.__pending_condition:
+            self.__pending.discard(future)
+            if future.exception() is not None:
+                self.errors.append(future.exception())
+            self.__pending_condition.notify_all()
+        self.__window_semaphore.release()
+
+
+class AckBatcher(ConnectionListener):
+    """
+    Batches up the acknowledgements of each subscription, so that they're sent to the server using fewer frames and
+    writes::
+
+        conn.set_ack_batcher(AckBatcher(conn, max_acks=100, max_delay=0.05))
+
+    For subscriptions with `ack="client"` (where an ACK also acknowledges all the messages received before it), only
+    the latest acknowledgement is sent. For `ack="client-individual"` subscriptions, the ACK frames are sent together
+    in one write. A subscription's batch is sent once it has `max_acks` acknowledgements, and all batches are sent
+    when the oldest has been waiting for `max_delay` seconds, or when :py:meth:`flush_acks` is called. Batches are
+    also sent before the subscription is unsubscribed, before disconnecting, and before any NACK (or
+    acknowledgement with a transaction or receipt, which are sent individually).
+
+    If the connection is lost, batched acknowledgements are discarded (the server will redeliver the messages).
+
+    :param connection: the connection the acknowledgements are sent on
+    :param int max_acks: the number of acknowledgements for a subscription which are batched before sending
+    :param float max_delay: the maximum time (in seconds) an acknowledgement is batched before sending
+    """
+    internal = True
+
+    def __init__(self, connection, max_acks=100, max_delay=0.05):
+        self.connection = connection
+        self.max_acks = max_acks
+        self.max_delay = max_delay
+        self.flusher_thread = None
+        self.stats = {
+            # number of acknowledgements batched
+            "acks": 0,
+            # number of ACK frames sent
+            "frames": 0,
+            # number of batches sent
+            "batches": 0,
+        }
+        # ack mode of each subscription
+        self.__ack_modes = {}
+        # ack ids of the unacknowledged messages of each subscription, in the order received
+        self.__received = {}
+        # subscription of each unacknowledged message
+        self.__message_subscriptions = {}
+        # batched ACK headers, and number of acknowledgements, for each subscription
+        self.__pending = {}
+        self.__pending_counts = {}
+        self.__first_batched = None
+        self.__generation = 0
+        self.__condition = threading.Condition()
+        # held while batches are sent, to keep them in order
+        self.__send_lock = threading.Lock()
+
+    def add(self, headers):
+        """
+        Add an acknowledgement to the batch for its subscription.
+
+        :param dict headers: the headers of the ACK frame
+
+        :return: True if the acknowledgement was batched, False if it should be sent straight away (because the
+            subscription isn't known, or the message has already been acknowledged by a cumulative ack)
+        :rtype: bool
+        """
+        ack_id = headers.get(HDR_ID) or headers.get(HDR_MESSAGE_ID)
+        with self.__condition:
+            subscription = headers.get(HDR_SUBSCRIPTION)
+            if subscription is not None:
+                subscription = str(subscription)
+            else:
+                subscription = self.__message_subscriptions.get(ack_id)
+            ack_mode = self.__ack_modes.get(subscription)
+            if ack_mode is None:
+                return False
+            if ack_mode == "client":
+                if not self.__acknowledged(subscription, ack_id, True):
+                    # already covered by an earlier cumulative ack (or not a message we know of), so not batched in
+                    # place of the ack which is
+                    return False
+                self.__pending[subscription] = [headers]
+            else:
+                self.__acknowledged(subscription, ack_id, False)
+                self.__pending.setdefault(subscription, []).append(headers)
+            count = self.__pending_counts.get(subscription, 0) + 1
+            self.__pending_counts[subscription] = count
+            self.stats["acks"] += 1
+            if count < self.max_acks:
+                if self.__first_batched is None:
+                    self.__first_batched = monotonic()
+                    if self.flusher_thread is None:
+                        generation = self.__generation
+                        self.flusher_thread = self.connection.transport.create_thread_fc(
+                            lambda: self.__flusher_loop(generation))
+                    self.__condition.notify_all()
+                return True
+        self.__flush(subscription)
+        return True
+
+    def flush_acks(self):
+        """
+        Send all the batched acknowledgements.
+        """
+        self.__flush()
+
+    def close(self):
+        """
+        Discard the batched acknowledgements and stop the flusher thread.
+        """
+        with self.__condition:
+            self.__discard()
+            self.__generation += 1
+            self.flusher_thread = None
+            self.__condition.notify_all()
+
+    def on_message(self, frame):
+        """
+        :param Frame frame: the stomp frame
+        """
+        headers = frame.headers
+        ack_id = headers.get(HDR_ACK) or headers.get(HDR_MESSAGE_ID)
+        subscription = headers.get(HDR_SUBSCRIPTION)
+        with self.__condition:
+            received = self.__received.get(subscription)
+            if received is not None and ack_id is not None:
+                received[ack_id] = True
+                self.__message_subscriptions[ack_id] = subscription
+
+    def on_send(self, frame):
+        """
+        Learn the ack mode of each subscription, and send the batched acknowledgements before unsubscribing or
+        disconnecting.
+
+        :param Frame frame: the stomp frame
+        """
+        cmd = frame.cmd
+        if cmd == CMD_SUBSCRIBE:
+            ack_mode = frame.headers.get(HDR_ACK, "auto")
+            subscription = frame.headers.get(HDR_ID)
+            if ack_mode in ("client", "client-individual") and subscription is not None:
+                with self.__condition:
+                    self.__ack_modes[str(subscription)] = ack_mode
+                    self.__received.setdefault(str(subscription), OrderedDict())
+        elif cmd == CMD_UNSUBSCRIBE:
+            subscription = str(frame.headers.get(HDR_ID))
+            self.__flush(subscription)
+            with self.__condition:
+                self.__ack_modes.pop(subscription, None)
+                for ack_id in self.__received.pop(subscription, ()):
+                    self.__message_subscriptions.pop(ack_id, None)
+        elif cmd == CMD_DISCONNECT:
+            self.__flush()
+
+    def on_disconnected(self):
+        """
+        Discard the batched acknowledgements (the server will redeliver the messages).
+        """
+        with self.__condition:
+            self.__discard()
+            self.__message_subscriptions.clear()
+            for received in self.__received.values():
+                received.clear()
+
+    def __acknowledged(self, subscription, ack_id, cumulative):
+        """
+        Stop tracking acknowledged messages. Must be called holding the condition.
+
+        :return: False if the message wasn't being tracked (for example, because it's already been acknowledged)
+        :rtype: bool
+        """
+        received = self.__received[subscription]
+        if ack_id not in received:
+            return False
+        if cumulative:
+            while received:
+                (received_id, _) = received.popitem(last=False)
+                self.__message_subscriptions.pop(received_id, None)
+                if received_id == ack_id:
+                    break
+        else:
+            del received[ack_id]
+            self.__message_subscriptions.pop(ack_id, None)
+        return True
+
+    def __discard(self):
+        self.__pending.clear()
+        self.__pending_counts.clear()
+        self.__first_batched = None
+
+    def __take(self, subscription=None):
+        """
+        Remove the batched acknowledgements (of one subscription, or all of them).
+        """
+        with self.__condition:
+            if subscription is None:
+                batches = list(self.__pending.values())
+                self.__discard()
+            else:
+                batches = [self.__pending.pop(subscription, [])]
+                self.__pending_counts.pop(subscription, None)
+                if not self.__pending:
+                    self.__first_batched = None
+        frames = []
+        for batch in batches:
+            for headers in batch:
+                frames.append((CMD_ACK, headers, ""))
+        return frames
+
+    def __flush(self, subscription=None):
+        with self.__send_lock:
+            frames = self.__take(subscription)
+            if frames:
+                self.connection.send_frames(frames)
+                self.stats["frames"] += len(frames)
+                self.stats["batches"] += 1
+
+    def __flusher_loop(self, generation):
+        logging.debug("starting ack flusher loop (%s)", threading.current_thread())
+        while True:
+            with self.__condition:
+                while generation == self.__generation and self.__first_batched is None:
+                    self.__condition.wait()
+                if generation != self.__generation:
+                    break
+                remaining = self.__first_batched + self.max_delay - monotonic()
+                if remaining > 0:
+                    self.__condition.wait(remaining)
+                    continue
+            try:
+                self.__flush()
+            except Exception:
+                logging.debug("error sending batched acknowledgements", exc_info=logging.verbose)
+                with self.__condition:
+                    self.__discard()
+        logging.debug("ack flusher loop ended")
+
+
+class _FailoverListener(ConnectionListener):
+    """
+    Tells a FailoverConnection when one of its connections is lost.
+    """
+
+    def __init__(self, failover, connection):
+        self.failover = failover
+        self.connection = connection
+
+    def on_heartbeat_timeout(self):
+        self.failover.connection_lost(self.connection)
+
+    def on_disconnected(self):
+        self.failover.connection_lost(self.connection)
+
+
+class FailoverConnection(object):
+    """
+    Publishes through a STOMP 1.2 connection to one of the brokers, while keeping a second connection to another
+    broker established (but with no subscriptions) as a warm standby. When the primary connection is lost (or its
+    heartbeat times out), sending switches straight over to the standby, and a new standby is connected in the
+    background - rather than waiting for the transport to reconnect::
+
+        conn = stomp.FailoverConnection([(host1, port), (host2, port)], heartbeats=(4000, 4000))
+        conn.connect(username, passcode)
+        conn.send("/queue/test", "message")
+
+    Frames which were sent on the primary connection just before it was lost may not have reached the broker, so
+    receipts should be used if messages mustn't be lost (see :py:class:`ConfirmedPublisher`).
+
+    If there's only one broker, the standby is a second connection to the same broker.
+
+    :param list((str,int)) host_and_ports: the brokers to connect to
+    :param float retry_sleep: how long to wait (in seconds) before trying again, when a standby connection can't be
+        established to any of the brokers
+    :param keyword_args: any other parameters for the connections (see :py:class:`StompConnection12`)
+    """
+
+    def __init__(self, host_and_ports, retry_sleep=1.0, **keyword_args):
+        assert host_and_ports, "'host_and_ports' is required"
+        self.host_and_ports = list(host_and_ports)
+        self.retry_sleep = retry_sleep
+        self.primary = None
+        self.standby = None
+        self.standby_thread = None
+        self.stats = {
+            # number of times sending switched to the standby connection
+            "failovers": 0,
+            # number of standby connections established
+            "standby_connects": 0,
+            # number of failed attempts to establish a standby connection
+            "standby_failures": 0,
+        }
+        self.__connection_args = keyword_args
+        self.__connect_args = None
+        self.__listeners = {}
+        self.__next_host = 0
+        self.__closed = True
+        self.__lock = threading.Lock()
+
+    def set_listener(self, name, listener):
+        """
+        Set a named listener on the primary and standby connections (including any connected later).
+
+        :param str name: the name of the listener
+        :param ConnectionListener listener: the listener object
+        """
+        with self.__lock:
+            self.__listeners[name] = listener
+            connections = [self.primary, self.standby]
+        for connection in connections:
+            if connection is not None:
+                connection.set_listener(name, listener)
+
+    def remove_listener(self, name):
+        """
+        Remove a listener from the connections.
+
+        :param str name: the name of the listener to remove
+        """
+        with self.__lock:
+            self.__listeners.pop(name, None)
+            connections = [self.primary, self.standby]
+        for connection in connections:
+            if connection is not None:
+                connection.remove_listener(name)
+
+    def is_connected(self):
+        """
+        :rtype: bool
+        """
+        primary = self.primary
+        return primary is not None and primary.is_connected()
+
+    def connect(self, username=None, passcode=None, headers=None, **keyword_headers):
+        """
+        Connect the primary connection (waiting until it's established), then start connecting the standby.
+
+        :param str username: the username to connect with
+        :param str passcode: the password used to authenticate with
+        :param dict headers: a map of any additional headers the broker requires
+        :param keyword_headers: any additional headers the broker requires
+        """
+        self.__connect_args = (username, passcode, utils.merge_headers([headers, keyword_headers]))
+        with self.__lock:
+            self.__closed = False
+        try:
+            primary = self.__open()
+        except Exception:
+            with self.__lock:
+                self.__closed = True
+            raise
+        with self.__lock:
+            self.primary = primary
+            self.__start_standby()
+
+    def disconnect(self, receipt=None, headers=None, **keyword_headers):
+        """
+        Disconnect the primary and standby connections.
+
+        :param str receipt: the receipt to use with the primary connection's disconnect
+        :param dict headers: a map of any additional headers to send with the disconnection
+        :param keyword_headers: any additional headers to send with the disconnection
+        """
+        with self.__lock:
+            self.__closed = True
+            (primary, standby) = (self.primary, self.standby)
+            self.primary = self.standby = None
+        if standby is not None:
+            standby.disconnect()
+        if primary is not None:
+            primary.disconnect(receipt, headers, **keyword_headers)
+
+    def send(self, destination, body, content_type=None, headers=None, **keyword_headers):
+        """
+        Send a message using the primary connection (see :py:meth:`stomp.protocol.Protocol11.send`).
+
+        :param str destination: the destination
+        :param body: the content of the message
+        :param str content_type: the MIME type of message
+        :param dict headers: additional headers to send in the message frame
+        :param keyword_headers: any additional headers the broker requires
+        """
+        return self.__current().send(destination, body, content_type, headers, **keyword_headers)
+
+    def send_many(self, messages, transactional=False, receipt=None):
+        """
+        Send a batch of messages using the primary connection (see :py:meth:`stomp.protocol.Protocol11.send_many`).
+        """
+        return self.__current().send_many(messages, transactional, receipt)
+
+    def connection_lost(self, connection):
+        """
+        Called (by the listener on each connection) when a connection is lost. If it's the primary connection, the
+        standby takes over.
+
+        :param StompConnection12 connection: the connection which has been lost
+        """
+        with self.__lock:
+            if self.__closed:
+                return
+            if connection is self.primary:
+                logging.info("primary connection to %s lost, switching to standby",
+                             connection.transport.current_host_and_port)
+                self.primary = self.standby
+                self.standby = None
+                if self.primary is not None:
+                    self.stats["failovers"] += 1
+            elif connection is self.standby:
+                self.standby = None
+            else:
+                return
+            self.__start_standby()
+        self.__discard(connection)
+
+    def __current(self):
+        primary = self.primary
+        if primary is None:
+            raise exception.NotConnectedException()
+        return primary
+
+    def __start_standby(self):
+        """
+        Start the thread which establishes the standby connection (or primary, if there isn't one), if it isn't
+        already running. Called with the lock held.
+        """
+        if self.standby_thread is None and not self.__closed and (self.primary is None or self.standby is None):
+            self.standby_thread = default_create_thread(self.__standby_loop)
+
+    def __standby_loop(self):
+        while True:
+            with self.__lock:
+                if self.__closed or (self.primary is not None and self.standby is not None):
+                    self.standby_thread = None
+                    return
+                avoid = self.primary.transport.current_host_and_port if self.primary is not None else None
+            try:
+                connection = self.__open(avoid)
+            except Exception:
+                logging.debug("unable to establish standby connection", exc_info=logging.verbose)
+                self.stats["standby_failures"] += 1
+                time.sleep(self.retry_sleep)
+                continue
+            with self.__lock:
+                if not self.__closed and connection.is_connected():
+                    if self.primary is None:
+                        self.primary = connection
+                    else:
+                        self.standby = connection
+                        self.stats["standby_connects"] += 1
+                    continue
+            connection.disconnect()
+
+    def __open(self, avoid=None):
+        """
+        Connect to the next broker (other than `avoid`, if there's a choice), trying each of the brokers in turn.
+
+        :param (str,int) avoid: the host and port of the broker to avoid
+
+        :rtype: StompConnection12
+        """
+        with self.__lock:
+            start = self.__next_host
+            self.__next_host = (self.__next_host + 1) % len(self.host_and_ports)
+        hosts = self.host_and_ports[start:] + self.host_and_ports[:start]
+        hosts.sort(key=lambda host_and_port: host_and_port == avoid)
+        (username, passcode, headers) = self.__connect_args
+        for host_and_port in hosts:
+            connection = StompConnection12([host_and_port], **self.__connection_args)
+            connected = False
+            try:
+                for (name, listener) in list(self.__listeners.items()):
+                    connection.set_listener(name, listener)
+                connection.set_listener("failover-listener", _FailoverListener(self, connection))
+                connection.connect(username, passcode, wait=True, headers=dict(headers))
+                connected = True
+                return connection
+            except exception.ConnectFailedException:
+                logging.debug("unable to connect to %s", host_and_port, exc_info=logging.verbose)
+            finally:
+                if not connected:
+                    self.__discard(connection)
+        raise exception.ConnectFailedException()
+
+    def __discard(self, connection):
+        """
+        Stop using a connection which has been lost (or couldn't be established): detach the listeners, so that
+        they're no longer told about it, and shut it down, so that its transport doesn't try to reconnect.
+        """
+        for name in list(connection.transport.listeners):
+            if name in self.__listeners or name == "failover-listener":
+                connection.remove_listener(name)
+        try:
+            connection.transport.disconnect_socket()
+            connection.transport.stop()
+        except Exception:
+            logging.debug("error closing connection", exc_info=logging.verbose)
@@ -13,6 +13,7 @@ HDR_MESSAGE_ID = "message-id"
 HDR_LOGIN = "login"
 HDR_PASSCODE = "passcode"
 HDR_RECEIPT = "receipt"
+HDR_RECEIPT_ID = "receipt-id"
 HDR_SUBSCRIPTION = "subscription"
 HDR_TRANSACTION = "transaction"
 
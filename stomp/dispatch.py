@@ -0,0 +1,377 @@
+"""Dispatchers which handle messages away from the connection's receiver thread: on a pool of threads (see
+:py:meth:`stomp.transport.BaseTransport.set_message_dispatcher`), or on a pool of processes.
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import monotonic
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except (ImportError, AttributeError):  # python < 3.8
+    shared_memory = None
+
+from stomp.constants import *
+from stomp.listener import ConnectionListener
+from stomp.utils import encode
+from stomp import logging
+
+
+class ThreadPoolDispatcher(object):
+    """
+    Hands messages to a pool of worker threads, so that slow message handlers don't hold up the receiver thread (and
+    with it, reading from the socket, heartbeats and receipts).
+
+    Messages with the same ordering key are handled one at a time, in the order they were received, while messages
+    with different keys are handled in parallel. By default the key is the subscription id, so each subscription
+    sees its messages in order. Messages without a key are handled in any order.
+
+    At most `max_pending` messages are queued or being handled - once that many are outstanding, the receiver thread
+    waits for the handlers to catch up, rather than reading more messages from the server.
+
+    Exceptions raised by the handlers are logged.
+
+    :param int max_workers: the number of worker threads (ignored if an executor is provided)
+    :param int max_pending: the maximum number of messages queued or being handled
+    :param ordering_key: the name of the header used as the ordering key, or a function which is passed the frame
+        and returns the key
+    :param concurrent.futures.Executor executor: an executor to use, rather than creating a ThreadPoolExecutor (for
+        example, to share workers between connections)
+    """
+
+    def __init__(self, max_workers=None, max_pending=1000, ordering_key=HDR_SUBSCRIPTION, executor=None):
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers, thread_name_prefix="StompDispatch")
+        self.executor = executor
+        if callable(ordering_key):
+            self.__key_fc = ordering_key
+        else:
+            self.__key_fc = lambda frame: frame.headers.get(ordering_key)
+        self.__pending_semaphore = threading.BoundedSemaphore(max_pending)
+        # messages waiting to be handled, for the keys which currently have one being handled
+        self.__queues = {}
+        self.__pending = 0
+        self.__condition = threading.Condition()
+
+    def dispatch(self, frame, handlers):
+        """
+        Queue a message to be passed to each of the handlers (in order).
+
+        :param Frame frame: the MESSAGE frame
+        :param tuple handlers: the listener methods to call
+        """
+        self.__pending_semaphore.acquire()
+        with self.__condition:
+            self.__pending += 1
+        task = (frame, handlers)
+        key = self.__key_fc(frame)
+        if key is None:
+            self.__submit(self.__run_unordered, key, task)
+            return
+        with self.__condition:
+            queue = self.__queues.get(key)
+            if queue is not None:
+                queue.append(task)
+                return
+            self.__queues[key] = deque()
+        self.__submit(self.__run_ordered, key, task)
+
+    def wait(self, timeout=None):
+        """
+        Wait until all the messages dispatched so far have been handled.
+
+        :param float timeout: how long to wait, in seconds
+
+        :return: False if the timeout expired first
+        :rtype: bool
+        """
+        end = None if timeout is None else monotonic() + timeout
+        with self.__condition:
+            while self.__pending:
+                remaining = None if end is None else end - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__condition.wait(remaining)
+        return True
+
+    def shutdown(self, wait=True):
+        """
+        Shut down the executor.
+
+        :param bool wait: if True, wait for the queued messages to be handled first
+        """
+        if wait:
+            self.wait()
+        self.executor.shutdown(wait)
+
+    def __submit(self, fn, key, task):
+        try:
+            self.executor.submit(fn, key, task)
+        except Exception:
+            #
+            # Most likely the executor has been shut down: drop this message, and any queued behind it
+            #
+            logging.error("unable to dispatch message", exc_info=True)
+            dropped = 1
+            if key is not None:
+                with self.__condition:
+                    dropped += len(self.__queues.pop(key, ()))
+            for _ in range(dropped):
+                self.__done()
+            raise
+
+    def __handle(self, task):
+        (frame, handlers) = task
+        try:
+            for handler in handlers:
+                handler(frame)
+        except Exception:
+            logging.error("error handling message %s", frame.headers.get(HDR_MESSAGE_ID), exc_info=True)
+        finally:
+            self.__done()
+
+    def __done(self):
+        with self.__condition:
+            self.__pending -= 1
+            self.__condition.notify_all()
+        self.__pending_semaphore.release()
+
+    def __run_unordered(self, key, task):
+        self.__handle(task)
+
+    def __run_ordered(self, key, task):
+        self.__handle(task)
+        with self.__condition:
+            queue = self.__queues[key]
+            if not queue:
+                del self.__queues[key]
+                return
+            task = queue.popleft()
+        #
+        # Resubmit rather than looping, so that a busy key doesn't hog a worker
+        #
+        self.__submit(self.__run_ordered, key, task)
+
+
+def _run_handler(handler, headers, body, shm_name, size):
+    """
+    Run a handler in a worker process. The body is either passed in directly, or (if shm_name is set) read from
+    shared memory.
+    """
+    if shm_name is None:
+        return handler(headers, body)
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+        tracked = False
+    except TypeError:
+        # before Python 3.13, attaching always registers the block with the resource tracker
+        shm = shared_memory.SharedMemory(name=shm_name)
+        tracked = os.name == "posix"
+    view = shm.buf[:size]
+    try:
+        return handler(headers, view)
+    finally:
+        view.release()
+        shm.close()
+        if tracked:
+            #
+            # The block belongs to the parent, so stop tracking it - otherwise the tracker would remove it (and
+            # complain about a leak) when this process exits
+            #
+            resource_tracker.unregister(shm._name, "shared_memory")
+
+
+class ProcessPoolDispatcher(ConnectionListener):
+    """
+    A listener which hands messages to a pool of worker processes, for CPU-bound handlers which wouldn't run in
+    parallel on threads. Register it on the connection (with set_listener) before subscribing.
+
+    The handler must be a picklable (module level) function, which is called in a worker process with the message
+    headers (a dict) and body. Small bodies are passed as bytes; bodies of `shared_memory_threshold` bytes or more are
+    copied into a shared memory block rather than pickled, and passed as a memoryview which is only valid for the
+    duration of the call.
+
+    For subscriptions with client or client-individual acknowledgement (found from the SUBSCRIBE frames sent), each
+    message is acked when its handler returns, or nacked if it raises an exception. As the handlers finish out of
+    order, with 'client' (cumulative) acknowledgement a message is only acked once every message before it on the
+    subscription has finished.
+
+    :param connection: the connection the messages are received on (used to ack them)
+    :param function handler: called as handler(headers, body) in a worker process
+    :param int max_workers: the number of worker processes (ignored if an executor is provided)
+    :param int max_pending: the maximum number of messages queued or being handled, after which the receiver thread
+        waits for the workers to catch up
+    :param int shared_memory_threshold: the body size from which shared memory is used
+    :param concurrent.futures.Executor executor: the executor to use, rather than creating a ProcessPoolExecutor
+    """
+    internal = True
+
+    def __init__(self, connection, handler, max_workers=None, max_pending=1000, shared_memory_threshold=65536,
+                 executor=None):
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers)
+        self.executor = executor
+        self.connection = connection
+        self.handler = handler
+        self.shared_memory_threshold = shared_memory_threshold
+        self.__pending_semaphore = threading.BoundedSemaphore(max_pending)
+        self.__pending = 0
+        self.__condition = threading.Condition()
+        # ack mode by subscription id
+        self.__ack_modes = {}
+        # messages awaiting a cumulative ack, in the order received, by subscription id
+        self.__unacked = {}
+
+    def on_send(self, frame):
+        """
+        Keep track of the acknowledgement mode of each subscription.
+
+        :param Frame frame: the stomp frame
+        """
+        if frame.cmd == CMD_SUBSCRIBE and HDR_ID in frame.headers:
+            with self.__condition:
+                self.__ack_modes[str(frame.headers[HDR_ID])] = frame.headers.get(HDR_ACK, "auto")
+        elif frame.cmd == CMD_UNSUBSCRIBE and HDR_ID in frame.headers:
+            with self.__condition:
+                self.__ack_modes.pop(str(frame.headers[HDR_ID]), None)
+                self.__unacked.pop(str(frame.headers[HDR_ID]), None)
+
+    def on_message(self, frame):
+        """
+        Submit the message to the worker pool.
+
+        :param Frame frame: the stomp frame
+        """
+        self.__pending_semaphore.acquire()
+        headers = dict(frame.headers)
+        body = frame.raw_body
+        if isinstance(body, str):
+            body = encode(body)
+        shm = None
+        if shared_memory is not None and body is not None and len(body) >= self.shared_memory_threshold:
+            shm = shared_memory.SharedMemory(create=True, size=len(body))
+            shm.buf[:len(body)] = body
+            args = (self.handler, headers, None, shm.name, len(body))
+        else:
+            args = (self.handler, headers, bytes(body or b""), None, 0)
+
+        entry = [headers, None]
+        subscription = headers.get(HDR_SUBSCRIPTION)
+        with self.__condition:
+            self.__pending += 1
+            ack_mode = self.__ack_modes.get(subscription, "auto")
+            if ack_mode == "client":
+                self.__unacked.setdefault(subscription, deque()).append(entry)
+
+        try:
+            future = self.executor.submit(_run_handler, *args)
+        except Exception as e:
+            # the message won't be handled, so nack it (rather than leaving it to hold up the cumulative acks)
+            self.__completed(entry, ack_mode, e)
+            self.__release(shm)
+            raise
+        future.add_done_callback(lambda f: self.__finished(f, entry, ack_mode, shm))
+
+    def wait(self, timeout=None):
+        """
+        Wait until all the messages received so far have been handled (and acked).
+
+        :param float timeout: how long to wait, in seconds
+
+        :return: False if the timeout expired first
+        :rtype: bool
+        """
+        end = None if timeout is None else monotonic() + timeout
+        with self.__condition:
+            while self.__pending:
+                remaining = None if end is None else end - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__condition.wait(remaining)
+        return True
+
+    def shutdown(self, wait=True):
+        """
+        Shut down the executor.
+
+        :param bool wait: if True, wait for the queued messages to be handled first
+        """
+        if wait:
+            self.wait()
+        self.executor.shutdown(wait)
+
+    def __release(self, shm):
+        if shm is not None:
+            shm.close()
+            if os.name == "posix":
+                #
+                # The resource tracker may be shared with the worker processes, in which case a worker stopping
+                # tracking the block (see _run_handler) also stops the tracker knowing about it here - so register it
+                # again, as unlink unregisters it
+                #
+                resource_tracker.register(shm._name, "shared_memory")
+            shm.unlink()
+        with self.__condition:
+            self.__pending -= 1
+            self.__condition.notify_all()
+        self.__pending_semaphore.release()
+
+    def __finished(self, future, entry, ack_mode, shm):
+        try:
+            self.__completed(entry, ack_mode, future.exception())
+        finally:
+            self.__release(shm)
+
+    def __completed(self, entry, ack_mode, error):
+        """
+        Ack (or, if there was an error, nack) a message which has been handled.
+        """
+        try:
+            if error is not None:
+                logging.error("error handling message %s", entry[0].get(HDR_MESSAGE_ID), exc_info=error)
+            entry[1] = error is None
+            if ack_mode == "client-individual":
+                self.__acknowledge(entry[0], entry[1])
+            elif ack_mode == "client":
+                self.__acknowledge_completed(entry[0].get(HDR_SUBSCRIPTION))
+        except Exception:
+            logging.error("unable to acknowledge message %s", entry[0].get(HDR_MESSAGE_ID), exc_info=True)
+
+    def __acknowledge_completed(self, subscription):
+        """
+        With cumulative acknowledgement, ack the last of the messages which have finished, in order, and nack any
+        which failed.
+        """
+        with self.__condition:
+            unacked = self.__unacked.get(subscription)
+            completed = []
+            while unacked and unacked[0][1] is not None:
+                completed.append(unacked.popleft())
+        last_ok = None
+        for (headers, ok) in completed:
+            if ok:
+                last_ok = headers
+                continue
+            if last_ok is not None:
+                self.__acknowledge(last_ok, True)
+                last_ok = None
+            self.__acknowledge(headers, False)
+        if last_ok is not None:
+            self.__acknowledge(last_ok, True)
+
+    def __acknowledge(self, headers, ok):
+        connection = self.connection
+        if connection.version == "1.0":
+            if ok:
+                connection.ack(headers[HDR_MESSAGE_ID])
+            return
+        if connection.version == "1.1":
+            args = (headers[HDR_MESSAGE_ID], headers[HDR_SUBSCRIPTION])
+        else:
+            args = (headers[HDR_ACK],)
+        if ok:
+            connection.ack(*args)
+        else:
+            connection.nack(*args)
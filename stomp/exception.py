@@ -34,3 +34,13 @@ class InterruptedException(StompException):
     """
     Raised by receive when data read is interrupted.
     """
+
+
+class ErrorFrameException(StompException):
+    """
+    Set on a receipt's Future when the server responds with an ERROR frame, rather than the receipt.
+    The ERROR frame is available as the `frame` attribute.
+    """
+    def __init__(self, frame):
+        StompException.__init__(self, frame.headers.get("message", frame.body))
+        self.frame = frame
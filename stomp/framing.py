@@ -0,0 +1,350 @@
+"""Incremental decoding of the STOMP byte stream into frames, and encoding of frames for transmission.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from stomp.constants import *
+from stomp import logging
+from stomp.utils import convert_frame, encode, is_eol_default, ENC_NEWLINE, ENC_NULL
+
+##
+# Used to find the end of the preamble (or the end of a frame which has no preamble terminator), whichever comes
+# first. As of STOMP 1.2, lines can end with either line feed, or carriage return plus line feed.
+#
+PREAMBLE_OR_NULL_RE = re.compile(b"\n\n|\r\n\r\n|\x00")
+
+##
+# Used to parse the STOMP "content-length" header lines
+#
+CONTENT_LENGTH_RE = re.compile(b"^content-length[:]\\s*(?P<value>[0-9]+)", re.MULTILINE)
+
+#
+# The longest match of PREAMBLE_OR_NULL_RE is 4 bytes, so a resumed search has to step back by (at most) 3 bytes in
+# case the terminator was split across two reads.
+#
+_PREAMBLE_OVERLAP = 3
+
+
+class FrameDecoder(object):
+    """
+    A resumable decoder which turns chunks of data read from the network into (raw) STOMP frames.
+
+    Received data is appended to a single bytearray, which is consumed using a read offset (and only compacted once
+    per call to :py:meth:`decode`), so that large frames arriving in many small reads aren't copied over and over
+    again. The decoder remembers how far it has already scanned, parses the preamble of each frame once, and, if the
+    frame has a content-length header, takes exactly that many bytes as the body without searching them for NUL.
+
+    :param function is_eol_fc: function used to check whether data is an end-of-line (used to skip the optional
+        EOLs between frames)
+    """
+
+    def __init__(self, is_eol_fc=is_eol_default):
+        self.__is_eol = is_eol_fc
+        self.__buf = bytearray()
+        self.reset()
+
+    def reset(self):
+        """
+        Discard any buffered (partially received) data.
+        """
+        del self.__buf[:]
+        # start of the current frame
+        self.__start = 0
+        # position to resume scanning from
+        self.__scan = 0
+        # start of the current frame's body (None until the end of the preamble has been found)
+        self.__body_start = None
+        # value of the current frame's content-length header (None if not present)
+        self.__content_length = None
+
+    def __len__(self):
+        """
+        The number of buffered bytes which haven't yet been returned as part of a frame.
+
+        :rtype: int
+        """
+        return len(self.__buf) - self.__start
+
+    def bytes_needed(self):
+        """
+        The number of bytes still required to complete the current frame, if known (that is, once the preamble of a
+        frame with a content-length header has been received), otherwise 0.
+
+        :rtype: int
+        """
+        if self.__content_length is None:
+            return 0
+        return max(0, self.__body_start + self.__content_length + 1 - len(self.__buf))
+
+    def feed(self, data):
+        """
+        Append data received from the network.
+
+        :param bytes data: the data received (any bytes-like object)
+        """
+        self.__buf += data
+
+    def decode(self):
+        """
+        Return the complete frames found in the buffered data. The frames do not include the terminating NUL byte.
+
+        :rtype: list(bytes)
+        """
+        buf = self.__buf
+        result = []
+        while True:
+            if self.__body_start is None:
+                if self.__scan == self.__start:
+                    self.__skip_eols()
+                mat = PREAMBLE_OR_NULL_RE.search(buf, max(self.__start, self.__scan - _PREAMBLE_OVERLAP))
+                if not mat:
+                    self.__scan = len(buf)
+                    break
+                if mat.group() == b"\x00":
+                    #
+                    # Frame without a preamble terminator (e.g. "FOO\x00")
+                    #
+                    result.append(self.__take(mat.start(), mat.end()))
+                    continue
+                content_length_match = CONTENT_LENGTH_RE.search(buf, self.__start, mat.start())
+                if content_length_match:
+                    self.__content_length = int(content_length_match.group("value"))
+                self.__body_start = mat.end()
+                self.__scan = self.__body_start
+
+            if self.__content_length is not None:
+                end = self.__body_start + self.__content_length
+                if end >= len(buf):
+                    #
+                    # Haven't read enough data yet, wait for more to arrive
+                    #
+                    break
+                if buf[end] == 0:
+                    result.append(self.__take(end, end + 1))
+                    continue
+                #
+                # Content-length doesn't line up with a NUL, so fall back to searching for the end of the frame
+                #
+                self.__content_length = None
+                self.__scan = end
+
+            pos = buf.find(b"\x00", self.__scan)
+            if pos < 0:
+                self.__scan = len(buf)
+                break
+            result.append(self.__take(pos, pos + 1))
+
+        self.__compact()
+        return result
+
+    def __take(self, end, next_start):
+        """
+        Extract the current frame (ending at `end`) and reset the state for the next frame, which starts at
+        `next_start`.
+        """
+        frame = bytes(memoryview(self.__buf)[self.__start:end])
+        self.__start = next_start
+        self.__scan = next_start
+        self.__body_start = None
+        self.__content_length = None
+        #
+        # Ignore optional EOLs at end of frame
+        #
+        self.__skip_eols()
+        return frame
+
+    def __skip_eols(self):
+        buf = self.__buf
+        pos = self.__start
+        while True:
+            if self.__is_eol(buf[pos:pos + 1]):
+                pos += 1
+            elif self.__is_eol(buf[pos:pos + 2]):
+                pos += 2
+            else:
+                break
+        self.__start = pos
+        self.__scan = pos
+
+    def __compact(self):
+        """
+        Drop the data which has already been consumed.
+        """
+        start = self.__start
+        if start == 0:
+            return
+        del self.__buf[:start]
+        self.__start = 0
+        self.__scan -= start
+        if self.__body_start is not None:
+            self.__body_start -= start
+
+
+##
+# Headers which are expected to have a different value in every frame, and so aren't part of the cached header block
+#
+DEFAULT_VARYING_HEADERS = frozenset([HDR_CONTENT_LENGTH, HDR_RECEIPT, HDR_TRANSACTION])
+
+
+class FrameEncoder(object):
+    """
+    Converts frames to the list of byte strings to transmit, producing exactly the same output as
+    :py:func:`stomp.utils.convert_frame`.
+
+    For the commands in `cached_commands` (by default only SEND), the encoded header block is cached (least recently
+    used entries are evicted first) using the command, the destination and the other headers as the key - apart from
+    the `varying_headers`, which are the only ones encoded for every frame. So producers sending to a limited set of
+    destinations, with the same headers each time, only pay for encoding the content-length (plus any receipt or
+    transaction) per message.
+
+    Any other header which is set to a different value for each message (such as a correlation-id or timestamp)
+    should be added to `varying_headers`, otherwise every frame is a cache miss. If the hit rate over
+    `probe_frames` frames is below `min_hit_rate`, the cache is bypassed (frames are converted as by convert_frame)
+    for the next `bypass_frames` frames, so that a poor hit rate doesn't cost more than not caching at all.
+
+    :param int cache_size: the maximum number of cached header blocks
+    :param varying_headers: names of the headers which change from one frame to the next
+    :param bool sort_headers: if True (the default) headers are written sorted by name, as by convert_frame. If
+        deterministic header order isn't needed, set to False to skip sorting
+    :param cached_commands: the commands of the frames whose header blocks are cached
+    :param float min_hit_rate: the hit rate below which the cache is bypassed
+    """
+    probe_frames = 256
+    bypass_frames = 4096
+
+    def __init__(self, cache_size=64, varying_headers=DEFAULT_VARYING_HEADERS, sort_headers=True,
+                 cached_commands=(CMD_SEND,), min_hit_rate=0.5):
+        self.cache_size = cache_size
+        self.sort_headers = sort_headers
+        self.min_hit_rate = min_hit_rate
+        self.__varying_headers = frozenset(varying_headers)
+        self.__cached_commands = frozenset(cached_commands)
+        self.__templates = OrderedDict()
+        self.__templates_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # number of frames converted without the cache, because the hit rate was too low
+        self.cache_bypassed = 0
+        self.__probed = 0
+        self.__probe_hits = 0
+        self.__bypass = 0
+
+    def encode(self, frame):
+        """
+        Convert a frame to a list of byte strings (which, joined together, are the frame as sent on the wire).
+
+        :param Frame frame: the Frame object to convert
+
+        :rtype: list(bytes)
+        """
+        if frame.cmd not in self.__cached_commands or self.cache_size <= 0:
+            return convert_frame(frame, self.sort_headers)
+        if self.__bypass > 0:
+            self.__bypass -= 1
+            self.cache_bypassed += 1
+            return convert_frame(frame, self.sort_headers)
+
+        headers = frame.headers
+        body = None
+        if frame.body:
+            body = encode(frame.body)
+
+            if HDR_CONTENT_LENGTH in headers and headers[HDR_CONTENT_LENGTH] != len(body):
+                frame.set_header(HDR_CONTENT_LENGTH, len(body))
+
+        #
+        # The key is the command, the other headers (names and values as written), and the names of the varying
+        # headers which are set. Values which aren't strings are formatted, since values which are equal can still
+        # be written differently (for example, 1 and True)
+        #
+        varying_headers = self.__varying_headers
+        static = []
+        varying = []
+        for item in headers.items():
+            if item[0] in varying_headers:
+                if item[1] is not None:
+                    varying.append(item[0])
+            elif type(item[1]) is str or item[1] is None:
+                static.append(item)
+            elif type(item[1]) == tuple:
+                static.append((item[0], tuple(["%s" % val for val in item[1]])))
+            else:
+                static.append((item[0], "%s" % (item[1],)))
+        key = (frame.cmd, tuple(static), tuple(varying))
+
+        templates = self.__templates
+        template = templates.get(key)
+
+        if template is None:
+            template = self.__compile(frame.cmd, headers, varying)
+            with self.__templates_lock:
+                self.cache_misses += 1
+                templates[key] = template
+                if len(templates) > self.cache_size:
+                    templates.popitem(last=False)
+        else:
+            self.cache_hits += 1
+            self.__probe_hits += 1
+            try:
+                templates.move_to_end(key)
+            except KeyError:
+                # evicted by another thread in the meantime
+                pass
+        self.__probed += 1
+        if self.__probed >= self.probe_frames:
+            if self.__probe_hits < self.__probed * self.min_hit_rate:
+                logging.debug("header cache hit rate %d/%d, bypassing the cache", self.__probe_hits, self.__probed)
+                self.__bypass = self.bypass_frames
+            self.__probed = self.__probe_hits = 0
+
+        (prefix, slots) = template
+        lines = [prefix]
+        for (name, suffix) in slots:
+            vals = headers[name]
+            if type(vals) != tuple:
+                vals = (vals,)
+            for val in vals:
+                lines.append(("%s:%s\n" % (name, val)).encode("utf-8", errors="replace"))
+            lines.append(suffix)
+        if body:
+            lines.append(body)
+        lines.append(ENC_NULL)
+        return lines
+
+    def __compile(self, cmd, headers, varying):
+        """
+        Build the template for a header block: the encoded header lines up to the first varying header, followed by
+        (name, encoded lines up to the next varying header) for each of the varying headers.
+        """
+        if self.sort_headers:
+            names = sorted(headers)
+        else:
+            names = [name for name in headers if name not in varying] + varying
+        prefix = None
+        slots = []
+        slot_name = None
+        pieces = [encode(cmd), ENC_NEWLINE]
+        for name in names:
+            if name in varying:
+                if prefix is None:
+                    prefix = b"".join(pieces)
+                else:
+                    slots.append((slot_name, b"".join(pieces)))
+                slot_name = name
+                pieces = []
+                continue
+            vals = headers[name]
+            if vals is None or name in self.__varying_headers:
+                continue
+            if type(vals) != tuple:
+                vals = (vals,)
+            for val in vals:
+                pieces.append(encode("%s:%s\n" % (name, val)))
+        pieces.append(ENC_NEWLINE)
+        if prefix is None:
+            prefix = b"".join(pieces)
+        else:
+            slots.append((slot_name, b"".join(pieces)))
+        return prefix, tuple(slots)
@@ -0,0 +1,189 @@
+"""Choosing which broker to connect to, based on how the brokers have been behaving.
+
+By default a transport tries its hosts in the order given (with local hosts first), and every reconnect attempt
+tries them all again - including any which have just failed. With a host selector, the transport records how long
+each host takes to connect (and to return receipts), and how often connecting fails. Hosts which fail repeatedly are
+skipped for a while (their "circuit breaker" is open), and the rest are tried in order of health::
+
+    conn = stomp.Connection12(brokers, host_selector=stomp.hosts.host_selector)
+
+The selector can (and usually should) be shared by all the connections in the process, so that once one connection
+has found that a broker is down, the others don't try it as well.
+"""
+
+import threading
+from time import monotonic
+
+from stomp import logging
+
+
+class _HostState(object):
+    """
+    What's known about a host.
+    """
+
+    def __init__(self):
+        # number of failed connection attempts since the last successful one
+        self.failures = 0
+        self.total_failures = 0
+        self.connects = 0
+        # smoothed connect time and receipt round trip time, in seconds (None until measured)
+        self.connect_latency = None
+        self.receipt_rtt = None
+        # the time until which the circuit breaker is open
+        self.open_until = 0.0
+        # once the breaker's cooldown is over, one connection attempt is let through at a time, until this time
+        self.trial_until = 0.0
+
+    def score(self):
+        return (self.connect_latency or 0.0) + (self.receipt_rtt or 0.0)
+
+
+class HostSelector(object):
+    """
+    Keeps track of the health of each host, and decides which hosts to try connecting to, and in which order.
+
+    After `failure_threshold` consecutive failures to connect to a host, its circuit breaker opens and it's skipped
+    for `cooldown` seconds. Once the cooldown is over, a single attempt is allowed (the breaker is "half open") -
+    if it succeeds the breaker closes again, otherwise it stays open for another cooldown period.
+
+    Hosts which are available are ordered by the number of recent failures, then by their (smoothed) connect time
+    plus receipt round trip time. Hosts with the same health keep their original order, so hosts which haven't been
+    measured yet keep the transport's preference (for example, for local hosts).
+
+    :param int failure_threshold: the number of consecutive failures which opens a host's circuit breaker
+    :param float cooldown: how long (in seconds) a host is skipped for once its circuit breaker opens
+    :param float smoothing: the weight given to each new measurement of connect time and receipt round trip time
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=30.0, smoothing=0.2):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.__hosts = {}
+        self.__lock = threading.Lock()
+
+    def order(self, host_and_ports):
+        """
+        Return the hosts which should be tried, in order of preference (leaving out any whose circuit breaker is
+        open).
+
+        :param list((str,int)) host_and_ports: the hosts
+
+        :rtype: list((str,int))
+        """
+        now = monotonic()
+        available = []
+        with self.__lock:
+            for (index, host_and_port) in enumerate(host_and_ports):
+                state = self.__hosts.get(tuple(host_and_port))
+                if state is None:
+                    available.append((0, 0.0, index, host_and_port))
+                    continue
+                if state.failures >= self.failure_threshold:
+                    if state.open_until > now or state.trial_until > now:
+                        continue
+                    state.trial_until = now + self.cooldown
+                available.append((state.failures, state.score(), index, host_and_port))
+        available.sort()
+        return [host_and_port for (_, _, _, host_and_port) in available]
+
+    def is_available(self, host_and_port):
+        """
+        :param (str,int) host_and_port: the host
+
+        :return: False if the host's circuit breaker is open
+        :rtype: bool
+        """
+        with self.__lock:
+            state = self.__hosts.get(tuple(host_and_port))
+            return state is None or state.failures < self.failure_threshold or state.open_until <= monotonic()
+
+    def record_connect(self, host_and_port, latency):
+        """
+        Record a successful connection to a host (which closes its circuit breaker).
+
+        :param (str,int) host_and_port: the host
+        :param float latency: how long connecting took, in seconds
+        """
+        with self.__lock:
+            state = self.__state(host_and_port)
+            if state.failures >= self.failure_threshold:
+                logging.info("circuit breaker for %s closed", host_and_port)
+            state.failures = 0
+            state.open_until = state.trial_until = 0.0
+            state.connects += 1
+            state.connect_latency = self.__smooth(state.connect_latency, latency)
+
+    def record_failure(self, host_and_port):
+        """
+        Record a failed attempt to connect to a host.
+
+        :param (str,int) host_and_port: the host
+        """
+        with self.__lock:
+            state = self.__state(host_and_port)
+            state.failures += 1
+            state.total_failures += 1
+            if state.failures >= self.failure_threshold:
+                if state.failures == self.failure_threshold:
+                    logging.info("circuit breaker for %s opened", host_and_port)
+                state.open_until = monotonic() + self.cooldown
+                state.trial_until = 0.0
+
+    def record_rtt(self, host_and_port, rtt):
+        """
+        Record the round trip time of a receipt from a host.
+
+        :param (str,int) host_and_port: the host
+        :param float rtt: the time between sending a frame and receiving its receipt, in seconds
+        """
+        with self.__lock:
+            state = self.__state(host_and_port)
+            state.receipt_rtt = self.__smooth(state.receipt_rtt, rtt)
+
+    def get_state(self, host_and_port):
+        """
+        Return what's known about a host.
+
+        :param (str,int) host_and_port: the host
+
+        :return: the number of consecutive and total failures, successful connections, smoothed connect latency
+            and receipt round trip time (or None, if not measured), and whether the circuit breaker is open
+        :rtype: dict
+        """
+        with self.__lock:
+            state = self.__hosts.get(tuple(host_and_port)) or _HostState()
+            return {
+                "failures": state.failures,
+                "total_failures": state.total_failures,
+                "connects": state.connects,
+                "connect_latency": state.connect_latency,
+                "receipt_rtt": state.receipt_rtt,
+                "open": state.failures >= self.failure_threshold and state.open_until > monotonic(),
+            }
+
+    def reset(self):
+        """
+        Forget everything known about the hosts.
+        """
+        with self.__lock:
+            self.__hosts.clear()
+
+    def __state(self, host_and_port):
+        key = tuple(host_and_port)
+        state = self.__hosts.get(key)
+        if state is None:
+            state = self.__hosts[key] = _HostState()
+        return state
+
+    def __smooth(self, current, measurement):
+        if current is None:
+            return measurement
+        return current + self.smoothing * (measurement - current)
+
+
+##
+# The host selector shared by the connections in the process.
+#
+host_selector = HostSelector()
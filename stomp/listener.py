@@ -1,8 +1,12 @@
 """Various listeners for using with stomp.py connections.
 """
 
+import heapq
+import math
 import sys
 import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import time
 from time import monotonic
 
@@ -50,6 +54,9 @@ class ConnectionListener(object):
     This class should be used as a base class for objects registered
     using Connection.set_listener().
     """
+    # set by the listeners which are part of the connection itself (rather than application code), so that their
+    # on_message is always called on the receiver thread, even when messages are handed to a dispatcher
+    internal = False
 
     def on_connecting(self, host_and_port):
         """
@@ -138,6 +145,16 @@ class ConnectionListener(object):
         """
         pass
 
+    def on_send_error(self, frame, error):
+        """
+        Called when a frame which was queued to be sent (see :py:class:`stomp.transport.CoalescingWriter`) couldn't
+        be sent, because the write failed or the connection was closed first.
+
+        :param Frame frame: the stomp frame
+        :param Exception error: the reason the frame wasn't sent
+        """
+        pass
+
     def on_heartbeat(self):
         """
         Called on receipt of a heartbeat.
@@ -151,26 +168,151 @@ class ConnectionListener(object):
         pass
 
 
+class HeartbeatScheduler(object):
+    """
+    Runs timed tasks for any number of connections from a single thread, using a heap of due times - so that a
+    process with hundreds of connections doesn't need a heartbeat thread for each one.
+
+    A task is a function which is called (with no arguments) when it is due, and returns the (monotonic) time it
+    should next be called, or None if it's finished. Tasks only decide what needs doing, since they all run on the
+    same thread - anything which may block (such as writing to a socket) should be handed to :py:meth:`submit`, so
+    that one slow connection can't hold up the heartbeats of the others. The thread (and the worker threads) are
+    started when needed, and end once there are no tasks left.
+
+    :param int max_workers: the maximum number of worker threads used to run the functions passed to submit
+    """
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.scheduler_thread = None
+        self.__executor = None
+        self.__heap = []
+        # sequence number of the current heap entry for each task (older entries for a task are skipped)
+        self.__scheduled = {}
+        self.__sequence = 0
+        self.__condition = threading.Condition()
+
+    def schedule(self, task, due):
+        """
+        Schedule a task (replacing any existing schedule for the same task).
+
+        :param function task: the task to run
+        :param float due: when to run it (a time.monotonic() value)
+        """
+        with self.__condition:
+            self.__push(task, due)
+            if self.scheduler_thread is None:
+                self.scheduler_thread = utils.default_create_thread(self.__scheduler_loop)
+                self.scheduler_thread.name = "StompHeartbeat%s" % getattr(self.scheduler_thread, "name", "Thread")
+            self.__condition.notify_all()
+
+    def submit(self, func):
+        """
+        Run a function on one of the scheduler's worker threads.
+
+        :param function func: the function to run (with no arguments)
+
+        :rtype: concurrent.futures.Future
+        """
+        with self.__condition:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="StompHeartbeatWorker")
+            return self.__executor.submit(func)
+
+    def cancel(self, task):
+        """
+        Stop running a task.
+
+        :param function task: the task to cancel
+        """
+        with self.__condition:
+            if self.__scheduled.pop(task, None) is not None:
+                self.__condition.notify_all()
+
+    def __len__(self):
+        """
+        The number of scheduled tasks.
+
+        :rtype: int
+        """
+        return len(self.__scheduled)
+
+    def __push(self, task, due):
+        self.__sequence += 1
+        self.__scheduled[task] = self.__sequence
+        heapq.heappush(self.__heap, (due, self.__sequence, task))
+
+    def __scheduler_loop(self):
+        logging.debug("starting heartbeat scheduler loop (%s)", threading.current_thread())
+        while True:
+            with self.__condition:
+                while True:
+                    if not self.__scheduled:
+                        del self.__heap[:]
+                        self.scheduler_thread = None
+                        if self.__executor is not None:
+                            # anything already submitted still runs
+                            self.__executor.shutdown(False)
+                            self.__executor = None
+                        logging.debug("heartbeat scheduler loop ended")
+                        return
+                    (due, sequence, task) = self.__heap[0]
+                    if self.__scheduled.get(task) != sequence:
+                        # cancelled or rescheduled
+                        heapq.heappop(self.__heap)
+                        continue
+                    delay = due - monotonic()
+                    if delay <= 0:
+                        heapq.heappop(self.__heap)
+                        break
+                    self.__condition.wait(delay)
+            try:
+                next_due = task()
+            except Exception:
+                logging.warning("error running heartbeat task", exc_info=True)
+                next_due = None
+            with self.__condition:
+                if self.__scheduled.get(task) == sequence:
+                    if next_due is None:
+                        del self.__scheduled[task]
+                    else:
+                        self.__push(task, next_due)
+
+
+##
+# The scheduler shared by the heartbeats of all connections in the process
+#
+heartbeat_scheduler = HeartbeatScheduler()
+
+
 class HeartbeatListener(ConnectionListener):
     """
-    Listener used to handle STOMP heartbeating.
+    Listener used to handle STOMP heartbeating. Heartbeats are sent, and received heartbeats are checked, by a
+    :py:class:`HeartbeatScheduler` (by default, one shared by all connections).
     """
-    def __init__(self, transport, heartbeats, heart_beat_receive_scale=1.5):
+    internal = True
+
+    def __init__(self, transport, heartbeats, heart_beat_receive_scale=1.5, scheduler=None):
         self.running = False
         self.transport = transport
         self.heartbeats = heartbeats
         self.received_heartbeat = None
+        # the thread running the heartbeats (the scheduler's thread) while they're scheduled
         self.heartbeat_thread = None
         self.next_outbound_heartbeat = None
         self.heart_beat_receive_scale = heart_beat_receive_scale
-        self.heartbeat_terminate_event = threading.Event()
+        self.heartbeat_scheduler = scheduler if scheduler is not None else heartbeat_scheduler
         self.disconnecting = False
+        self.send_sleep = 0
+        self.receive_sleep = 0
+        self.__heartbeat_task = self.__heartbeat
+        # the heartbeat being sent by the scheduler's workers, if any
+        self.__sending = None
 
     def on_connected(self, frame):
         """
         Once the connection is established, and 'heart-beat' is found in the headers, we calculate the real
         heartbeat numbers (based on what the server sent and what was specified by the client) - if the heartbeats
-        are not 0, we start up the heartbeat loop accordingly.
+        are not 0, the heartbeats are scheduled accordingly.
 
         :param Frame frame: the stomp frame
         """
@@ -188,19 +330,21 @@ class HeartbeatListener(ConnectionListener):
 
                 logging.debug("set receive_sleep to %s, send_sleep to %s", self.receive_sleep, self.send_sleep)
 
+                now = monotonic()
                 # Give grace of receiving the first heartbeat
-                self.received_heartbeat = monotonic() + self.receive_sleep
+                self.received_heartbeat = now + self.receive_sleep
+                if self.send_sleep != 0:
+                    self.next_outbound_heartbeat = now + self.send_sleep
+                    logging.debug("calculated next outbound heartbeat as %s", self.next_outbound_heartbeat)
 
                 self.running = True
-                if self.heartbeat_thread is None:
-                    self.heartbeat_thread = utils.default_create_thread(
-                        self.__heartbeat_loop)
-                    self.heartbeat_thread.name = "StompHeartbeat%s" % \
-                        getattr(self.heartbeat_thread, "name", "Thread")
+                self.heartbeat_scheduler.schedule(self.__heartbeat_task, self.__next_due(now))
+                self.heartbeat_thread = self.heartbeat_scheduler.scheduler_thread
 
     def on_disconnected(self):
         self.running = False
-        self.heartbeat_terminate_event.set()
+        self.heartbeat_scheduler.cancel(self.__heartbeat_task)
+        self.heartbeat_thread = None
 
     def on_disconnecting(self):
         self.disconnecting = True
@@ -240,7 +384,7 @@ class HeartbeatListener(ConnectionListener):
         :param Frame frame: the Frame object
         """
         if frame.cmd in [CMD_CONNECT, CMD_STOMP] and self.heartbeats != (0, 0):
-            frame.headers[HDR_HEARTBEAT] = "%s,%s" % self.heartbeats
+            frame.set_header(HDR_HEARTBEAT, "%s,%s" % self.heartbeats)
         if self.next_outbound_heartbeat is not None:
             self.next_outbound_heartbeat = monotonic() + self.send_sleep
 
@@ -252,67 +396,545 @@ class HeartbeatListener(ConnectionListener):
         if now > self.received_heartbeat:
             self.received_heartbeat = now
 
-    def __heartbeat_loop(self):
+    def __next_due(self, now):
+        """
+        The next time a heartbeat has to be sent, or the received heartbeats have to be checked.
+        """
+        next_events = []
+        if self.send_sleep != 0 and self.next_outbound_heartbeat is not None:
+            next_events.append(self.next_outbound_heartbeat)
+        if self.receive_sleep != 0:
+            next_events.append(self.received_heartbeat + self.receive_sleep)
+        if not next_events:
+            return None
+        return max(now, min(next_events))
+
+    def __heartbeat(self):
         """
-        Main loop for sending (and monitoring received) heartbeats.
+        Send a heartbeat and check for received heartbeats, as required (run by the heartbeat scheduler).
+
+        :return: when to run again, or None to stop
         """
-        logging.debug("starting heartbeat loop")
+        if not self.running:
+            return None
         now = monotonic()
 
-        # Setup the initial due time for the outbound heartbeat
-        if self.send_sleep != 0:
+        if not self.transport.is_connected() or self.disconnecting:
+            return now + (self.send_sleep or self.receive_sleep)
+
+        if self.send_sleep != 0 and now >= self.next_outbound_heartbeat:
+            if self.__sending is None or self.__sending.done():
+                logging.debug("sending a heartbeat message at %s", now)
+                self.__sending = self.heartbeat_scheduler.submit(self.__send_heartbeat)
+            else:
+                # the socket isn't keeping up, so there's no point queueing another
+                logging.debug("previous heartbeat still being sent, skipping the heartbeat at %s", now)
             self.next_outbound_heartbeat = now + self.send_sleep
-            logging.debug("calculated next outbound heartbeat as %s", self.next_outbound_heartbeat)
-
-        while self.running:
-            now = monotonic()
-
-            next_events = []
-            if self.next_outbound_heartbeat is not None:
-                next_events.append(self.next_outbound_heartbeat - now)
-            if self.receive_sleep != 0:
-                t = self.received_heartbeat + self.receive_sleep - now
-                if t > 0:
-                    next_events.append(t)
-            sleep_time = min(next_events) if next_events else 0
-            if sleep_time > 0:
-                terminate = self.heartbeat_terminate_event.wait(sleep_time)
-                if terminate:
-                    break
 
-            now = monotonic()
+        if self.receive_sleep != 0:
+            if self.transport.receive_paused:
+                # deliberately not reading from the socket (see MessageQueue), so nothing is being received
+                self.received_heartbeat = now
+            diff_receive = now - self.received_heartbeat
+
+            if diff_receive > self.receive_sleep:
+                # heartbeat timeout
+                logging.warning("heartbeat timeout: diff_receive=%s, time=%s, lastrec=%s",
+                                diff_receive, now, self.received_heartbeat)
+                self.heartbeat_scheduler.submit(self.__timed_out)
+                # the heartbeats are scheduled again on reconnecting
+                return None
+
+        return self.__next_due(now)
+
+    def __send_heartbeat(self):
+        try:
+            self.transport.transmit(utils.Frame(None, {}, None))
+        except exception.NotConnectedException:
+            logging.debug("lost connection, unable to send heartbeat")
+        except Exception:
+            _, e, _ = sys.exc_info()
+            logging.debug("unable to send heartbeat, due to: %s", e)
+
+    def __timed_out(self):
+        self.transport.set_connected(False)
+        self.transport.disconnect_socket()
+        self.transport.stop()
+        for listener in self.transport.listeners.values():
+            listener.on_heartbeat_timeout()
+
+
+class SubscriptionRouter(ConnectionListener):
+    """
+    A listener which passes each message to the handler registered for its subscription (found using the
+    'subscription' header), rather than every listener having to check whether the message is meant for it.
 
-            if not self.transport.is_connected() or self.disconnecting:
-                time.sleep(self.send_sleep)
-                continue
+    Normally created by passing a callback to the connection's subscribe method, in which case the handler is
+    removed when the connection unsubscribes. If used directly, call :py:meth:`remove_handler` when unsubscribing.
+
+    :param function default_handler: called (with the frame) for messages whose subscription has no handler
+    """
+    def __init__(self, default_handler=None):
+        self.default_handler = default_handler
+        self.__handlers = {}
+        # subscription id -> destination, for the handlers added with a destination
+        self.__destinations = {}
+
+    def add_handler(self, subscription_id, handler, destination=None):
+        """
+        :param str subscription_id: the id of the subscription
+        :param function handler: called with the frame of each message received on the subscription
+        :param str destination: the destination subscribed to (so that the handler can be removed by destination)
+        """
+        subscription_id = str(subscription_id)
+        self.__handlers[subscription_id] = handler
+        if destination is not None:
+            self.__destinations[subscription_id] = destination
+
+    def remove_handler(self, subscription_id):
+        """
+        :param str subscription_id: the id of the subscription
+        """
+        subscription_id = str(subscription_id)
+        self.__handlers.pop(subscription_id, None)
+        self.__destinations.pop(subscription_id, None)
+
+    def remove_destination(self, destination):
+        """
+        Remove the handlers of the subscriptions to a destination (for STOMP 1.0, where a subscription can be
+        unsubscribed by destination).
+
+        :param str destination: the destination
+        """
+        for (subscription_id, subscribed) in list(self.__destinations.items()):
+            if subscribed == destination:
+                self.remove_handler(subscription_id)
+
+    def get_handler(self, subscription_id):
+        """
+        :param str subscription_id: the id of the subscription
+
+        :rtype: function
+        """
+        return self.__handlers.get(str(subscription_id))
+
+    def on_message(self, frame):
+        """
+        :param Frame frame: the stomp frame
+        """
+        handler = self.__handlers.get(frame.headers.get(HDR_SUBSCRIPTION), self.default_handler)
+        if handler is not None:
+            handler(frame)
 
-            if self.send_sleep != 0 and now > self.next_outbound_heartbeat:
-                logging.debug("sending a heartbeat message at %s", now)
-                try:
-                    self.transport.transmit(utils.Frame(None, {}, None))
-                except exception.NotConnectedException:
-                    logging.debug("lost connection, unable to send heartbeat")
-                except Exception:
-                    _, e, _ = sys.exc_info()
-                    logging.debug("unable to send heartbeat, due to: %s", e)
-
-            if self.receive_sleep != 0:
-                diff_receive = now - self.received_heartbeat
-
-                if diff_receive > self.receive_sleep:
-                    # heartbeat timeout
-                    logging.warning("heartbeat timeout: diff_receive=%s, time=%s, lastrec=%s",
-                                    diff_receive, now, self.received_heartbeat)
-                    self.transport.set_connected(False)
-                    self.transport.disconnect_socket()
-                    self.transport.stop()
-                    for listener in self.transport.listeners.values():
-                        listener.on_heartbeat_timeout()
-        self.heartbeat_thread = None
-        self.heartbeat_terminate_event.clear()
-        if self.heartbeats != (0, 0):
-            # don't bother logging this if heartbeats weren't setup to start with
-            logging.debug("heartbeat loop ended")
+
+class MessageQueue(ConnectionListener):
+    """
+    A bounded queue of received messages, for consumers which pull messages (see
+    :py:meth:`stomp.connect.BaseConnection.receive`) rather than having them pushed to a listener.
+
+    When the queue is full, the receiver thread waits for the consumer to catch up, and so stops reading from the
+    socket - leaving TCP flow control to push back on the server, rather than buffering an unlimited number of
+    messages in memory. While it is waiting the transport is marked as `receive_paused`, so that heartbeat timeouts
+    aren't raised for data which is just not being read yet.
+
+    Metrics are available in `stats`: the number of messages queued and taken from the queue, the maximum depth,
+    how often (and for how long in total) reading was paused, and the total and maximum time spent by messages in
+    the queue (in seconds).
+
+    :param transport: the transport the messages are received on
+    :param int maxsize: the maximum number of queued messages (0 means no limit)
+    """
+    internal = True
+
+    def __init__(self, transport, maxsize=1000):
+        self.transport = transport
+        self.maxsize = maxsize
+        self.stats = {
+            "queued": 0,
+            "received": 0,
+            "max_depth": 0,
+            "pauses": 0,
+            "paused_time": 0.0,
+            "queue_time": 0.0,
+            "max_queue_time": 0.0,
+        }
+        self.__queue = deque()
+        self.__condition = threading.Condition()
+        self.__closed = False
+        self.__disconnecting = False
+
+    def __len__(self):
+        """
+        The number of messages waiting in the queue.
+
+        :rtype: int
+        """
+        return len(self.__queue)
+
+    def __iter__(self):
+        """
+        Iterate over the received messages, until the connection is disconnected (and the queue is empty).
+        """
+        while True:
+            frame = self.get()
+            if frame is None:
+                return
+            yield frame
+
+    def get(self, timeout=None):
+        """
+        Take the next message from the queue, waiting for one to arrive if necessary.
+
+        :param float timeout: how long to wait, in seconds (None to wait until a message is received or the
+            connection is disconnected)
+
+        :return: the message, or None if the timeout expired or the connection has been disconnected
+        :rtype: Frame
+        """
+        with self.__condition:
+            if not self.__queue:
+                if timeout is not None:
+                    end = monotonic() + timeout
+                while not self.__queue and not self.__closed:
+                    if timeout is None:
+                        self.__condition.wait()
+                        continue
+                    remaining = end - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+                if not self.__queue:
+                    return None
+            (frame, queued) = self.__queue.popleft()
+            self.__condition.notify_all()
+            queue_time = monotonic() - queued
+            self.stats["received"] += 1
+            self.stats["queue_time"] += queue_time
+            if queue_time > self.stats["max_queue_time"]:
+                self.stats["max_queue_time"] = queue_time
+            return frame
+
+    def on_connected(self, frame):
+        with self.__condition:
+            self.__closed = False
+            self.__disconnecting = False
+
+    def on_disconnected(self):
+        """
+        Wake up any consumers waiting for a message (messages still in the queue can be taken afterwards).
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    def on_send(self, frame):
+        """
+        Stop holding up the receiver thread when disconnecting, otherwise the receipt for the disconnect can't be
+        read.
+
+        :param Frame frame: the stomp frame
+        """
+        if frame.cmd == CMD_DISCONNECT:
+            with self.__condition:
+                self.__disconnecting = True
+                self.__condition.notify_all()
+
+    def on_message(self, frame):
+        """
+        Add the message to the queue, waiting (in the receiver thread) if the queue is full.
+
+        :param Frame frame: the stomp frame
+        """
+        with self.__condition:
+            if self.maxsize > 0 and len(self.__queue) >= self.maxsize:
+                self.__wait_for_space()
+            self.__queue.append((frame, monotonic()))
+            self.stats["queued"] += 1
+            if len(self.__queue) > self.stats["max_depth"]:
+                self.stats["max_depth"] = len(self.__queue)
+            self.__condition.notify_all()
+
+    def __wait_for_space(self):
+        self.stats["pauses"] += 1
+        start = monotonic()
+        self.transport.receive_paused = True
+        try:
+            while len(self.__queue) >= self.maxsize and not self.__disconnecting and self.transport.running:
+                # wake up now and then, in case the transport is stopped
+                self.__condition.wait(1.0)
+        finally:
+            self.transport.receive_paused = False
+            self.stats["paused_time"] += monotonic() - start
+
+
+##
+# The header used to set the number of unacknowledged messages the broker will send to a subscription, by the
+# product name found in the 'server' header of the CONNECTED frame (checked in order). The Artemis window is a number
+# of bytes, rather than messages.
+#
+PREFETCH_HEADERS = (
+    ("ActiveMQ-Artemis", "consumer-window-size"),
+    ("ActiveMQ", "activemq.prefetchSize"),
+    ("RabbitMQ", "prefetch-count"),
+)
+
+##
+# Headers whose value is a window size in bytes (rather than a number of messages)
+#
+BYTE_WINDOW_HEADERS = frozenset(["consumer-window-size"])
+
+
+class FlowControlListener(ConnectionListener):
+    """
+    Sets the broker's prefetch header on subscriptions using client (or client-individual) acknowledgement, so that
+    each subscription is sent roughly as many messages as its handler gets through in `target_delay` seconds, rather
+    than a broker default of hundreds or thousands (which piles messages up in one slow consumer while others sit
+    idle).
+
+    The header is chosen using the 'server' header of the CONNECTED frame (see PREFETCH_HEADERS), unless
+    `prefetch_header` is specified. The rate at which each subscription's messages are acknowledged is measured, and
+    the window is recalculated after each acknowledgement. Headers set explicitly in subscribe are left alone.
+
+    Brokers only read the prefetch header when subscribing, so the adjusted window is also applied as messages are
+    received: once a subscription has more unacknowledged messages than its window, the receiver thread waits (for
+    up to `hold_timeout` seconds) for some of them to be acknowledged before the message is delivered. The wait is
+    limited so that handlers which only acknowledge after receiving further messages can't deadlock. If `transport`
+    is given, it's marked as `receive_paused` while waiting (see :py:class:`MessageQueue`).
+
+    Metrics are available in `stats`: the number of times delivery was held up, and the total time (in seconds).
+
+    :param int initial_window: the window used before the handler's rate has been measured
+    :param int min_window: the smallest window used
+    :param int max_window: the largest window used
+    :param float target_delay: how much work (in seconds) to have buffered for each subscription
+    :param str prefetch_header: the header to set (if not specified, chosen based on the server)
+    :param float smoothing: the weight given to each new rate measurement (between 0 and 1)
+    :param float hold_timeout: the longest the receiver thread waits for acknowledgements once a subscription's
+        window is exhausted (0 to never wait)
+    :param transport: the transport the messages are received on
+    """
+    internal = True
+
+    def __init__(self, initial_window=10, min_window=1, max_window=1000, target_delay=0.5, prefetch_header=None,
+                 smoothing=0.2, hold_timeout=1.0, transport=None):
+        self.initial_window = initial_window
+        self.min_window = min_window
+        self.max_window = max_window
+        self.target_delay = target_delay
+        self.prefetch_header = prefetch_header
+        self.smoothing = smoothing
+        self.hold_timeout = hold_timeout
+        self.transport = transport
+        self.server_prefetch_header = None
+        self.stats = {
+            "holds": 0,
+            "held_time": 0.0,
+        }
+        self.__subscriptions = {}
+        # maps the ack id of each unacknowledged message to its subscription id
+        self.__unacked = {}
+        # whether the headers of sent frames are escaped (for STOMP 1.1 and later), unlike those received
+        self.__escaped = False
+        self.__disconnecting = False
+        self.__condition = threading.Condition()
+
+    def get_prefetch_header(self):
+        """
+        :return: the header used to set the prefetch window, or None if the server isn't known
+        :rtype: str
+        """
+        return self.prefetch_header or self.server_prefetch_header
+
+    def window(self, subscription_id):
+        """
+        The window (number of messages) currently calculated for a subscription.
+
+        :param str subscription_id: the id of the subscription
+
+        :rtype: int
+        """
+        with self.__condition:
+            state = self.__subscriptions.get(str(subscription_id))
+            return state.window if state is not None else self.initial_window
+
+    def outstanding(self, subscription_id=None):
+        """
+        The number of messages received but not yet acknowledged.
+
+        :param str subscription_id: the id of the subscription (if not specified, the total for all subscriptions)
+
+        :rtype: int
+        """
+        with self.__condition:
+            if subscription_id is None:
+                return len(self.__unacked)
+            state = self.__subscriptions.get(str(subscription_id))
+            return len(state.unacked) if state is not None else 0
+
+    def on_connected(self, frame):
+        """
+        Choose the prefetch header for the server.
+
+        :param Frame frame: the stomp frame
+        """
+        server = frame.headers.get("server", "")
+        self.__escaped = frame.headers.get("version", "1.0") != "1.0"
+        self.__disconnecting = False
+        self.server_prefetch_header = None
+        for (product, header) in PREFETCH_HEADERS:
+            if server.startswith(product):
+                self.server_prefetch_header = header
+                break
+        else:
+            logging.debug("no prefetch header known for server %r", server)
+
+    def on_disconnected(self):
+        """
+        Unacknowledged messages will be redelivered by the broker, so stop tracking them.
+        """
+        with self.__condition:
+            self.__unacked.clear()
+            for state in self.__subscriptions.values():
+                state.unacked.clear()
+                state.last_ack = None
+            self.__condition.notify_all()
+
+    def on_message(self, frame):
+        """
+        Keep track of the message, waiting (in the receiver thread) if the subscription's window is exhausted.
+
+        :param Frame frame: the stomp frame
+        """
+        headers = frame.headers
+        ack_id = headers.get(HDR_ACK) or headers.get(HDR_MESSAGE_ID)
+        with self.__condition:
+            state = self.__subscriptions.get(headers.get(HDR_SUBSCRIPTION))
+            if state is None or ack_id is None:
+                return
+            state.unacked[ack_id] = True
+            self.__unacked[ack_id] = state
+            body = frame.raw_body
+            if body:
+                state.message_size += self.smoothing * (len(body) - state.message_size)
+            if self.hold_timeout > 0 and len(state.unacked) > state.window:
+                self.__hold(state)
+
+    def on_send(self, frame):
+        """
+        Set the prefetch header on subscribe, and measure the rate of acknowledgements.
+
+        :param Frame frame: the stomp frame
+        """
+        cmd = frame.cmd
+        headers = frame.headers
+        if cmd == CMD_SUBSCRIBE:
+            self.__subscribe(frame)
+        elif cmd == CMD_ACK or cmd == CMD_NACK:
+            self.__acknowledged(self.__unescape(headers.get(HDR_ID) or headers.get(HDR_MESSAGE_ID)))
+        elif cmd == CMD_UNSUBSCRIBE:
+            with self.__condition:
+                state = self.__subscriptions.pop(str(self.__unescape(headers.get(HDR_ID))), None)
+                if state is not None:
+                    for ack_id in state.unacked:
+                        self.__unacked.pop(ack_id, None)
+                    state.unacked.clear()
+                    self.__condition.notify_all()
+        elif cmd == CMD_DISCONNECT:
+            # stop holding up the receiver thread, otherwise the receipt for the disconnect can't be read
+            with self.__condition:
+                self.__disconnecting = True
+                self.__condition.notify_all()
+
+    def __unescape(self, value):
+        if self.__escaped and isinstance(value, str) and "\\" in value:
+            return utils.unescape_header(value)
+        return value
+
+    def __hold(self, state):
+        self.stats["holds"] += 1
+        start = monotonic()
+        end = start + self.hold_timeout
+        if self.transport is not None:
+            self.transport.receive_paused = True
+        try:
+            while len(state.unacked) > state.window and not self.__disconnecting:
+                remaining = end - monotonic()
+                if remaining <= 0:
+                    logging.debug("flow control window still exhausted after %s seconds", self.hold_timeout)
+                    break
+                self.__condition.wait(remaining)
+        finally:
+            if self.transport is not None:
+                self.transport.receive_paused = False
+            self.stats["held_time"] += monotonic() - start
+
+    def __subscribe(self, frame):
+        headers = frame.headers
+        ack = headers.get(HDR_ACK, "auto")
+        subscription_id = self.__unescape(headers.get(HDR_ID, headers.get(HDR_DESTINATION)))
+        if ack == "auto" or subscription_id is None:
+            return
+        with self.__condition:
+            state = self.__subscriptions.get(str(subscription_id))
+            if state is None:
+                state = self.__subscriptions[str(subscription_id)] = _FlowState(ack, self.initial_window)
+            state.cumulative = ack == "client"
+            header = self.get_prefetch_header()
+            if header is None or header in headers:
+                return
+            if header in BYTE_WINDOW_HEADERS:
+                frame.set_header(header, int(state.window * max(state.message_size, 1)))
+            else:
+                frame.set_header(header, state.window)
+
+    def __acknowledged(self, ack_id):
+        now = monotonic()
+        with self.__condition:
+            state = self.__unacked.get(ack_id)
+            if state is None:
+                return
+            if state.cumulative:
+                # acknowledges all messages received on the subscription up to this one
+                acked = []
+                for received_id in state.unacked:
+                    acked.append(received_id)
+                    if received_id == ack_id:
+                        break
+            else:
+                acked = [ack_id]
+            for received_id in acked:
+                del state.unacked[received_id]
+                del self.__unacked[received_id]
+
+            if state.last_ack is not None:
+                interval = (now - state.last_ack) / len(acked)
+                if state.interval is None:
+                    state.interval = interval
+                else:
+                    state.interval += self.smoothing * (interval - state.interval)
+                if state.interval > 0:
+                    window = int(math.ceil(self.target_delay / state.interval))
+                else:
+                    window = self.max_window
+                state.window = max(self.min_window, min(self.max_window, window))
+            state.last_ack = now
+            self.__condition.notify_all()
+
+
+class _FlowState(object):
+    """
+    The flow control state of a subscription.
+    """
+    def __init__(self, ack, window):
+        self.cumulative = ack == "client"
+        self.window = window
+        # unacknowledged message ids, in the order received
+        self.unacked = OrderedDict()
+        self.last_ack = None
+        # average time between acknowledgements
+        self.interval = None
+        # average message size
+        self.message_size = 1024.0
 
 
 class WaitingListener(ConnectionListener):
@@ -512,6 +1134,13 @@ class PrintingListener(ConnectionListener):
         """
         self.__print("on_send %s %s %s", frame.cmd, utils.clean_headers(frame.headers), frame.body)
 
+    def on_send_error(self, frame, error):
+        """
+        :param Frame frame: the stomp frame
+        :param Exception error: the reason the frame wasn't sent
+        """
+        self.__print("on_send_error %s %s %r", frame.cmd, utils.clean_headers(frame.headers), error)
+
     def on_heartbeat(self):
         self.__print("on_heartbeat")
 
@@ -1,11 +1,121 @@
 """Provides the 1.0, 1.1 and 1.2 protocol classes.
 """
 
+import threading
+
 from stomp.exception import ConnectFailedException
 from stomp.listener import *
 
+##
+# The name of the listener used to route messages to the callbacks passed to subscribe
+#
+SUBSCRIPTION_ROUTER_NAME = "subscription-router"
+
 
-class Protocol10(ConnectionListener):
+class BaseProtocol(object):
+    """
+    The behaviour shared by all versions of the protocol, built on the `send_frame` and `send_frames` methods of
+    the protocol classes.
+    """
+
+    def __init__(self):
+        # held while adding the SubscriptionRouter, so that two threads subscribing at once can't both add one
+        self.__router_lock = threading.Lock()
+
+    def send_many(self, messages, transactional=False, receipt=None):
+        """
+        Send a batch of messages. The frames are encoded together and written to the server in as few writes as
+        possible (rather than one at a time, as when calling `send` in a loop).
+
+        :param messages: the messages to send, as (destination, body, headers) tuples - headers can be None
+        :param bool transactional: if True, wrap the batch in a transaction (BEGIN, the messages, then COMMIT)
+        :param str receipt: a receipt to request once the batch has been processed by the server - this is added
+            to the COMMIT if the batch is transactional, otherwise to the last message
+
+        :return: the transaction id, if the batch is transactional
+        :rtype: str
+        """
+        frames = []
+        for (destination, body, headers) in messages:
+            assert destination is not None, "'destination' is required"
+            assert body is not None, "'body' is required"
+            headers = dict(headers) if headers else {}
+            headers[HDR_DESTINATION] = destination
+            if self.auto_content_length and body and HDR_CONTENT_LENGTH not in headers:
+                headers[HDR_CONTENT_LENGTH] = len(body)
+            frames.append((CMD_SEND, headers, body))
+
+        transaction = None
+        if transactional:
+            transaction = utils.get_uuid()
+            for (_, headers, _) in frames:
+                headers[HDR_TRANSACTION] = transaction
+            frames.insert(0, (CMD_BEGIN, {HDR_TRANSACTION: transaction}, ""))
+            frames.append((CMD_COMMIT, {HDR_TRANSACTION: transaction}, ""))
+        if receipt and frames:
+            frames[-1][1][HDR_RECEIPT] = receipt
+        self.send_frames(frames)
+        return transaction
+
+    def _send_with_receipt(self, cmd, headers, body, sync):
+        """
+        Send a frame with a generated receipt id, returning a Future for the receipt.
+
+        :rtype: concurrent.futures.Future
+        """
+        receipt = utils.get_uuid()
+        headers[HDR_RECEIPT] = receipt
+        future = self.transport.expect_receipt(receipt)
+        try:
+            self.send_frame(cmd, headers, body, sync)
+        except Exception:
+            self.transport.cancel_receipt(receipt)
+            raise
+        return future
+
+    def _send_ack(self, cmd, headers):
+        """
+        Send an ACK or NACK frame - or, if there's an ack batcher (see :py:class:`stomp.connect.AckBatcher`), add
+        the acknowledgement to the current batch. Acknowledgements which can't be batched are sent after any batched
+        ones, to keep them in order.
+
+        :param str cmd: the command (ACK or NACK)
+        :param dict headers: the headers of the frame
+        """
+        batcher = self.ack_batcher
+        if batcher is not None:
+            if cmd == CMD_ACK and HDR_TRANSACTION not in headers and HDR_RECEIPT not in headers \
+                    and batcher.add(headers):
+                return
+            batcher.flush_acks()
+        self.send_frame(cmd, headers)
+
+    def _add_subscription_handler(self, id, callback, destination=None):
+        """
+        Register a callback for a subscription with the connection's SubscriptionRouter (adding one, if necessary).
+        """
+        with self.__router_lock:
+            router = self.transport.get_listener(SUBSCRIPTION_ROUTER_NAME)
+            if router is None:
+                router = SubscriptionRouter()
+                self.transport.set_listener(SUBSCRIPTION_ROUTER_NAME, router)
+        router.add_handler(id, callback, destination)
+
+    def _remove_subscription_handler(self, id=None, destination=None):
+        """
+        Remove the callback for a subscription (by id, or else all those for the destination) from the
+        connection's SubscriptionRouter. Called with the headers as passed to unsubscribe, before they're escaped.
+        """
+        router = self.transport.get_listener(SUBSCRIPTION_ROUTER_NAME)
+        if router is None:
+            return
+        if id is not None:
+            router.remove_handler(id)
+        elif destination is not None:
+            router.remove_destination(destination)
+
+
+class Protocol10(BaseProtocol, ConnectionListener):
     """
     Represents version 1.0 of the protocol (see https://stomp.github.io/stomp-specification-1.0.html).
 
@@ -16,12 +126,14 @@ class Protocol10(ConnectionListener):
     automatically if it has not been set
     """
     def __init__(self, transport, auto_content_length=True):
+        BaseProtocol.__init__(self)
         self.transport = transport
         self.auto_content_length = auto_content_length
         transport.set_listener("protocol-listener", self)
         self.version = "1.0"
+        self.ack_batcher = None
 
-    def send_frame(self, cmd, headers=None, body=""):
+    def send_frame(self, cmd, headers=None, body="", sync=False):
         """
         Encode and send a stomp frame
         through the underlying transport.
@@ -29,9 +141,18 @@ class Protocol10(ConnectionListener):
         :param str cmd: the protocol command
         :param dict headers: a map of headers to include in the frame
         :param body: the content of the message
+        :param bool sync: if writes are being coalesced, send the frame immediately rather than queueing it
         """
         frame = utils.Frame(cmd, headers, body)
-        self.transport.transmit(frame)
+        self.transport.transmit(frame, sync)
+
+    def send_frames(self, frames):
+        """
+        Encode a list of stomp frames, and send them together through the underlying transport.
+
+        :param list((str,dict,body)) frames: the frames to send, as (command, headers, body) tuples
+        """
+        self.transport.transmit_many([utils.Frame(cmd, headers, body) for (cmd, headers, body) in frames])
 
     def abort(self, transaction, headers=None, **keyword_headers):
         """
@@ -60,7 +181,7 @@ class Protocol10(ConnectionListener):
             headers[HDR_TRANSACTION] = transaction
         if receipt:
             headers[HDR_RECEIPT] = receipt
-        self.send_frame(CMD_ACK, headers)
+        self._send_ack(CMD_ACK, headers)
 
     def begin(self, transaction=None, headers=None, **keyword_headers):
         """
@@ -140,7 +261,7 @@ class Protocol10(ConnectionListener):
         self.set_receipt(rec, CMD_DISCONNECT)
         self.send_frame(CMD_DISCONNECT, headers)
 
-    def send(self, destination, body, content_type=None, headers=None, **keyword_headers):
+    def send(self, destination, body, content_type=None, headers=None, *, send_immediately=False, **keyword_headers):
         """
         Send a message to a destination.
 
@@ -148,7 +269,14 @@ class Protocol10(ConnectionListener):
         :param body: the content of the message
         :param str content_type: the content type of the message
         :param dict headers: a map of any additional headers the broker requires
-        :param keyword_headers: any additional headers the broker requires
+        :param bool send_immediately: if writes are being coalesced, send the message immediately rather than
+            queueing it
+        :param keyword_headers: any additional headers the broker requires. Pass receipt=True to have a receipt
+            generated, and get a Future which is resolved when it arrives
+
+        :return: if receipt=True, a Future resolved with the RECEIPT frame (see
+            :py:meth:`stomp.transport.BaseTransport.expect_receipt`)
+        :rtype: concurrent.futures.Future
         """
         assert destination is not None, "'destination' is required"
         assert body is not None, "'body' is required"
@@ -158,9 +286,11 @@ class Protocol10(ConnectionListener):
             headers[HDR_CONTENT_TYPE] = content_type
         if self.auto_content_length and body and HDR_CONTENT_LENGTH not in headers:
             headers[HDR_CONTENT_LENGTH] = len(body)
-        self.send_frame(CMD_SEND, headers, body)
+        if headers.get(HDR_RECEIPT) is True:
+            return self._send_with_receipt(CMD_SEND, headers, body, send_immediately)
+        self.send_frame(CMD_SEND, headers, body, send_immediately)
 
-    def subscribe(self, destination, id=None, ack="auto", headers=None, **keyword_headers):
+    def subscribe(self, destination, id=None, ack="auto", headers=None, callback=None, **keyword_headers):
         """
         Subscribe to a destination.
 
@@ -170,11 +300,17 @@ class Protocol10(ConnectionListener):
             (see http://stomp.github.io/stomp-specification-1.2.html#SUBSCRIBE_ack_Header)
             for more information
         :param dict headers: a map of any additional headers the broker requires
+        :param function callback: if specified, called with the frame of each message received on this
+            subscription (see :py:class:`stomp.listener.SubscriptionRouter`). If no id is given, one is generated
         :param keyword_headers: any additional headers the broker requires
         """
         assert destination is not None, "'destination' is required"
         headers = utils.merge_headers([headers, keyword_headers])
         headers[HDR_DESTINATION] = destination
+        if callback is not None:
+            if not id:
+                id = utils.get_uuid()
+            self._add_subscription_handler(id, callback, destination)
         if id:
             headers[HDR_ID] = id
         headers[HDR_ACK] = ack
@@ -195,10 +331,11 @@ class Protocol10(ConnectionListener):
             headers[HDR_ID] = id
         if destination:
             headers[HDR_DESTINATION] = destination
+        self._remove_subscription_handler(id, destination)
         self.send_frame(CMD_UNSUBSCRIBE, headers)
 
 
-class Protocol11(HeartbeatListener, ConnectionListener):
+class Protocol11(BaseProtocol, HeartbeatListener, ConnectionListener):
     """
     Represents version 1.1 of the protocol (see https://stomp.github.io/stomp-specification-1.1.html).
 
@@ -212,14 +349,19 @@ class Protocol11(HeartbeatListener, ConnectionListener):
     as a scale factor of receive time
     """
     def __init__(self, transport, heartbeats=(0, 0), auto_content_length=True, heart_beat_receive_scale=1.5):
+        BaseProtocol.__init__(self)
         HeartbeatListener.__init__(self, transport, heartbeats, heart_beat_receive_scale)
         self.transport = transport
         self.auto_content_length = auto_content_length
         transport.set_listener("protocol-listener", self)
         self.version = "1.1"
+        self.ack_batcher = None
 
-    def _escape_headers(self, headers):
+    @staticmethod
+    def _escape_headers(headers):
         """
+        Escape the header values as required by STOMP 1.1.
+
         :param dict(str,str) headers:
         """
         for key, val in headers.items():
@@ -229,7 +371,7 @@ class Protocol11(HeartbeatListener, ConnectionListener):
                 pass
             headers[key] = val
 
-    def send_frame(self, cmd, headers=None, body=""):
+    def send_frame(self, cmd, headers=None, body="", sync=False):
         """
         Encode and send a stomp frame
         through the underlying transport:
@@ -237,13 +379,25 @@ class Protocol11(HeartbeatListener, ConnectionListener):
         :param str cmd: the protocol command
         :param dict headers: a map of headers to include in the frame
         :param body: the content of the message
+        :param bool sync: if writes are being coalesced, send the frame immediately rather than queueing it
         """
         if cmd not in [CMD_CONNECT, CMD_STOMP]:
             if headers is None:
                 headers = {}
             self._escape_headers(headers)
         frame = utils.Frame(cmd, headers, body)
-        self.transport.transmit(frame)
+        self.transport.transmit(frame, sync)
+
+    def send_frames(self, frames):
+        """
+        Encode a list of stomp frames, and send them together through the underlying transport.
+
+        :param list((str,dict,body)) frames: the frames to send, as (command, headers, body) tuples
+        """
+        for (cmd, headers, _) in frames:
+            if cmd not in [CMD_CONNECT, CMD_STOMP]:
+                self._escape_headers(headers)
+        self.transport.transmit_many([utils.Frame(cmd, headers, body) for (cmd, headers, body) in frames])
 
     def abort(self, transaction, headers=None, **keyword_headers):
         """
@@ -274,7 +428,7 @@ class Protocol11(HeartbeatListener, ConnectionListener):
             headers[HDR_TRANSACTION] = transaction
         if receipt:
             headers[HDR_RECEIPT] = receipt
-        self.send_frame(CMD_ACK, headers)
+        self._send_ack(CMD_ACK, headers)
 
     def begin(self, transaction=None, headers=None, **keyword_headers):
         """
@@ -377,9 +531,9 @@ class Protocol11(HeartbeatListener, ConnectionListener):
             headers[HDR_TRANSACTION] = transaction
         if receipt:
             headers[HDR_RECEIPT] = receipt
-        self.send_frame(CMD_NACK, headers)
+        self._send_ack(CMD_NACK, headers)
 
-    def send(self, destination, body, content_type=None, headers=None, **keyword_headers):
+    def send(self, destination, body, content_type=None, headers=None, *, send_immediately=False, **keyword_headers):
         """
         Send a message to a destination in the messaging system (as per
          https://stomp.github.io/stomp-specification-1.2.html#SEND)
@@ -389,7 +543,14 @@ class Protocol11(HeartbeatListener, ConnectionListener):
         :param body: the content of the message
         :param str content_type: the MIME type of message
         :param dict headers: additional headers to send in the message frame
-        :param keyword_headers: any additional headers the broker requires
+        :param bool send_immediately: if writes are being coalesced, send the message immediately rather than
+            queueing it
+        :param keyword_headers: any additional headers the broker requires. Pass receipt=True to have a receipt
+            generated, and get a Future which is resolved when it arrives
+
+        :return: if receipt=True, a Future resolved with the RECEIPT frame (see
+            :py:meth:`stomp.transport.BaseTransport.expect_receipt`)
+        :rtype: concurrent.futures.Future
         """
         assert destination is not None, "'destination' is required"
         assert body is not None, "'body' is required"
@@ -399,9 +560,11 @@ class Protocol11(HeartbeatListener, ConnectionListener):
             headers[HDR_CONTENT_TYPE] = content_type
         if self.auto_content_length and body and HDR_CONTENT_LENGTH not in headers:
             headers[HDR_CONTENT_LENGTH] = len(body)
-        self.send_frame(CMD_SEND, headers, body)
+        if headers.get(HDR_RECEIPT) is True:
+            return self._send_with_receipt(CMD_SEND, headers, body, send_immediately)
+        self.send_frame(CMD_SEND, headers, body, send_immediately)
 
-    def subscribe(self, destination, id, ack="auto", headers=None, **keyword_headers):
+    def subscribe(self, destination, id, ack="auto", headers=None, callback=None, **keyword_headers):
         """
         Subscribe to a destination
 
@@ -410,10 +573,14 @@ class Protocol11(HeartbeatListener, ConnectionListener):
         :param str ack: either auto, client or client-individual
         (see https://stomp.github.io/stomp-specification-1.2.html#SUBSCRIBE for more info)
         :param dict headers: a map of any additional headers to send with the subscription
+        :param function callback: if specified, called with the frame of each message received on this
+            subscription (see :py:class:`stomp.listener.SubscriptionRouter`)
         :param keyword_headers: any additional headers to send with the subscription
         """
         assert destination is not None, "'destination' is required"
         assert id is not None, "'id' is required"
+        if callback is not None:
+            self._add_subscription_handler(id, callback, destination)
         headers = utils.merge_headers([headers, keyword_headers])
         headers[HDR_DESTINATION] = destination
         headers[HDR_ID] = id
@@ -431,6 +598,7 @@ class Protocol11(HeartbeatListener, ConnectionListener):
         assert id is not None, "'id' is required"
         headers = utils.merge_headers([headers, keyword_headers])
         headers[HDR_ID] = id
+        self._remove_subscription_handler(id)
         self.send_frame(CMD_UNSUBSCRIBE, headers)
 
 
@@ -452,8 +620,11 @@ class Protocol12(Protocol11):
                             heart_beat_receive_scale=heart_beat_receive_scale)
         self.version = "1.2"
 
-    def _escape_headers(self, headers):
+    @staticmethod
+    def _escape_headers(headers):
         """
+        Escape the header values as required by STOMP 1.2 (which, unlike 1.1, also escapes carriage returns).
+
         :param dict(str,str) headers:
         """
         for key, val in headers.items():
@@ -477,7 +648,7 @@ class Protocol12(Protocol11):
             headers[HDR_TRANSACTION] = transaction
         if receipt:
             headers[HDR_RECEIPT] = receipt
-        self.send_frame(CMD_ACK, headers)
+        self._send_ack(CMD_ACK, headers)
 
     def nack(self, id, transaction=None, receipt=None, **keyword_headers):
         """
@@ -495,7 +666,7 @@ class Protocol12(Protocol11):
             headers[HDR_TRANSACTION] = transaction
         if receipt:
             headers[HDR_RECEIPT] = receipt
-        self.send_frame(CMD_NACK, headers)
+        self._send_ack(CMD_NACK, headers)
 
     def connect(self, username=None, passcode=None, wait=False, headers=None,
                 with_connect_command=False, **keyword_headers):
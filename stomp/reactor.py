@@ -0,0 +1,167 @@
+"""A reactor which reads from the sockets of many connections using a single thread.
+
+By default each connection starts its own receiver thread, which spends most of its time blocked reading from the
+socket. With a reactor, the sockets are put into non-blocking mode and watched using a selector (epoll on Linux,
+kqueue on BSD and macOS), and the reactor's thread reads whatever data is ready, decodes it and calls the listeners::
+
+    reactor = stomp.reactor.Reactor()
+    connections = [stomp.Connection12([(host, port)], reactor=reactor) for (host, port) in brokers]
+
+Because every connection's listeners are called on the reactor's thread, they should not block (slow message handling
+can be moved to other threads with a message dispatcher - see :py:mod:`stomp.dispatch`).
+"""
+
+import selectors
+import socket
+import threading
+
+from stomp import logging
+
+
+class Reactor(object):
+    """
+    Watches the sockets of the transports registered with it, and calls their `receive_ready` method when there
+    is data to read.
+
+    The reactor's thread is started when the first transport is registered, and ends once there are none left.
+    Sockets are only added to (and removed from) the selector by the reactor's thread, so registering and
+    unregistering can be done from any thread.
+
+    :param selector: the selector to use (by default, the most efficient one available on the platform)
+    """
+
+    def __init__(self, selector=None):
+        self.selector = selector if selector is not None else selectors.DefaultSelector()
+        self.reactor_thread = None
+        self.__transports = {}
+        self.__requests = []
+        self.__lock = threading.Lock()
+        #
+        # Used to wake up the reactor thread when there are requests waiting
+        #
+        (self.__wakeup_receiver, self.__wakeup_sender) = socket.socketpair()
+        self.__wakeup_receiver.setblocking(False)
+        self.__wakeup_sender.setblocking(False)
+        self.selector.register(self.__wakeup_receiver, selectors.EVENT_READ)
+
+    def __len__(self):
+        """
+        The number of transports being watched.
+
+        :rtype: int
+        """
+        return len(self.__transports)
+
+    def register(self, transport):
+        """
+        Start reading from a (connected) transport's socket.
+
+        :param stomp.transport.Transport transport: the transport
+        """
+        self.__request(self.__add, transport, transport.socket)
+
+    def unregister(self, transport):
+        """
+        Stop reading from a transport's socket (for example, because it's being disconnected). The transport's
+        `receiver_completed` method is called by the reactor's thread once the socket has been removed.
+
+        :param stomp.transport.Transport transport: the transport
+        """
+        self.__request(self.__remove, transport)
+
+    def __request(self, func, *args):
+        with self.__lock:
+            self.__requests.append((func, args))
+            if self.reactor_thread is None:
+                self.reactor_thread = self.__create_thread()
+                return
+        self.__wakeup()
+
+    def __create_thread(self):
+        thread = threading.Thread(None, self.__reactor_loop)
+        thread.daemon = True
+        thread.name = "StompReactor%s" % thread.name
+        thread.start()
+        return thread
+
+    def __wakeup(self):
+        try:
+            self.__wakeup_sender.send(b"\x00")
+        except (BlockingIOError, OSError):
+            # there's already a wake up waiting
+            pass
+
+    def __process_requests(self):
+        """
+        Carry out the registration requests. Returns False if the reactor has nothing left to do.
+        """
+        try:
+            while self.__wakeup_receiver.recv(1024):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        with self.__lock:
+            requests = self.__requests
+            self.__requests = []
+        for (func, args) in requests:
+            func(*args)
+        with self.__lock:
+            if not self.__transports and not self.__requests:
+                self.reactor_thread = None
+                return False
+        return True
+
+    def __add(self, transport, sock):
+        if sock is None or sock.fileno() < 0:
+            # closed before the reactor got to it
+            self.__completed(transport, sock)
+            return
+        self.__remove(transport)
+        self.selector.register(sock, selectors.EVENT_READ, transport)
+        self.__transports[transport] = sock
+
+    def __remove(self, transport):
+        sock = self.__transports.pop(transport, None)
+        if sock is None:
+            return
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        self.__completed(transport, sock)
+
+    def __completed(self, transport, sock):
+        try:
+            if sock is not None and transport.socket is sock:
+                transport.cleanup()
+            transport.receiver_completed()
+        except Exception:
+            logging.warning("error cleaning up after connection closed", exc_info=True)
+
+    def __reactor_loop(self):
+        logging.debug("starting reactor loop (%s)", threading.current_thread())
+        running = True
+        while running:
+            running = self.__process_requests()
+            if not running:
+                break
+            for (key, _) in self.selector.select():
+                transport = key.data
+                if transport is None:
+                    # woken up to process requests
+                    continue
+                if self.__transports.get(transport) is not key.fileobj:
+                    # removed while handling an earlier event
+                    continue
+                try:
+                    still_open = transport.receive_ready()
+                except Exception:
+                    #
+                    # As when the receiver thread fails, stop reading - the data left on the socket (if any) would
+                    # only fail again, or be read in the wrong place
+                    #
+                    logging.warning("error processing received data, closing the connection", exc_info=True)
+                    still_open = False
+                if not still_open:
+                    self.__remove(transport)
+        logging.debug("reactor loop ended")
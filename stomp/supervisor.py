@@ -0,0 +1,165 @@
+"""Automatic reconnection, restoring the connection's subscriptions.
+
+Normally, when the connection to the broker is lost (or a heartbeat times out) the transport stops, and it's up to
+the application to reconnect and subscribe again. With a supervisor, the connection is re-established automatically
+(using the transport's reconnect settings), and the CONNECT frame and all the active subscriptions are replayed in a
+single write, with a receipt requested on the last SUBSCRIBE - rather than waiting for each one in turn::
+
+    conn = stomp.Connection12([(host, port)], auto_reconnect=True)
+    conn.connect(username, passcode, wait=True)
+    conn.subscribe("/queue/test", id=1)
+
+The supervisor learns about the connection and the subscriptions from the frames being sent, so it doesn't need to
+be told about them.
+"""
+
+import threading
+import time
+
+from stomp.constants import *
+from stomp.exception import ConnectFailedException, ErrorFrameException
+from stomp.listener import ConnectionListener
+from stomp import logging
+from stomp import utils
+
+##
+# The name of the supervisor's listener.
+#
+SUPERVISOR_NAME = "reconnect-supervisor"
+
+
+class ReconnectSupervisor(ConnectionListener):
+    """
+    Reconnects a (STOMP 1.1 or 1.2) connection when it's lost, and replays its subscriptions. A recovery is
+    abandoned if the transport runs out of connection attempts, or the broker sends an ERROR frame in response.
+    Reconnection stops once the connection is disconnected by the client (or :py:meth:`close` is called).
+
+    :param stomp.connect.BaseConnection connection: the connection to supervise
+    :param float timeout: how long to wait for the broker to confirm the subscriptions, in seconds
+    :param int attempts: how many times to try to recover, if the connection is lost again while recovering
+    """
+
+    def __init__(self, connection, timeout=10.0, attempts=3):
+        self.connection = connection
+        self.transport = connection.transport
+        self.timeout = timeout
+        self.attempts = attempts
+        self.stats = {
+            # number of successful recoveries
+            "recoveries": 0,
+            # number of abandoned recoveries
+            "failures": 0,
+            # number of subscriptions replayed
+            "resubscribed": 0,
+            # how long the last successful recovery took, in seconds
+            "recovery_time": 0.0,
+        }
+        self.recovery_thread = None
+        self.__connect_frame = None
+        self.__subscriptions = {}
+        self.__closed = True
+        self.__lock = threading.Lock()
+        self.__receiver_completed = threading.Event()
+
+    def subscriptions(self):
+        """
+        The active subscriptions, as a map of subscription id to the headers of the SUBSCRIBE frame (including the
+        destination and ack mode).
+
+        :rtype: dict(str,dict)
+        """
+        with self.__lock:
+            return {id: dict(headers) for (id, headers) in self.__subscriptions.items()}
+
+    def close(self):
+        """
+        Stop reconnecting (for example, because the client is disconnecting).
+        """
+        with self.__lock:
+            self.__closed = True
+
+    def on_send(self, frame):
+        """
+        Record the CONNECT and SUBSCRIBE frames (and remove unsubscribed subscriptions).
+
+        :param Frame frame: the frame being sent
+        """
+        cmd = frame.cmd
+        if cmd in (CMD_CONNECT, CMD_STOMP):
+            with self.__lock:
+                self.__connect_frame = utils.Frame(cmd, dict(frame.headers), frame.body)
+                self.__closed = False
+        elif cmd == CMD_SUBSCRIBE:
+            headers = dict(frame.headers)
+            headers.pop(HDR_RECEIPT, None)
+            with self.__lock:
+                self.__subscriptions[headers.get(HDR_ID)] = headers
+        elif cmd == CMD_UNSUBSCRIBE:
+            with self.__lock:
+                self.__subscriptions.pop(frame.headers.get(HDR_ID), None)
+        elif cmd == CMD_DISCONNECT:
+            self.close()
+
+    def on_receiver_loop_completed(self, frame):
+        self.__receiver_completed.set()
+
+    def on_disconnected(self):
+        """
+        Start recovering the connection (unless the client disconnected, or a recovery is already in progress).
+        """
+        with self.__lock:
+            if self.__closed or self.__connect_frame is None or self.recovery_thread is not None:
+                return
+            self.recovery_thread = self.transport.create_thread_fc(self.__recover)
+
+    def __recover(self):
+        start = time.monotonic()
+        try:
+            for attempt in range(self.attempts):
+                with self.__lock:
+                    if self.__closed:
+                        return
+                    frames = [self.__connect_frame] + [utils.Frame(CMD_SUBSCRIBE, dict(headers))
+                                                       for headers in self.__subscriptions.values()]
+                try:
+                    self.__reconnect(frames)
+                except (ConnectFailedException, ErrorFrameException):
+                    logging.warning("unable to reconnect", exc_info=logging.verbose)
+                    break
+                except Exception:
+                    logging.debug("connection lost while reconnecting (attempt %d)", attempt + 1,
+                                  exc_info=logging.verbose)
+                    # make sure the receiver has finished with the socket, before connecting again
+                    self.transport.disconnect_socket()
+                    self.__receiver_completed.wait(self.timeout)
+                    continue
+                self.stats["recoveries"] += 1
+                self.stats["resubscribed"] += len(frames) - 1
+                self.stats["recovery_time"] = time.monotonic() - start
+                logging.info("reconnected to %s, with %d subscriptions", self.transport.current_host_and_port,
+                             len(frames) - 1)
+                return
+            self.stats["failures"] += 1
+            self.close()
+            self.transport.disconnect_socket()
+        finally:
+            with self.__lock:
+                self.recovery_thread = None
+
+    def __reconnect(self, frames):
+        """
+        Connect, and send the CONNECT and SUBSCRIBE frames together, waiting until the broker has processed them.
+        """
+        self.__receiver_completed.clear()
+        self.transport.start()
+        if len(frames) == 1:
+            self.transport.transmit_many(frames)
+            self.transport.wait_for_connection(self.timeout)
+            if self.transport.connection_error:
+                raise ConnectFailedException()
+            return
+        receipt = utils.get_uuid()
+        frames[-1].set_header(HDR_RECEIPT, receipt)
+        future = self.transport.expect_receipt(receipt)
+        self.transport.transmit_many(frames)
+        future.result(self.timeout)
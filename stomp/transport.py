@@ -3,11 +3,15 @@ from the actual STOMP protocol
 """
 
 import errno
+import hashlib
 import math
+import os
 import random
+import selectors
 import sys
 import time
-from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import Future
 from time import monotonic
 
 try:
@@ -32,13 +36,29 @@ except (ImportError, AttributeError):
         pass
     DEFAULT_SSL_VERSION = None
 
+##
+# Errors raised when writing to a non-blocking socket whose send buffer is full
+#
+if ssl:
+    WOULD_BLOCK_ERRORS = (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError)
+else:
+    WOULD_BLOCK_ERRORS = (BlockingIOError,)
+
 
 import stomp.exception as exception
 import stomp.listener
+from stomp.framing import FrameDecoder, FrameEncoder
 from stomp.utils import *
 from stomp import logging
 
 
+##
+# The (no-op) methods of ConnectionListener, which don't need to be called
+#
+NOOP_LISTENER_METHODS = dict((name, func) for (name, func) in vars(stomp.listener.ConnectionListener).items()
+                             if name.startswith("on_"))
+
+
 class BaseTransport(stomp.listener.Publisher):
     """
     Base class for transport classes providing support for listeners, threading overrides,
@@ -49,22 +69,40 @@ class BaseTransport(stomp.listener.Publisher):
         leaving them as bytes. This preserves the behaviour as of version 4.0.16.
         (To be defaulted to False as of the next release)
     :param encoding: the character encoding to use for the message body
-    """
 
-    #
-    # Used to parse the STOMP "content-length" header lines,
-    #
-    __content_length_re = re.compile(b"^content-length[:]\\s*(?P<value>[0-9]+)", re.MULTILINE)
+    Listeners should be added and removed using `set_listener` and `remove_listener` (rather than by changing
+    `listeners` directly), as these also update the table used to dispatch events to the listeners.
+
+    Outgoing frames are converted using `frame_encoder` (see :py:class:`stomp.framing.FrameEncoder`), which can be
+    replaced to change the header caching or ordering. If `writer` is set (see :py:class:`CoalescingWriter`), frames
+    are queued and written in batches rather than sent one at a time.
+    """
 
     def __init__(self, auto_decode=True, encoding="utf-8", is_eol_fc=is_eol_default):
-        self.__recvbuf = b""
+        self.__decoder = FrameDecoder(is_eol_fc)
+        self.frame_encoder = FrameEncoder()
+        self.writer = None
         self.listeners = {}
+        self.__dispatch = {}
+        # the on_message methods of the internal listeners, and of the rest (see set_message_dispatcher)
+        self.__inline_messages = ()
+        self.__dispatched_messages = ()
+        self.__message_dispatcher = None
+        # if set, the reactor which reads from the socket (see stomp.reactor.Reactor), instead of a receiver thread
+        self.reactor = None
+        # if set, records the health of the hosts (see stomp.hosts.HostSelector)
+        self.host_selector = None
         self.running = False
         self.blocking = None
         self.connected = False
         self.connection_error = False
         self.disconnecting = False
+        # set while the receiver thread is waiting for a consumer to catch up (see stomp.listener.MessageQueue)
+        self.receive_paused = False
         self.__receipts = {}
+        # the Future for each receipt being waited for, and when it was requested
+        self.__receipt_futures = {}
+        self.__receipt_futures_lock = threading.Lock()
         self.current_host_and_port = None
         self.bind_host_port = None
         # flag used when we receive the disconnect receipt
@@ -84,6 +122,19 @@ class BaseTransport(stomp.listener.Publisher):
         self.__encoding = encoding
         self.__is_eol = is_eol_fc
 
+    def set_message_dispatcher(self, dispatcher):
+        """
+        Hand MESSAGE frames to a dispatcher (see :py:class:`stomp.dispatch.ThreadPoolDispatcher`), which calls the
+        listeners' on_message methods, rather than calling them on the receiver thread. All other events are still
+        notified on the receiver thread, so (for example) a receipt may be notified before the messages received
+        ahead of it have been handled. The on_message methods of the connection's internal listeners (those with
+        `internal` set, such as the heartbeat and flow control listeners) are called on the receiver thread, before
+        the message is dispatched.
+
+        :param dispatcher: an object with a `dispatch(frame, handlers)` method, or None to stop using a dispatcher
+        """
+        self.__message_dispatcher = dispatcher
+
     def override_threading(self, create_thread_fc):
         """
         Override for thread creation. Use an alternate threading library by
@@ -107,8 +158,11 @@ class BaseTransport(stomp.listener.Publisher):
         """
         self.running = True
         self.attempt_connection()
-        self.receiver_thread = self.create_thread_fc(self.__receiver_loop)
-        logging.debug("created thread %s using func %s", self.receiver_thread, self.create_thread_fc)
+        if self.reactor is not None:
+            self.reactor.register(self)
+        else:
+            self.receiver_thread = self.create_thread_fc(self.__receiver_loop)
+            logging.debug("created thread %s using func %s", self.receiver_thread, self.create_thread_fc)
         self.notify("connecting")
 
     def stop(self):
@@ -142,6 +196,54 @@ class BaseTransport(stomp.listener.Publisher):
         elif receipt_id in self.__receipts:
             del self.__receipts[receipt_id]
 
+    def expect_receipt(self, receipt_id):
+        """
+        Track a receipt, returning a Future which is resolved (with the RECEIPT frame) when it arrives. The Future
+        fails with :py:class:`stomp.exception.ErrorFrameException` if the server sends an ERROR frame instead, or
+        :py:class:`stomp.exception.ConnectionClosedException` if the connection is lost first.
+
+        This must be called before the frame requesting the receipt is sent.
+
+        :param str receipt_id: the receipt to wait for
+
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self.__receipt_futures_lock:
+            self.__receipt_futures[receipt_id] = (future, monotonic())
+        return future
+
+    def cancel_receipt(self, receipt_id):
+        """
+        Stop tracking a receipt (for example, because the frame requesting it couldn't be sent).
+
+        :param str receipt_id: the receipt
+        """
+        with self.__receipt_futures_lock:
+            (future, _) = self.__receipt_futures.pop(receipt_id, (None, None))
+        if future is not None and not future.done():
+            future.set_exception(exception.NotConnectedException())
+
+    def __resolve_receipts(self, receipt_id, frame=None, error=None):
+        """
+        Resolve the Future for receipt_id, or (if receipt_id is None) fail all of them.
+        """
+        with self.__receipt_futures_lock:
+            if receipt_id is not None:
+                receipt = self.__receipt_futures.pop(receipt_id, None)
+                futures = [receipt] if receipt is not None else []
+            else:
+                futures = list(self.__receipt_futures.values())
+                self.__receipt_futures.clear()
+        if futures and frame is not None and self.host_selector is not None:
+            self.host_selector.record_rtt(self.current_host_and_port, monotonic() - futures[0][1])
+        for (future, _) in futures:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(frame)
+
     #
     # Manage objects listening to incoming frames
     #
@@ -157,6 +259,7 @@ class BaseTransport(stomp.listener.Publisher):
         assert listener is not None
         with self.__listeners_change_condition:
             self.listeners[name] = listener
+            self.__rebuild_dispatch()
 
     def remove_listener(self, name):
         """
@@ -166,6 +269,7 @@ class BaseTransport(stomp.listener.Publisher):
         """
         with self.__listeners_change_condition:
             del self.listeners[name]
+            self.__rebuild_dispatch()
 
     def get_listener(self, name):
         """
@@ -177,6 +281,32 @@ class BaseTransport(stomp.listener.Publisher):
         """
         return self.listeners.get(name)
 
+    def __rebuild_dispatch(self):
+        """
+        Rebuild the table of listener methods to call for each event type (in order of listener name). Methods which
+        a listener inherits unchanged from ConnectionListener do nothing, so they're left out. The table is replaced
+        rather than modified, so it can be read without holding the listeners lock.
+        """
+        dispatch = {}
+        inline_messages = []
+        dispatched_messages = []
+        for (_, listener) in sorted(self.listeners.items()):
+            for name in dir(listener):
+                if not name.startswith("on_"):
+                    continue
+                func = getattr(listener, name, None)
+                if not callable(func) or getattr(func, "__func__", None) is NOOP_LISTENER_METHODS.get(name):
+                    continue
+                dispatch.setdefault(name[3:], []).append(func)
+                if name == "on_message":
+                    if getattr(listener, "internal", False):
+                        inline_messages.append(func)
+                    else:
+                        dispatched_messages.append(func)
+        self.__dispatch = dict((frame_type, tuple(funcs)) for (frame_type, funcs) in dispatch.items())
+        self.__inline_messages = tuple(inline_messages)
+        self.__dispatched_messages = tuple(dispatched_messages)
+
     def process_frame(self, f, frame_str):
         """
         :param Frame f: Frame object
@@ -192,12 +322,13 @@ class BaseTransport(stomp.listener.Publisher):
         else:
             logging.warning("unknown response frame type: '%s' (frame length was %d)", frame_type, length(frame_str))
 
-    def notify(self, frame_type, frame=None):
+    def notify(self, frame_type, frame=None, error=None):
         """
         Utility function for notifying listeners of incoming and outgoing messages
 
         :param str frame_type: the type of message
         :param Frame frame: the stomp frame
+        :param Exception error: for "send_error", the reason the frame wasn't sent
         """
         if frame_type == "receipt":
             # logic for wait-on-receipt notification
@@ -205,7 +336,8 @@ class BaseTransport(stomp.listener.Publisher):
             receipt_value = self.__receipts.get(receipt)
             with self.__send_wait_condition:
                 self.set_receipt(receipt, None)
-                self.__send_wait_condition.notify()
+                self.__send_wait_condition.notify_all()
+            self.__resolve_receipts(receipt, frame)
 
             if receipt_value == CMD_DISCONNECT:
                 self.set_connected(False)
@@ -217,56 +349,101 @@ class BaseTransport(stomp.listener.Publisher):
         elif frame_type == "connected":
             self.set_connected(True)
 
+        elif frame_type == "error":
+            #
+            # The server may say which receipt the error relates to - if it doesn't, the connection is about to be
+            # closed anyway, so fail all of the outstanding receipts
+            #
+            self.__resolve_receipts(frame.headers.get(HDR_RECEIPT_ID), error=exception.ErrorFrameException(frame))
+
         elif frame_type == "disconnected":
             self.notified_on_disconnect = True
             self.set_connected(False)
+            self.__resolve_receipts(None, error=exception.ConnectionClosedException())
 
-        with self.__listeners_change_condition:
-            listeners = sorted(self.listeners.items())
+        if frame_type == "error" and not self.connected:
+            with self.__connect_wait_condition:
+                self.connection_error = True
+                self.__connect_wait_condition.notify()
 
-        for (_, listener) in listeners:
-            notify_func = getattr(listener, "on_%s" % frame_type, None)
-            if not notify_func:
-                logging.debug("listener %s has no method on_%s", listener, frame_type)
-                continue
-            if frame_type in ("heartbeat", "disconnected"):
+        notify_funcs = self.__dispatch.get(frame_type, ())
+        if frame_type == "message" and self.__message_dispatcher is not None:
+            for notify_func in self.__inline_messages:
+                notify_func(frame)
+            if self.__dispatched_messages:
+                self.__message_dispatcher.dispatch(frame, self.__dispatched_messages)
+        elif frame_type in ("heartbeat", "disconnected"):
+            for notify_func in notify_funcs:
                 notify_func()
-                continue
-            if frame_type == "connecting":
+        elif frame_type == "connecting":
+            for notify_func in notify_funcs:
                 notify_func(self.current_host_and_port)
-                continue
-
-            if frame_type == "error" and not self.connected:
-                with self.__connect_wait_condition:
-                    self.connection_error = True
-                    self.__connect_wait_condition.notify()
-
-            notify_func(frame)
+        elif frame_type == "send_error":
+            for notify_func in notify_funcs:
+                notify_func(frame, error)
+        else:
+            for notify_func in notify_funcs:
+                notify_func(frame)
 
-    def transmit(self, frame):
+    def transmit(self, frame, sync=False):
         """
         Convert a frame object to a frame string and transmit to the server.
 
         :param Frame frame: the Frame object to transmit
+        :param bool sync: if writes are being coalesced, send this frame (and anything queued before it)
+            immediately, rather than queueing it
         """
-        with self.__listeners_change_condition:
-            listeners = sorted(self.listeners.items())
+        lines = self.__encode(frame, self.__dispatch.get("send", ()))
 
-        for (_, listener) in listeners:
-            try:
-                listener.on_send(frame)
-            except AttributeError:
-                continue
+        if self.writer is not None:
+            self.writer.write(lines, sync or frame.cmd not in COALESCED_COMMANDS, frame)
+        else:
+            self.send_buffers(lines)
+
+    def transmit_many(self, frames):
+        """
+        Convert a list of frame objects and transmit them to the server together, using as few writes as possible.
+        The listeners' on_send method is still called for each frame (in order).
+
+        :param list(Frame) frames: the Frame objects to transmit
+        """
+        on_send_funcs = self.__dispatch.get("send", ())
+        lines = []
+        for frame in frames:
+            lines.extend(self.__encode(frame, on_send_funcs))
+        if not lines:
+            return
+
+        if self.writer is not None:
+            self.writer.write(lines, True)
+        else:
+            self.send_buffers(lines)
+
+    def __encode(self, frame, on_send_funcs):
+        """
+        Call the listeners' on_send method, then encode the frame.
+
+        :rtype: list(bytes)
+        """
+        for on_send in on_send_funcs:
+            on_send(frame)
 
         if frame.cmd == CMD_DISCONNECT and HDR_RECEIPT in frame.headers:
             self.__disconnect_receipt = frame.headers[HDR_RECEIPT]
 
-        lines = convert_frame(frame)
-        packed_frame = pack(lines)
+        lines = self.frame_encoder.encode(frame)
 
         if logging.isEnabledFor(logging.DEBUG):
             logging.debug("sending frame: %s", clean_lines(lines))
-        self.send(packed_frame)
+        return lines
+
+    def flush(self):
+        """
+        Write any frames queued for coalescing (see :py:class:`CoalescingWriter`) to the server, waiting until
+        they've been sent.
+        """
+        if self.writer is not None:
+            self.writer.flush()
 
     def send(self, encoded_frame):
         """
@@ -276,6 +453,16 @@ class BaseTransport(stomp.listener.Publisher):
         """
         pass
 
+    def send_buffers(self, buffers):
+        """
+        Send an encoded frame, as a list of buffers, over this transport. By default the buffers are joined together
+        and passed to `send`; subclasses which can write a list of buffers directly override this, to avoid copying
+        large bodies.
+
+        :param list buffers: the encoded frame, as a list of bytes-like objects
+        """
+        self.send(pack(buffers))
+
     def receive(self):
         """
         Receive a chunk of data (to be implemented in subclasses)
@@ -284,6 +471,24 @@ class BaseTransport(stomp.listener.Publisher):
         """
         pass
 
+    def receive_pending(self):
+        """
+        The number of bytes which have been received, but not yet read (for example, SSL data which has already been
+        decrypted), and so won't be signalled by a selector (to be implemented in subclasses).
+
+        :rtype: int
+        """
+        return 0
+
+    def receive_size_hint(self):
+        """
+        The number of bytes still required to complete the frame currently being received, if known (otherwise 0).
+        Subclasses can use this to size their reads.
+
+        :rtype: int
+        """
+        return self.__decoder.bytes_needed()
+
     def cleanup(self):
         """
         Cleanup the transport (to be implemented in subclasses)
@@ -323,45 +528,88 @@ class BaseTransport(stomp.listener.Publisher):
         Main loop listening for incoming data.
         """
         logging.debug("starting receiver loop (%s)", threading.current_thread())
-        notify_disconnected = True
         try:
             while self.running:
                 try:
                     while self.running:
-                        frames = self.__read()
-
-                        for frame in frames:
-                            if self.__is_eol(frame):
-                                f = HEARTBEAT_FRAME
-                            else:
-                                f = parse_frame(frame)
-                            if f is None:
-                                continue
-                            if self.__auto_decode:
-                                f.body = decode(f.body)
-                            self.process_frame(f, frame)
+                        self.__process_frames(self.__read())
                 except exception.ConnectionClosedException:
-                    if self.running:
-                        #
-                        # Clear out any half-received messages after losing connection
-                        #
-                        self.__recvbuf = b""
-                        self.running = False
-                        notify_disconnected = True
+                    self.__connection_closed()
                     break
                 finally:
                     self.cleanup()
         finally:
-            with self.__receiver_thread_exit_condition:
-                self.__receiver_thread_exited = True
-                self.__receiver_thread_exit_condition.notify_all()
-            logging.debug("receiver loop ended")
-            self.notify("receiver_loop_completed")
-            if notify_disconnected and not self.notified_on_disconnect:
-                self.notify("disconnected")
-            with self.__connect_wait_condition:
-                self.__connect_wait_condition.notify_all()
-            self.notified_on_disconnect = False
+            self.receiver_completed()
+
+    def receive_ready(self):
+        """
+        Read and process the data waiting on the socket, without blocking (the socket must be in non-blocking mode).
+        Used by :py:class:`stomp.reactor.Reactor` in place of the receiver thread.
+
+        :return: False if the connection has been closed (in which case :py:meth:`receiver_completed` should be
+            called once the socket is no longer being watched), otherwise True
+        :rtype: bool
+        """
+        if not self.running:
+            return False
+        while True:
+            try:
+                try:
+                    c = self.receive()
+                except exception.InterruptedException:
+                    # nothing to read after all
+                    return True
+            except Exception:
+                logging.debug("socket read error", exc_info=logging.verbose)
+                c = b""
+            if c is None or len(c) == 0:
+                logging.debug("nothing received, connection closed")
+                self.__connection_closed()
+                return False
+            self.__process_frames(self.__decode(c))
+            if not self.running:
+                return False
+            if not self.receive_pending():
+                return True
+
+    def receiver_completed(self):
+        """
+        Clean up once data is no longer being received (called when the receiver thread, or reading by the reactor,
+        finishes).
+        """
+        with self.__receiver_thread_exit_condition:
+            self.__receiver_thread_exited = True
+            self.__receiver_thread_exit_condition.notify_all()
+        logging.debug("receiver loop ended")
+        self.notify("receiver_loop_completed")
+        if not self.notified_on_disconnect:
+            self.notify("disconnected")
+        with self.__connect_wait_condition:
+            self.__connect_wait_condition.notify_all()
+        self.notified_on_disconnect = False
+
+    def __connection_closed(self):
+        if self.running:
+            #
+            # Clear out any half-received messages after losing connection
+            #
+            self.__decoder.reset()
+            self.running = False
+
+    def __process_frames(self, frames):
+        for frame in frames:
+            if not self.running:
+                #
+                # Stopped (for example, by a listener of an earlier frame), so the rest are ignored
+                #
+                break
+            if self.__is_eol(frame):
+                f = HEARTBEAT_FRAME
+            else:
+                f = parse_frame(frame, self.__encoding if self.__auto_decode else None)
+            if f is None:
+                continue
+            self.process_frame(f, frame)
 
     def __read(self):
         """
@@ -370,7 +618,6 @@ class BaseTransport(stomp.listener.Publisher):
         :return: list of frames read
         :rtype: list(bytes)
         """
-        fastbuf = BytesIO()
         while self.running:
             try:
                 try:
@@ -384,67 +631,546 @@ class BaseTransport(stomp.listener.Publisher):
             if c is None or len(c) == 0:
                 logging.debug("nothing received, raising ConnectionClosedException")
                 raise exception.ConnectionClosedException()
-            if self.__is_eol(c) and not self.__recvbuf and not fastbuf.tell():
-                #
-                # EOL to an empty receive buffer: treat as heartbeat.
-                # Note that this may misdetect an optional EOL at end of frame as heartbeat in case the
-                # previous receive() got a complete frame whose NUL at end of frame happened to be the
-                # last byte of that read. But that should be harmless in practice.
-                #
-                fastbuf.close()
-                return [c]
-            fastbuf.write(c)
-            if b"\x00" in c:
-                #
-                # Possible end of frame
-                #
+            frames = self.__decode(c)
+            if frames:
+                return frames
+        return []
+
+    def __decode(self, c):
+        """
+        Add received data to the decoder, and return the complete frames.
+
+        :param bytes c: the data received
+
+        :rtype: list(bytes)
+        """
+        if self.__is_eol(c) and not len(self.__decoder):
+            #
+            # EOL to an empty receive buffer: treat as heartbeat.
+            # Note that this may misdetect an optional EOL at end of frame as heartbeat in case the
+            # previous receive() got a complete frame whose NUL at end of frame happened to be the
+            # last byte of that read. But that should be harmless in practice.
+            #
+            return [bytes(c)]
+        self.__decoder.feed(c)
+        return self.__decoder.decode()
+
+
+##
+# Buffers smaller than this are joined together before being written, rather than passed to sendmsg individually
+#
+GATHER_THRESHOLD = 16384
+
+##
+# Maximum number of buffers passed to a single sendmsg call (the lowest common IOV_MAX)
+#
+IOV_MAX = 1024
+
+##
+# Size of each write when buffers are sent to an SSL socket
+#
+SEND_CHUNK_SIZE = 262144
+
+
+def gather_buffers(buffers):
+    """
+    Prepare a list of buffers for a scatter-gather write: runs of small buffers (such as the header lines of a
+    frame) are joined together, and large ones are wrapped in memoryviews so that they are never copied.
+
+    :param list buffers: bytes-like objects
+
+    :rtype: list(memoryview)
+    """
+    views = []
+    pending = []
+    for buf in buffers:
+        if len(buf) < GATHER_THRESHOLD:
+            pending.append(buf)
+            continue
+        if pending:
+            views.append(memoryview(pack(pending)))
+            pending = []
+        views.append(memoryview(buf).cast("B"))
+    if pending:
+        views.append(memoryview(pack(pending)))
+    return views
+
+
+##
+# The commands whose frames can be queued by a CoalescingWriter. All other frames (connect, disconnect, subscribe,
+# transactions, heartbeats) are written immediately.
+#
+COALESCED_COMMANDS = frozenset([CMD_SEND, CMD_ACK, CMD_NACK])
+
+
+def interleave_addresses(addresses):
+    """
+    Reorder addresses (as returned by socket.getaddrinfo) so that the address families alternate (for example IPv6,
+    IPv4, IPv6...), starting with the family of the first address, as recommended by RFC 8305.
+
+    :param list addresses: the addresses, as (family, type, proto, canonname, sockaddr) tuples
+
+    :rtype: list
+    """
+    by_family = []
+    for address in addresses:
+        for family_addresses in by_family:
+            if family_addresses[0][0] == address[0]:
+                family_addresses.append(address)
                 break
-        self.__recvbuf += fastbuf.getvalue()
-        fastbuf.close()
-        result = []
-
-        if self.__recvbuf and self.running:
-            while True:
-                pos = self.__recvbuf.find(b"\x00")
-
-                if pos >= 0:
-                    frame = self.__recvbuf[0:pos]
-                    preamble_end_match = PREAMBLE_END_RE.search(frame)
-                    if preamble_end_match:
-                        preamble_end = preamble_end_match.start()
-                        content_length_match = BaseTransport.__content_length_re.search(frame[0:preamble_end])
-                        if content_length_match:
-                            content_length = int(content_length_match.group("value"))
-                            content_offset = preamble_end_match.end()
-                            frame_size = content_offset + content_length
-                            if frame_size > len(frame):
-                                #
-                                # Frame contains NUL bytes, need to read more
-                                #
-                                if frame_size < len(self.__recvbuf):
-                                    pos = frame_size
-                                    frame = self.__recvbuf[0:pos]
-                                else:
-                                    #
-                                    # Haven't read enough data yet, exit loop and wait for more to arrive
-                                    #
-                                    break
-                    result.append(frame)
-                    pos += 1
+        else:
+            by_family.append([address])
+    result = []
+    for i in range(max([len(family_addresses) for family_addresses in by_family] or [0])):
+        for family_addresses in by_family:
+            if i < len(family_addresses):
+                result.append(family_addresses[i])
+    return result
+
+
+def race_connections(host_and_ports, stagger, timeout=None, source_address=None, setup_fc=None,
+                     create_thread_fc=default_create_thread, failed_fc=None):
+    """
+    Connect to whichever of the hosts accepts a connection first ("happy eyeballs", see RFC 8305), so that a host
+    which is down (or unreachable) doesn't hold up connecting to the others until its connection attempt times out.
+
+    The hosts are resolved in parallel, as part of the race, and each host's addresses are interleaved by address
+    family (see :py:func:`interleave_addresses`). Connection attempts are started in order (hosts in the order given,
+    skipping any which are still being resolved), each one `stagger` seconds after the previous one, or straight away
+    if an earlier attempt fails. The first socket to connect (and complete `setup_fc`, for example a TLS handshake)
+    is returned. The attempts still in progress are then cancelled - their sockets are shut down, so that they don't
+    linger until they time out - and closed.
+
+    :param list((str,int)) host_and_ports: the hosts to connect to, in order of preference
+    :param float stagger: the delay (in seconds) before starting the next connection attempt
+    :param float timeout: the timeout for each connection attempt
+    :param (str,int) source_address: the local address to bind to before connecting
+    :param function setup_fc: called with (socket, host_and_port) once connected, returning the socket to use
+        (possibly a wrapped socket)
+    :param function create_thread_fc: the function used to create a thread for each connection attempt
+    :param function failed_fc: called with the (host, port) of each host which couldn't be connected to (because
+        it couldn't be resolved, or every attempt to connect to it failed) before the race was over
+
+    :return: the connected socket, and the (host, port) it's connected to
+    :rtype: (socket.socket, (str,int))
+
+    :raises OSError: the last error, if all the connection attempts failed
+    """
+    condition = threading.Condition()
+    state = {"winner": None, "resolving": len(host_and_ports), "started": 0, "finished": 0}
+    # the addresses of each host (None until resolved), and the number of them which haven't failed yet
+    addresses = [None] * len(host_and_ports)
+    remaining = [0] * len(host_and_ports)
+    errors = []
+    failed = []
+    # a duplicate of the socket of each attempt in progress, used to cancel the attempt once there's a winner
+    in_progress = {}
+
+    def resolve(index):
+        (host, port) = host_and_ports[index]
+        try:
+            resolved = interleave_addresses(socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM))
+            error = None
+        except OSError:
+            _, error, _ = sys.exc_info()
+            logging.debug("unable to resolve host %s", host)
+            resolved = []
+        with condition:
+            state["resolving"] -= 1
+            addresses[index] = resolved
+            remaining[index] = len(resolved)
+            if error is not None:
+                errors.append(error)
+            if not resolved and state["winner"] is None:
+                failed.append(host_and_ports[index])
+            condition.notify_all()
+
+    def attempt(index, address):
+        host_and_port = host_and_ports[index]
+        (family, socktype, proto, _, sockaddr) = address
+        token = object()
+        sock = None
+        error = None
+        try:
+            sock = socket.socket(family, socktype, proto)
+            with condition:
+                if state["winner"] is not None:
+                    raise OSError("connection attempt cancelled")
+                in_progress[token] = sock.dup()
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            if setup_fc is not None:
+                sock = setup_fc(sock, host_and_port)
+        except Exception:
+            _, error, _ = sys.exc_info()
+            logging.debug("connection attempt to %s (%s) failed: %s", host_and_port, sockaddr, error)
+            if sock is not None:
+                sock.close()
+            sock = None
+        with condition:
+            handle = in_progress.pop(token, None)
+            if handle is not None:
+                handle.close()
+            state["finished"] += 1
+            if sock is not None:
+                if state["winner"] is None:
+                    state["winner"] = (sock, host_and_port)
+                else:
+                    # lost the race
+                    sock.close()
+            elif state["winner"] is None:
+                errors.append(error)
+                remaining[index] -= 1
+                if remaining[index] == 0:
+                    failed.append(host_and_port)
+            condition.notify_all()
+
+    def next_candidate():
+        for (index, host_addresses) in enumerate(addresses):
+            if host_addresses:
+                return (index, host_addresses.pop(0))
+        return None
+
+    for index in range(len(host_and_ports)):
+        create_thread_fc(lambda i=index: resolve(i))
+
+    with condition:
+        try:
+            while state["winner"] is None:
+                candidate = next_candidate()
+                if candidate is not None:
+                    create_thread_fc(lambda c=candidate: attempt(*c))
+                    state["started"] += 1
+                    finished = state["finished"]
                     #
-                    # Ignore optional EOLs at end of frame
+                    # Wait until the next attempt is due, or an attempt succeeds or fails
                     #
-                    while 1:
-                        if self.__is_eol(self.__recvbuf[pos:pos + 1]):
-                            pos += 1
-                        elif self.__is_eol(self.__recvbuf[pos:pos + 2]):
-                            pos += 2
-                        else:
+                    end = monotonic() + stagger
+                    while state["winner"] is None and state["finished"] == finished:
+                        remaining_time = end - monotonic()
+                        if remaining_time <= 0:
                             break
-                    self.__recvbuf = self.__recvbuf[pos:]
+                        condition.wait(remaining_time)
+                elif state["resolving"] or state["finished"] < state["started"]:
+                    condition.wait()
                 else:
                     break
-        return result
+        finally:
+            #
+            # Cancel the attempts still in progress (shutting down a duplicate of the socket interrupts a connect or
+            # handshake which is blocked in another thread)
+            #
+            for handle in in_progress.values():
+                try:
+                    handle.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                handle.close()
+            in_progress.clear()
+            winner = state["winner"]
+            failed_hosts = list(failed)
+            del failed[:]
+
+    if failed_fc is not None:
+        for host_and_port in failed_hosts:
+            failed_fc(host_and_port)
+    if winner is None:
+        raise errors[-1] if errors else OSError("no hosts to connect to")
+    return winner
+
+
+class SSLContextCache(object):
+    """
+    Caches an SSLContext for each SSL configuration, so that the certificate files aren't loaded (and parsed) again
+    for every connection. A context is reloaded if any of its files have changed (according to their modification
+    times) since it was loaded.
+
+    Contexts are shared by all the connections using the same configuration (see `ssl_context_cache`), which also
+    means the sessions of one connection can be resumed by another. Configurations are identified by a digest of the
+    key password (the password itself isn't kept), and the least recently used context is dropped once there are
+    more than `max_contexts`.
+
+    :param int max_contexts: the maximum number of cached contexts
+    """
+    def __init__(self, max_contexts=32):
+        self.max_contexts = max_contexts
+        self.stats = {
+            # number of times a context has been loaded
+            "loads": 0,
+            # number of times a cached context has been used
+            "hits": 0,
+        }
+        self.__contexts = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key_file=None, cert_file=None, ca_certs=None, password=None):
+        """
+        Return the context for an SSL configuration, loading it if it isn't cached (or the files have changed).
+
+        :param str key_file: the path to a X509 key file
+        :param str cert_file: the path to a X509 certificate
+        :param str ca_certs: the path to a file containing CA certificates to validate the server against
+        :param password: the password for the key
+
+        :rtype: ssl.SSLContext
+        """
+        key = (key_file, cert_file, ca_certs, self.__password_key(password))
+        mtimes = self.__mtimes(key_file, cert_file, ca_certs)
+        with self.__lock:
+            cached = self.__contexts.get(key)
+            if cached is not None and cached[1] == mtimes:
+                self.stats["hits"] += 1
+                self.__contexts.move_to_end(key)
+                return cached[0]
+            context = self.__load(key_file, cert_file, ca_certs, password)
+            self.__contexts[key] = (context, mtimes)
+            self.__contexts.move_to_end(key)
+            if len(self.__contexts) > self.max_contexts:
+                self.__contexts.popitem(last=False)
+            self.stats["loads"] += 1
+            return context
+
+    def clear(self):
+        """
+        Discard the cached contexts.
+        """
+        with self.__lock:
+            self.__contexts.clear()
+
+    @staticmethod
+    def __password_key(password):
+        """
+        The part of the cache key for the password: a digest of it (or, if the password is a function, the function).
+        """
+        if password is None or callable(password):
+            return password
+        if isinstance(password, str):
+            password = password.encode("utf-8")
+        return hashlib.sha256(password).hexdigest()
+
+    @staticmethod
+    def __mtimes(*paths):
+        mtimes = []
+        for path in paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns if path else None)
+            except OSError:
+                # reload (and report the missing file)
+                mtimes.append(-1)
+        return tuple(mtimes)
+
+    @staticmethod
+    def __load(key_file, cert_file, ca_certs, password):
+        tls_context = ssl.SSLContext(DEFAULT_SSL_VERSION)
+        if ca_certs:
+            cert_validation = ssl.CERT_REQUIRED
+            tls_context.load_verify_locations(ca_certs)
+        else:
+            cert_validation = ssl.CERT_NONE
+        if cert_file and not key_file:
+            key_file = cert_file
+        if cert_file:
+            tls_context.load_cert_chain(cert_file, key_file, password)
+        if cert_validation == ssl.CERT_NONE:
+            tls_context.check_hostname = False
+        tls_context.verify_mode = cert_validation
+        return tls_context
+
+
+##
+# The SSL contexts shared by all connections
+#
+ssl_context_cache = SSLContextCache()
+
+
+class CoalescingWriter(object):
+    """
+    Queues outbound frames, and writes them to the transport in batches from a dedicated writer thread, so that
+    many small frames are sent with one system call (and, for SSL, one record) rather than one each.
+
+    A batch is written as soon as it reaches `max_bytes` or `max_frames`, or when `max_delay` seconds have passed
+    since the first frame was queued. Callers are held back while a full batch is waiting to be written. Frames
+    written with sync=True (and any frames queued before them) are sent by the calling thread straight away.
+
+    Queued frames which aren't sent - because the write failed, or because the writer was closed before they could
+    be written - are passed to the listeners' `on_send_error` method (see
+    :py:meth:`stomp.listener.ConnectionListener.on_send_error`), rather than raised to whichever caller happens to
+    write next. A caller only gets an exception for its own write: when writing with sync=True or flushing fails,
+    or when it's held back waiting for room in the queue and the writer is closed.
+
+    :param BaseTransport transport: the transport to write to (using its `send_buffers` method, and its
+        `create_thread_fc` to start the writer thread)
+    :param int max_bytes: the maximum size of a batch
+    :param int max_frames: the maximum number of frames in a batch
+    :param float max_delay: the maximum time (in seconds) a frame is queued before being written
+    """
+
+    def __init__(self, transport, max_bytes=65536, max_frames=1000, max_delay=0.001):
+        self.transport = transport
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.max_delay = max_delay
+        self.writer_thread = None
+        self.stats = {
+            # number of frames written
+            "frames": 0,
+            # number of writes to the transport
+            "writes": 0,
+        }
+        self.__pending = []
+        # the frames queued (if known), to report to the listeners if they can't be sent
+        self.__pending_frame_objects = []
+        self.__pending_bytes = 0
+        self.__pending_frames = 0
+        self.__pending_frames_taken = 0
+        self.__first_queued = None
+        # the number of times the writer was closed, and the error, for the callers waiting for room in the queue
+        self.__error_count = 0
+        self.__last_error = None
+        self.__generation = 0
+        self.__condition = threading.Condition()
+        # held while a batch is taken from the queue and written, to keep frames in order
+        self.__write_lock = threading.Lock()
+
+    def write(self, buffers, sync=False, frame=None):
+        """
+        Queue an encoded frame, or (if sync is True) write it immediately along with any queued frames.
+
+        :param list buffers: the encoded frame
+        :param bool sync: write now, rather than queueing the frame
+        :param Frame frame: the frame (reported to the listeners if it's queued, but can't be sent)
+        """
+        if sync:
+            with self.__write_lock:
+                (batch, frames) = self.__take()
+                try:
+                    self.__send(batch + buffers, self.__pending_frames_taken + 1)
+                except Exception:
+                    # the caller gets the exception, the listeners are told about the queued frames
+                    self.__notify_failed(frames, sys.exc_info()[1])
+                    raise
+            return
+
+        size = 0
+        for buf in buffers:
+            size += len(buf)
+        with self.__condition:
+            error_count = self.__error_count
+            while self.__is_full():
+                self.__condition.wait()
+                if self.__error_count != error_count:
+                    raise self.__last_error
+            if frame is not None:
+                self.__pending_frame_objects.append(frame)
+            self.__pending.extend(buffers)
+            self.__pending_bytes += size
+            self.__pending_frames += 1
+            if self.__first_queued is None:
+                self.__first_queued = monotonic()
+            if self.writer_thread is None:
+                generation = self.__generation
+                self.writer_thread = self.transport.create_thread_fc(lambda: self.__writer_loop(generation))
+            self.__condition.notify_all()
+
+    def flush(self):
+        """
+        Write any queued frames, waiting until they've been sent.
+        """
+        with self.__write_lock:
+            (batch, frames) = self.__take()
+            if batch:
+                try:
+                    self.__send(batch, self.__pending_frames_taken)
+                except Exception:
+                    self.__notify_failed(frames, sys.exc_info()[1])
+                    raise
+
+    def close(self):
+        """
+        Discard any queued frames (reporting them to the listeners, and failing any callers waiting for room in the
+        queue) and stop the writer thread (a new one is started by the next queued write).
+        """
+        error = exception.ConnectionClosedException()
+        with self.__condition:
+            frames = self.__pending_frame_objects
+            if self.__pending:
+                logging.debug("discarding %d queued frames", self.__pending_frames)
+                self.__error_count += 1
+                self.__last_error = error
+            self.__pending = []
+            self.__pending_frame_objects = []
+            self.__pending_bytes = 0
+            self.__pending_frames = 0
+            self.__first_queued = None
+            self.__generation += 1
+            self.writer_thread = None
+            self.__condition.notify_all()
+        self.__notify_failed(frames, error)
+
+    def __is_full(self):
+        return self.__pending_bytes >= self.max_bytes or self.__pending_frames >= self.max_frames
+
+    def __take(self):
+        """
+        Remove the queued frames. Must be called holding the write lock.
+
+        :return: the encoded frames, and the Frame objects
+        :rtype: (list, list(Frame))
+        """
+        with self.__condition:
+            batch = self.__pending
+            frames = self.__pending_frame_objects
+            self.__pending_frames_taken = self.__pending_frames
+            self.__pending = []
+            self.__pending_frame_objects = []
+            self.__pending_bytes = 0
+            self.__pending_frames = 0
+            self.__first_queued = None
+            self.__condition.notify_all()
+            return (batch, frames)
+
+    def __send(self, batch, frames):
+        self.transport.send_buffers(batch)
+        self.stats["frames"] += frames
+        self.stats["writes"] += 1
+
+    def __notify_failed(self, frames, error):
+        for frame in frames:
+            try:
+                self.transport.notify("send_error", frame, error)
+            except Exception:
+                logging.warning("error notifying listeners of a frame which wasn't sent", exc_info=True)
+
+    def __writer_loop(self, generation):
+        logging.debug("starting writer loop (%s)", threading.current_thread())
+        while True:
+            with self.__condition:
+                #
+                # Wait for frames to be queued
+                #
+                while generation == self.__generation and not self.__pending:
+                    self.__condition.wait()
+                if generation != self.__generation:
+                    break
+                while generation == self.__generation and self.__pending and not self.__is_full():
+                    remaining = self.__first_queued + self.max_delay - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+            with self.__write_lock:
+                if generation != self.__generation:
+                    break
+                frames = []
+                try:
+                    (batch, frames) = self.__take()
+                    if batch:
+                        self.__send(batch, self.__pending_frames_taken)
+                except Exception:
+                    logging.debug("error writing queued frames", exc_info=logging.verbose)
+                    self.__notify_failed(frames, sys.exc_info()[1])
+        logging.debug("writer loop ended")
 
 
 class Transport(BaseTransport):
@@ -486,6 +1212,22 @@ class Transport(BaseTransport):
         For macos, supply ("mac", ka_intvl)
     :param str vhost: specify a virtual hostname to provide in the 'host' header of the connection
     :param int recv_bytes: the number of bytes to use when calling recv
+    :param bool recv_into: if True, read into a reusable buffer owned by the transport (using recv_into) rather than
+        allocating a new bytes object for every read. The buffer starts at recv_bytes and grows (up to
+        recv_bytes_max) when reads fill it, or when a larger frame is known to be arriving. Counters are
+        available in `recv_stats`
+    :param int recv_bytes_max: the maximum size of the receive buffer used when recv_into is True
+    :param bool coalesce_writes: if True, queue SEND, ACK and NACK frames and write them in batches from a separate
+        thread (see :py:class:`CoalescingWriter` - the batch limits can be changed through the `writer` attribute).
+        Use `flush`, or transmit with sync=True, to send frames immediately
+    :param stomp.reactor.Reactor reactor: if set, the socket is put into non-blocking mode once connected, and data
+        is read (and listeners called) by the reactor's thread, rather than a receiver thread for each connection
+    :param float connect_stagger: if set, rather than trying the hosts one after another (waiting for each
+        attempt to fail or time out), connect to them concurrently - starting the next attempt every
+        `connect_stagger` seconds (or as soon as an attempt fails), and using the first connection to succeed.
+        See :py:func:`race_connections`
+    :param stomp.hosts.HostSelector host_selector: if set, used to choose which hosts to try, and in which order,
+        based on their health (for example, :py:data:`stomp.hosts.host_selector`, which is shared by the process)
     """
 
     def __init__(self,
@@ -504,8 +1246,17 @@ class Transport(BaseTransport):
                  encoding="utf-8",
                  recv_bytes=1024,
                  is_eol_fc=is_eol_default,
-                 bind_host_port=None):
+                 bind_host_port=None,
+                 recv_into=False,
+                 recv_bytes_max=1048576,
+                 coalesce_writes=False,
+                 reactor=None,
+                 connect_stagger=None,
+                 host_selector=None):
         BaseTransport.__init__(self, auto_decode, encoding, is_eol_fc)
+        self.reactor = reactor
+        self.host_selector = host_selector
+        self.__connect_stagger = connect_stagger
 
         if host_and_ports is None:
             logging.debug("no hosts_and_ports specified, adding default localhost")
@@ -556,9 +1307,34 @@ class Transport(BaseTransport):
 
         # setup SSL
         self.__ssl_params = {}
+        # the last SSL session (and the context it belongs to) of each host
+        self.__ssl_sessions = {}
+        self.ssl_stats = {
+            # number of TLS handshakes
+            "handshakes": 0,
+            # number of handshakes which resumed a previous session (the resumption rate is resumed / handshakes)
+            "resumed": 0,
+        }
         self.__keepalive = keepalive
         self.vhost = vhost
         self.__recv_bytes = recv_bytes
+        self.__recv_into = recv_into
+        self.__recv_bytes_max = max(recv_bytes, recv_bytes_max)
+        self.__recv_size = recv_bytes
+        self.__recv_buffer = None
+        self.__recv_view = None
+        if coalesce_writes:
+            self.writer = CoalescingWriter(self)
+        self.recv_stats = {
+            # number of recv/recv_into calls on the socket
+            "calls": 0,
+            # total number of bytes received
+            "bytes": 0,
+            # number of times the receive buffer has been (re)allocated
+            "allocations": 0,
+            # current size of the receive buffer
+            "buffer_size": 0,
+        }
 
     def is_connected(self):
         """
@@ -576,8 +1352,16 @@ class Transport(BaseTransport):
         Disconnect the underlying socket connection
         """
         self.running = False
+        if self.writer is not None:
+            self.writer.close()
+        if self.reactor is not None:
+            self.reactor.unregister(self)
         if self.socket is not None:
             if self.__need_ssl():
+                #
+                # With TLS 1.3 the session tickets arrive after the handshake, so keep the latest session
+                #
+                self.__save_ssl_session(self.socket, self.current_host_and_port)
                 #
                 # Even though we don't want to use the socket, unwrap is the only API method which does a proper SSL
                 # shutdown
@@ -615,12 +1399,16 @@ class Transport(BaseTransport):
 
     def send(self, encoded_frame):
         """
-        :param bytes encoded_frame:
+        :param encoded_frame: the encoded frame, either as bytes or as a list of bytes-like objects (which are
+            written without joining them together - see `send_buffers`)
         """
         if self.socket is not None:
             try:
                 with self.__socket_semaphore:
-                    self.socket.sendall(encoded_frame)
+                    if isinstance(encoded_frame, (list, tuple)):
+                        self.__send_gathered(gather_buffers(encoded_frame))
+                    else:
+                        self.__sendall(encoded_frame)
             except Exception:
                 _, e, _ = sys.exc_info()
                 logging.error("error sending frame", exc_info=True)
@@ -628,20 +1416,127 @@ class Transport(BaseTransport):
         else:
             raise exception.NotConnectedException()
 
+    def send_buffers(self, buffers):
+        """
+        Write a list of buffers to the socket without joining them together: using sendmsg (scatter-gather) for plain
+        TCP connections, or a series of writes for SSL connections.
+
+        :param list buffers: the encoded frame, as a list of bytes-like objects (bytes, bytearray, memoryview, mmap)
+        """
+        self.send(buffers)
+
+    def __send_gathered(self, views):
+        sock = self.socket
+        if not hasattr(sock, "sendmsg") or (ssl and isinstance(sock, ssl.SSLSocket)):
+            for view in views:
+                for offset in range(0, len(view), SEND_CHUNK_SIZE):
+                    self.__sendall(view[offset:offset + SEND_CHUNK_SIZE])
+            return
+        start = 0
+        while start < len(views):
+            try:
+                sent = sock.sendmsg(views[start:start + IOV_MAX])
+            except BlockingIOError:
+                self.__wait_writable()
+                continue
+            #
+            # Drop the buffers which were completely written, and skip the written part of the next one
+            #
+            while start < len(views) and sent >= len(views[start]):
+                sent -= len(views[start])
+                start += 1
+            if sent:
+                views[start] = views[start][sent:]
+
+    def __sendall(self, data):
+        """
+        Write all the data, waiting for the socket to become writable if it's in non-blocking mode (as it is when
+        used with a reactor) and its send buffer is full.
+        """
+        sock = self.socket
+        if sock.gettimeout() != 0.0:
+            sock.sendall(data)
+            return
+        view = memoryview(data)
+        while len(view):
+            try:
+                sent = sock.send(view)
+            except WOULD_BLOCK_ERRORS:
+                self.__wait_writable()
+                continue
+            view = view[sent:]
+
+    def __wait_writable(self):
+        # a selector, rather than select.select, which can't handle file descriptors above FD_SETSIZE
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.socket, selectors.EVENT_WRITE)
+            selector.select(1.0)
+
     def receive(self):
         """
         :rtype: bytes
         """
         try:
-            return self.socket.recv(self.__recv_bytes)
+            if self.__recv_into:
+                return self.__receive_into()
+            data = self.socket.recv(self.__recv_bytes)
+            self.recv_stats["calls"] += 1
+            self.recv_stats["bytes"] += len(data)
+            return data
         except socket.error:
             _, e, _ = sys.exc_info()
-            if get_errno(e) in (errno.EAGAIN, errno.EINTR):
+            if get_errno(e) in (errno.EAGAIN, errno.EINTR) or (ssl and isinstance(e, ssl.SSLWantReadError)):
                 logging.debug("socket read interrupted, restarting")
                 raise exception.InterruptedException()
             if self.is_connected():
                 raise
 
+    def __receive_into(self):
+        """
+        Read into the transport's receive buffer. The returned memoryview is only valid until the next call.
+
+        :rtype: memoryview
+        """
+        size = min(max(self.__recv_size, self.receive_size_hint()), self.__recv_bytes_max)
+        if self.__recv_buffer is None or len(self.__recv_buffer) < size:
+            self.__recv_buffer = bytearray(size)
+            self.__recv_view = memoryview(self.__recv_buffer)
+            self.recv_stats["allocations"] += 1
+            self.recv_stats["buffer_size"] = size
+        view = self.__recv_view
+        stats = self.recv_stats
+
+        received = self.socket.recv_into(view)
+        stats["calls"] += 1
+        if received == len(view):
+            #
+            # Filled the buffer, so there's likely more waiting: grow for the next read
+            #
+            self.__recv_size = min(len(view) * 2, self.__recv_bytes_max)
+
+        #
+        # Data which has already been decrypted won't wake up a blocking read, so drain it now
+        #
+        pending = getattr(self.socket, "pending", None)
+        while pending is not None and 0 < received < len(view) and pending() > 0:
+            count = self.socket.recv_into(view[received:])
+            stats["calls"] += 1
+            if not count:
+                break
+            received += count
+
+        stats["bytes"] += received
+        return view[:received]
+
+    def receive_pending(self):
+        """
+        :rtype: int
+        """
+        pending = getattr(self.socket, "pending", None)
+        if pending is None:
+            return 0
+        return pending()
+
     def cleanup(self):
         """
         Close the socket and clear the current host and port details.
@@ -725,77 +1620,10 @@ class Transport(BaseTransport):
         logging.debug("attempt reconnection (%s, %s, %s)", self.running, self.socket, connect_count)
         while self.running and self.socket is None and (connect_count < self.__reconnect_attempts_max or
                                                         self.__reconnect_attempts_max == -1):
-            for host_and_port in self.__host_and_ports:
-                try:
-                    logging.debug("attempting connection to host %s, port %s", host_and_port[0], host_and_port[1])
-                    if self.__bind_host_port:
-                        self.socket = socket.create_connection(host_and_port, self.__timeout, self.__bind_host_port)
-                    else:
-                        self.socket = socket.create_connection(host_and_port, self.__timeout)
-                    self.__enable_keepalive()
-                    need_ssl = self.__need_ssl(host_and_port)
-
-                    if need_ssl:  # wrap socket
-                        ssl_params = self.get_ssl(host_and_port)
-                        tls_context = ssl.SSLContext(DEFAULT_SSL_VERSION)
-                        if ssl_params["ca_certs"]:
-                            cert_validation = ssl.CERT_REQUIRED
-                            tls_context.load_verify_locations(ssl_params["ca_certs"])
-                        else:
-                            cert_validation = ssl.CERT_NONE
-                        if tls_context:
-                            # Wrap the socket for TLS
-                            certfile = ssl_params["cert_file"]
-                            keyfile = ssl_params["key_file"]
-                            password = ssl_params.get("password")
-                            if certfile and not keyfile:
-                                keyfile = certfile
-                            if certfile:
-                                tls_context.load_cert_chain(certfile, keyfile, password)
-                            if cert_validation is None or cert_validation == ssl.CERT_NONE:
-                                tls_context.check_hostname = False
-                            tls_context.verify_mode = cert_validation
-                            logging.debug("wrapping SSL socket")
-                            self.socket = tls_context.wrap_socket(self.socket, server_hostname=host_and_port[0])
-                        else:
-                            # Old-style wrap_socket where we don't have a modern SSLContext (so no SNI)
-                            logging.debug("wrapping SSL socket (old style)")
-                            self.socket = ssl.wrap_socket(
-                                self.socket,
-                                keyfile=ssl_params["key_file"],
-                                certfile=ssl_params["cert_file"],
-                                cert_reqs=cert_validation,
-                                ca_certs=ssl_params["ca_certs"],
-                                ssl_version=ssl_params["ssl_version"])
-
-                    self.socket.settimeout(self.__timeout)
-
-                    if self.blocking is not None:
-                        self.socket.setblocking(self.blocking)
-
-                    #
-                    # Validate server cert
-                    #
-                    if need_ssl and ssl_params["cert_validator"]:
-                        cert = self.socket.getpeercert()
-                        (ok, errmsg) = ssl_params["cert_validator"](cert, host_and_port[0])
-                        if not ok:
-                            raise SSLError("Server certificate validation failed: %s", errmsg)
-
-                    self.current_host_and_port = host_and_port
-                    logging.info("established connection to host %s, port %s", host_and_port[0], host_and_port[1])
-                    break
-
-                except FileNotFoundError as err:
-                    logging.error("Could not find file %s", err.filename)
-                    self.socket = None
-                    break
-
-                except (OSError, AssertionError):
-                    self.socket = None
-                    connect_count += 1
-                    logging.warning("could not connect to host %s, port %s", host_and_port[0], host_and_port[1],
-                                    exc_info=logging.verbose)
+            if self.__connect_stagger is not None:
+                connect_count += self.__race_connections()
+            else:
+                connect_count += self.__connect_in_order()
 
             if self.socket is None:
                 sleep_duration = (min(self.__reconnect_sleep_max,
@@ -813,6 +1641,158 @@ class Transport(BaseTransport):
         if not self.socket:
             raise exception.ConnectFailedException()
 
+    def __connect_in_order(self):
+        """
+        Try connecting to each of the hosts in turn, until one succeeds.
+
+        :return: the number of failed attempts
+        :rtype: int
+        """
+        (host_and_ports, failed) = self.__select_hosts()
+        for host_and_port in host_and_ports:
+            start = monotonic()
+            try:
+                logging.debug("attempting connection to host %s, port %s", host_and_port[0], host_and_port[1])
+                if self.__bind_host_port:
+                    sock = socket.create_connection(host_and_port, self.__timeout, self.__bind_host_port)
+                else:
+                    sock = socket.create_connection(host_and_port, self.__timeout)
+                try:
+                    sock = self.__secure_socket(sock, host_and_port)
+                except Exception:
+                    sock.close()
+                    raise
+                self.__connected(sock, host_and_port)
+                if self.host_selector is not None:
+                    self.host_selector.record_connect(host_and_port, monotonic() - start)
+                break
+
+            except FileNotFoundError as err:
+                logging.error("Could not find file %s", err.filename)
+                self.socket = None
+                break
+
+            except (OSError, AssertionError):
+                self.socket = None
+                failed += 1
+                if self.host_selector is not None:
+                    self.host_selector.record_failure(host_and_port)
+                logging.warning("could not connect to host %s, port %s", host_and_port[0], host_and_port[1],
+                                exc_info=logging.verbose)
+        return failed
+
+    def __race_connections(self):
+        """
+        Connect to the hosts concurrently (see :py:func:`race_connections`), using the first to succeed.
+
+        :return: the number of failed attempts
+        :rtype: int
+        """
+        (host_and_ports, skipped) = self.__select_hosts()
+        if not host_and_ports:
+            return skipped
+        start = monotonic()
+        try:
+            logging.debug("racing connections to %s", host_and_ports)
+            failed_fc = self.host_selector.record_failure if self.host_selector is not None else None
+            (sock, host_and_port) = race_connections(host_and_ports, self.__connect_stagger, self.__timeout,
+                                                     self.__bind_host_port, self.__secure_socket,
+                                                     self.create_thread_fc, failed_fc)
+            self.__connected(sock, host_and_port)
+        except FileNotFoundError as err:
+            logging.error("Could not find file %s", err.filename)
+            self.socket = None
+        except (OSError, AssertionError):
+            self.socket = None
+            logging.warning("could not connect to any of %s", host_and_ports, exc_info=logging.verbose)
+            return len(self.__host_and_ports)
+        if self.host_selector is not None:
+            # only the winner's time is known (which includes any stagger before its attempt started)
+            self.host_selector.record_connect(host_and_port, monotonic() - start)
+        return skipped
+
+    def __select_hosts(self):
+        """
+        The hosts to try connecting to, in order - if there's a host selector, hosts whose circuit breaker is open
+        are left out (and counted as failed attempts).
+
+        :return: the hosts, and the number skipped
+        :rtype: (list((str,int)), int)
+        """
+        if self.host_selector is None:
+            return (self.__host_and_ports, 0)
+        host_and_ports = self.host_selector.order(self.__host_and_ports)
+        skipped = len(self.__host_and_ports) - len(host_and_ports)
+        if skipped:
+            logging.debug("skipping %d hosts with open circuit breakers", skipped)
+        return (host_and_ports, skipped)
+
+    def __secure_socket(self, sock, host_and_port):
+        """
+        Wrap a newly connected socket for TLS (if required for the host), carrying out the handshake and validating
+        the server's certificate.
+
+        :param socket.socket sock: the connected socket
+        :param (str,int) host_and_port: the host and port connected to
+
+        :rtype: socket.socket
+        """
+        if not self.__need_ssl(host_and_port):
+            return sock
+        ssl_params = self.get_ssl(host_and_port)
+        tls_context = ssl_context_cache.get(ssl_params["key_file"], ssl_params["cert_file"], ssl_params["ca_certs"],
+                                            ssl_params.get("password"))
+        #
+        # Resume the previous session with the host if possible, rather than doing a full handshake
+        #
+        (session_context, session) = self.__ssl_sessions.get(host_and_port, (None, None))
+        if session_context is not tls_context:
+            session = None
+        logging.debug("wrapping SSL socket")
+        sock = tls_context.wrap_socket(sock, server_hostname=host_and_port[0], session=session)
+        self.__save_ssl_session(sock, host_and_port)
+
+        #
+        # Validate server cert
+        #
+        if ssl_params["cert_validator"]:
+            cert = sock.getpeercert()
+            (ok, errmsg) = ssl_params["cert_validator"](cert, host_and_port[0])
+            if not ok:
+                raise SSLError("Server certificate validation failed: %s", errmsg)
+        return sock
+
+    def __save_ssl_session(self, sock, host_and_port):
+        """
+        Keep the SSL session of a socket, to resume on reconnecting to the same host.
+        """
+        session = getattr(sock, "session", None)
+        if session is not None:
+            self.__ssl_sessions[host_and_port] = (sock.context, session)
+
+    def __connected(self, sock, host_and_port):
+        """
+        Set up a newly connected (and, if required, secured) socket as the transport's socket.
+        """
+        if ssl and isinstance(sock, ssl.SSLSocket):
+            # only counted for the socket which is used (and not those which lost a connection race), on the thread
+            # connecting
+            self.ssl_stats["handshakes"] += 1
+            if sock.session_reused:
+                self.ssl_stats["resumed"] += 1
+        self.socket = sock
+        self.__enable_keepalive()
+        self.socket.settimeout(self.__timeout)
+
+        if self.blocking is not None:
+            self.socket.setblocking(self.blocking)
+
+        if self.reactor is not None:
+            self.socket.setblocking(False)
+
+        self.current_host_and_port = host_and_port
+        logging.info("established connection to host %s, port %s", host_and_port[0], host_and_port[1])
+
     def set_ssl(self,
                 for_hosts=[],
                 key_file=None,
@@ -839,10 +1819,18 @@ class Transport(BaseTransport):
         :param ssl_version: SSL protocol to use for the connection. This should be one of the PROTOCOL_x
                             constants provided by the ssl module. The default is ssl.PROTOCOL_TLSv1
         :param password: SSL password
+
+        The SSLContext for the configuration is loaded once, and shared (see :py:class:`SSLContextCache`).
         """
         if not ssl:
             raise Exception("SSL connection requested, but SSL library not found")
 
+        try:
+            # load the context now, rather than on connecting
+            ssl_context_cache.get(key_file, cert_file, ca_certs, password)
+        except (OSError, ssl.SSLError):
+            logging.debug("unable to load SSL context", exc_info=logging.verbose)
+
         for host_port in for_hosts:
             self.__ssl_params[host_port] = dict(key_file=key_file,
                                                 cert_file=cert_file,
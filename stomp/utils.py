@@ -2,11 +2,13 @@
 """
 
 import copy
+import mmap
 import os
 import re
 import socket
 import threading
 import uuid
+from collections.abc import MutableMapping
 
 from stomp.constants import *
 
@@ -39,21 +41,22 @@ def decode(byte_data, encoding="utf-8"):
     """
     Decode the byte data to a string if not None.
 
-    :param bytes byte_data: the data to decode
+    :param bytes byte_data: the data to decode (any bytes-like object)
     :param string encoding: character encoding
 
     :rtype: str
     """
     if byte_data is None:
         return None
-    return byte_data.decode(encoding, errors="replace")
+    return str(byte_data, encoding, errors="replace")
 
 
 def encode(char_data, encoding="utf-8"):
     """
     Encode the parameter as a byte string.
 
-    :param char_data: the data to encode
+    :param char_data: the data to encode. Binary data (bytes, bytearray, memoryview or mmap) is returned as-is, so
+        that it isn't copied
     :param string encoding: character encoding
 
     :rtype: bytes
@@ -62,6 +65,12 @@ def encode(char_data, encoding="utf-8"):
         return char_data.encode(encoding, errors="replace")
     elif type(char_data) is bytes:
         return char_data
+    elif isinstance(char_data, (bytearray, mmap.mmap)):
+        return char_data
+    elif isinstance(char_data, memoryview):
+        if char_data.c_contiguous:
+            return char_data.cast("B")
+        return char_data.tobytes()
     else:
         raise TypeError("message should be a string or bytes, found %s" % type(char_data))
 
@@ -112,6 +121,11 @@ LINE_END_RE = re.compile("\n|\r\n")
 #
 PASSCODE_RE = re.compile(r"passcode:\s+[^\' ]+")
 
+##
+# Bodies of received frames larger than this are exposed as a view over the frame data, rather than copied
+#
+BODY_VIEW_THRESHOLD = 1024
+
 ENC_NEWLINE = encode("\n")
 ENC_NULL = encode(NULL)
 
@@ -162,6 +176,17 @@ def _unescape_header(matchobj):
     return unescaped
 
 
+def unescape_header(value):
+    """
+    Reverse the escaping of a header key or value (as sent using STOMP 1.1 or 1.2).
+
+    :param str value: the escaped key or value
+
+    :rtype: str
+    """
+    return re.sub(r"\\.", _unescape_header, value)
+
+
 def parse_headers(lines, offset=0):
     """
     Parse the headers in a STOMP response
@@ -176,19 +201,163 @@ def parse_headers(lines, offset=0):
         header_match = HEADER_LINE_RE.match(header_line)
         if header_match:
             key = header_match.group("key")
-            key = re.sub(r"\\.", _unescape_header, key)
+            key = unescape_header(key)
             if key not in headers:
                 value = header_match.group("value")
-                value = re.sub(r"\\.", _unescape_header, value)
+                value = unescape_header(value)
                 headers[key] = value
     return headers
 
 
-def parse_frame(frame):
+class LazyHeaders(MutableMapping):
+    """
+    The headers of a received frame. Behaves like a dict, but keeps the raw header lines and only splits them into
+    keys and values when a header is first accessed. Values are unescaped individually when they are read (and
+    unescaping is skipped entirely if the raw headers contain no backslashes). The unescaped values are kept apart
+    from the raw ones, so that reading the same header from several threads can't unescape a value twice.
+
+    :param str raw: the header lines of the frame (excluding the command line)
+    """
+    __slots__ = ("_raw", "_values", "_escaped", "_decoded", "_original")
+
+    def __init__(self, raw=""):
+        self._raw = raw
+        # header values, some of which may still need to be unescaped (None until the raw lines are parsed)
+        self._values = None
+        # keys of the values which need to be unescaped
+        self._escaped = None
+        # unescaped values of the keys in _escaped, once they've been read
+        self._decoded = {}
+        # copy of the headers taken before they were first modified
+        self._original = None
+
+    def __parse(self):
+        raw = self._raw
+        if raw is None:
+            # parsed by another thread
+            return self._values
+        values = {}
+        escaped = None
+        if raw:
+            has_escapes = "\\" in raw
+            for header_line in LINE_END_RE.split(raw):
+                sep = header_line.find(":")
+                if sep <= 0:
+                    continue
+                key = header_line[:sep]
+                if has_escapes and "\\" in key:
+                    key = unescape_header(key)
+                if key in values:
+                    continue
+                value = header_line[sep + 1:]
+                values[key] = value
+                if has_escapes and "\\" in value:
+                    if escaped is None:
+                        escaped = set()
+                    escaped.add(key)
+        # _values is set last, as the other methods check it to see whether the headers have been parsed
+        self._escaped = escaped
+        self._values = values
+        self._raw = None
+        return values
+
+    def __getitem__(self, key):
+        values = self._values
+        if values is None:
+            values = self.__parse()
+        value = values[key]
+        escaped = self._escaped
+        if escaped and key in escaped:
+            decoded = self._decoded.get(key)
+            if decoded is None:
+                # the raw value is never replaced, so unescaping it more than once gives the same result
+                decoded = self._decoded[key] = unescape_header(value)
+            return decoded
+        return value
+
+    def __setitem__(self, key, value):
+        if self._original is None:
+            self._original = self.__copy__()
+        if self._values is None:
+            self.__parse()
+        if self._escaped:
+            self._escaped.discard(key)
+            self._decoded.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if self._original is None:
+            self._original = self.__copy__()
+        if self._values is None:
+            self.__parse()
+        if self._escaped:
+            self._escaped.discard(key)
+            self._decoded.pop(key, None)
+        del self._values[key]
+
+    def original(self):
+        """
+        Return the headers as they were before they were first modified.
+
+        :rtype: LazyHeaders
+        """
+        if self._original is not None:
+            return self._original
+        return self.__copy__()
+
+    def __contains__(self, key):
+        values = self._values
+        if values is None:
+            values = self.__parse()
+        return key in values
+
+    def __iter__(self):
+        values = self._values
+        if values is None:
+            values = self.__parse()
+        return iter(values)
+
+    def __len__(self):
+        values = self._values
+        if values is None:
+            values = self.__parse()
+        return len(values)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def copy(self):
+        """
+        :rtype: LazyHeaders
+        """
+        return self.__copy__()
+
+    def __copy__(self):
+        if self._values is None:
+            return LazyHeaders(self._raw)
+        rtn = LazyHeaders(None)
+        if self._escaped:
+            rtn._escaped = set(self._escaped)
+            rtn._decoded = dict(self._decoded)
+        rtn._values = dict(self._values)
+        return rtn
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def parse_frame(frame, encoding=None):
     """
-    Parse a STOMP frame into a Frame object.
+    Parse a STOMP frame into a Frame object. The body of the returned frame (see :py:attr:`Frame.raw_body`) is only
+    decoded when :py:attr:`Frame.body` is first accessed. Bodies larger than BODY_VIEW_THRESHOLD are a view over the
+    frame data, so they aren't copied either.
 
     :param bytes frame: the frame received from the server (as a byte string)
+    :param str encoding: if set, the character encoding used to decode the body to a string, otherwise the body is
+        left as bytes
 
     :rtype: Frame
     """
@@ -199,26 +368,37 @@ def parse_frame(frame):
     else:
         preamble_end = len(frame)
         body_start = preamble_end
-    preamble = decode(frame[0:preamble_end])
-    preamble_lines = LINE_END_RE.split(preamble)
-    preamble_len = len(preamble_lines)
-    body = frame[body_start:]
+    view = memoryview(frame)
+    preamble = decode(view[0:preamble_end])
+    if len(frame) - body_start > BODY_VIEW_THRESHOLD:
+        body = view[body_start:]
+    else:
+        # a view costs more than copying a small body (and would keep the whole frame alive)
+        body = frame[body_start:]
 
     # Skip any leading newlines
     first_line = 0
-    while first_line < preamble_len and len(preamble_lines[first_line]) == 0:
-        first_line += 1
-
-    if first_line >= preamble_len:
+    while True:
+        if preamble.startswith("\n", first_line):
+            first_line += 1
+        elif preamble.startswith("\r\n", first_line):
+            first_line += 2
+        else:
+            break
+
+    if first_line >= len(preamble):
         return None
 
-    # Extract frame type/command
-    cmd = preamble_lines[first_line]
-
-    # Put headers into a key/value map
-    headers = parse_headers(preamble_lines, first_line + 1)
+    # Extract frame type/command, leaving the rest of the preamble to be parsed on demand
+    mat = LINE_END_RE.search(preamble, first_line)
+    if mat:
+        cmd = preamble[first_line:mat.start()]
+        headers = LazyHeaders(preamble[mat.end():])
+    else:
+        cmd = preamble[first_line:]
+        headers = LazyHeaders()
 
-    return Frame(cmd, headers, body)
+    return Frame(cmd, headers, body, encoding=encoding, lazy_body=True)
 
 
 def merge_headers(header_map_list):
@@ -270,11 +450,13 @@ def calculate_heartbeats(shb, chb):
     return x, y
 
 
-def convert_frame(frame):
+def convert_frame(frame, sort_headers=True):
     """
     Convert a frame to a list of lines separated by newlines.
 
     :param Frame frame: the Frame object to convert
+    :param bool sort_headers: if True, write the headers sorted by name (so the output is deterministic), otherwise
+        in the order they were added to the frame
 
     :rtype: list(str)
     """
@@ -284,13 +466,16 @@ def convert_frame(frame):
     if frame.body:
         body = encode(frame.body)
 
-        if HDR_CONTENT_LENGTH in frame.headers:
-            frame.headers[HDR_CONTENT_LENGTH] = len(body)
+        if HDR_CONTENT_LENGTH in frame.headers and frame.headers[HDR_CONTENT_LENGTH] != len(body):
+            frame.set_header(HDR_CONTENT_LENGTH, len(body))
 
     if frame.cmd:
         lines.append(encode(frame.cmd))
         lines.append(ENC_NEWLINE)
-    for key, vals in sorted(frame.headers.items()):
+    items = frame.headers.items()
+    if sort_headers:
+        items = sorted(items)
+    for key, vals in items:
         if vals is None:
             continue
         if type(vals) != tuple:
@@ -319,19 +504,96 @@ def length(s):
     return 0
 
 
+#
+# Marker for a frame body which hasn't yet been converted from the raw body
+#
+_PENDING = object()
+
+
 class Frame(object):
     """
     A STOMP frame (or message).
 
     :param str cmd: the protocol command
-    :param dict headers: a map of headers for the frame
+    :param dict headers: a map of headers for the frame (not copied - see :py:attr:`original_headers`)
     :param body: the content of the frame.
+    :param str encoding: if lazy_body is set, the character encoding used to decode the body on first access (or
+        None to convert it to bytes)
+    :param bool lazy_body: if True, the body is raw data (any bytes-like object, such as a memoryview) which is only
+        converted when the body attribute is first read
     """
-    def __init__(self, cmd, headers=None, body=None):
+    __slots__ = ("cmd", "headers", "_initial_headers", "_body", "_raw_body", "_encoding")
+
+    def __init__(self, cmd, headers=None, body=None, encoding=None, lazy_body=False):
         self.cmd = cmd
-        self.headers = headers if headers is not None else {}
-        self.original_headers = copy.copy(self.headers)
-        self.body = body
+        self.headers = self._initial_headers = headers if headers is not None else {}
+        if lazy_body:
+            self._raw_body = body
+            self._body = _PENDING
+            self._encoding = encoding
+        else:
+            self._raw_body = None
+            self._body = body
+            self._encoding = None
+
+    @property
+    def body(self):
+        """
+        The content of the frame. For received frames this is decoded to a string (using the connection's encoding)
+        or copied to bytes the first time it is read, and cached afterwards.
+        """
+        if self._body is _PENDING:
+            if self._encoding is not None:
+                self._body = decode(self._raw_body, self._encoding)
+            else:
+                self._body = bytes(self._raw_body)
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._raw_body = None
+        self._body = body
+
+    @property
+    def original_headers(self):
+        """
+        The headers of the frame before any modification (for example by a listener's on_before_message). The
+        headers are only copied when they are first modified (or this attribute is read, if that's sooner). For
+        received frames, any change is tracked. The headers of other frames are the map the frame was created with,
+        so only changes made with :py:meth:`set_header` are tracked.
+        """
+        initial = self._initial_headers
+        if isinstance(initial, LazyHeaders):
+            return initial.original()
+        if initial is self.headers:
+            initial = self._initial_headers = copy.copy(initial)
+        return initial
+
+    @original_headers.setter
+    def original_headers(self, original_headers):
+        self._initial_headers = original_headers
+
+    def set_header(self, key, value):
+        """
+        Set a header, keeping the previous headers for :py:attr:`original_headers` if this is the first change.
+
+        :param str key: the header name
+        :param value: the header value
+        """
+        headers = self.headers
+        if self._initial_headers is headers and not isinstance(headers, LazyHeaders):
+            self._initial_headers = copy.copy(headers)
+        headers[key] = value
+
+    @property
+    def raw_body(self):
+        """
+        The content of the frame as received, without any decoding. For received frames this is bytes, or (for
+        bodies larger than BODY_VIEW_THRESHOLD) a read-only memoryview over the frame data.
+        """
+        if self._raw_body is not None:
+            return self._raw_body
+        return self._body
 
     def __str__(self):
         return "{cmd=%s,headers=[%s],body=%s}" % (self.cmd, self.headers, self.body)
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from stomp.aio import AsyncStompConnection
+from stomp.exception import ConnectFailedException, ErrorFrameException
+
+from .testutils import *
+
+
+def run(test, **kwargs):
+    broker = FakeBroker(**kwargs)
+    try:
+        asyncio.run(asyncio.wait_for(test(broker), 10))
+    finally:
+        broker.close()
+
+
+class TestAsyncConnection(object):
+    def test_send_and_receive(self):
+        async def test(broker):
+            async with AsyncStompConnection([("127.0.0.1", broker.port)]) as conn:
+                await conn.connect("admin", "password")
+                assert conn.is_connected()
+                subscription = await conn.subscribe("/queue/test", ack="client-individual")
+                for i in range(3):
+                    receipt = await conn.send("/queue/test", "message %s" % i, receipt=True)
+                    assert "RECEIPT" == (await receipt).cmd
+                received = []
+                async for frame in subscription:
+                    received.append(frame.body)
+                    await conn.ack(frame.headers["ack"])
+                    if len(received) == 3:
+                        await subscription.unsubscribe()
+                assert ["message 0", "message 1", "message 2"] == received
+            assert not conn.is_connected()
+            assert ["STOMP", "SUBSCRIBE", "SEND", "SEND", "SEND", "ACK", "ACK", "ACK", "UNSUBSCRIBE",
+                    "DISCONNECT"] == [f.cmd for f in broker.frames[0]]
+            assert "admin" == broker.frames[0][0].headers["login"]
+        run(test)
+
+    def test_error_fails_receipt(self):
+        async def test(broker):
+            conn = AsyncStompConnection([("127.0.0.1", broker.port)])
+            await conn.connect()
+            receipt = await conn.send("/queue/error", "test", receipt="r1")
+            with pytest.raises(ErrorFrameException):
+                await receipt
+            assert "rejected" == conn.last_error.headers["message"]
+            await conn.disconnect()
+        run(test)
+
+    def test_heartbeats(self):
+        async def test(broker):
+            conn = AsyncStompConnection([("127.0.0.1", broker.port)], heartbeats=(50, 0))
+            await conn.connect()
+            await asyncio.sleep(0.3)
+            assert conn.is_connected()
+            await conn.disconnect()
+            assert broker.heartbeats_received >= 3
+        run(test, heartbeat="0,50")
+
+    def test_paused_reads_dont_time_out(self):
+        async def test(broker):
+            conn = AsyncStompConnection([("127.0.0.1", broker.port)], heartbeats=(0, 50))
+            await conn.connect()
+            subscription = await conn.subscribe("/queue/test", max_queued=1)
+            for i in range(3):
+                await conn.send("/queue/test", "message %s" % i)
+            # the subscription's queue is full, so reading stops for longer than the heartbeat timeout
+            await asyncio.sleep(0.3)
+            assert conn.is_connected()
+            received = []
+            async for frame in subscription:
+                received.append(frame.body)
+                if len(received) == 3:
+                    break
+            await asyncio.sleep(0.2)
+            assert conn.is_connected()
+            await conn.disconnect()
+        run(test, heartbeat="50,0")
+
+    def test_connect_failed(self):
+        async def test(broker):
+            conn = AsyncStompConnection([("127.0.0.1", 1)])
+            with pytest.raises(ConnectFailedException):
+                await conn.connect()
+        run(test)
@@ -88,6 +88,22 @@ class TestBasic(object):
         assert listener.messages == 3, "should have received 3 messages"
         assert listener.errors == 0, "should not have received any errors"
 
+    def test_send_many(self, conn):
+        timestamp = time.strftime("%Y%m%d%H%M%S")
+        queuename = "/queue/test2-many-%s" % timestamp
+        conn.subscribe(destination=queuename, id=1, ack="auto")
+        messages = [(queuename, "this is test %s" % i, None) for i in range(5)]
+        trans_id = conn.send_many(messages, transactional=True, receipt="123")
+        assert trans_id is not None
+
+        listener = conn.get_listener("testlistener")
+        listener.wait_on_receipt()
+        listener.wait_for_message()
+        time.sleep(3)
+
+        assert listener.messages == 5, "should have received 5 messages"
+        assert listener.errors == 0, "should not have received any errors"
+
     def test_abort(self, conn):
         timestamp = time.strftime("%Y%m%d%H%M%S")
         queuename = "/queue/test3-%s" % timestamp
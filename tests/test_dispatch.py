@@ -0,0 +1,157 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import stomp
+from stomp.dispatch import ProcessPoolDispatcher, ThreadPoolDispatcher
+from stomp.utils import Frame
+
+
+def message(subscription, body, **headers):
+    headers["subscription"] = subscription
+    return Frame("MESSAGE", headers, body)
+
+
+class TestThreadPoolDispatcher(object):
+    def test_ordering_per_key(self):
+        dispatcher = ThreadPoolDispatcher(max_workers=4)
+        received = {"1": [], "2": []}
+
+        def handler(frame):
+            time.sleep(0.001)
+            received[frame.headers["subscription"]].append(frame.body)
+
+        for i in range(50):
+            dispatcher.dispatch(message("1", i), (handler,))
+            dispatcher.dispatch(message("2", i), (handler,))
+        assert dispatcher.wait(10)
+        assert list(range(50)) == received["1"]
+        assert list(range(50)) == received["2"]
+        dispatcher.shutdown()
+
+    def test_keys_run_in_parallel(self):
+        dispatcher = ThreadPoolDispatcher(max_workers=2, ordering_key="JMSXGroupID")
+        barrier = threading.Barrier(2, timeout=5)
+        handled = []
+
+        def handler(frame):
+            # only completes if both groups are being handled at the same time
+            barrier.wait()
+            handled.append(frame.body)
+
+        dispatcher.dispatch(message("1", "a", JMSXGroupID="a"), (handler,))
+        dispatcher.dispatch(message("1", "b", JMSXGroupID="b"), (handler,))
+        assert dispatcher.wait(10)
+        assert ["a", "b"] == sorted(handled)
+        dispatcher.shutdown()
+
+    def test_max_pending(self):
+        dispatcher = ThreadPoolDispatcher(max_workers=1, max_pending=1)
+        release = threading.Event()
+        dispatcher.dispatch(message("1", "first"), (lambda frame: release.wait(5),))
+
+        second = threading.Thread(target=dispatcher.dispatch, args=(message("1", "second"), (lambda frame: None,)))
+        second.start()
+        time.sleep(0.1)
+        assert second.is_alive()
+        release.set()
+        second.join(5)
+        assert dispatcher.wait(5)
+        dispatcher.shutdown()
+
+    def test_handler_errors(self):
+        dispatcher = ThreadPoolDispatcher(max_workers=1)
+        received = []
+
+        def handler(frame):
+            if frame.body == "bad":
+                raise ValueError()
+            received.append(frame.body)
+
+        dispatcher.dispatch(message("1", "bad"), (handler,))
+        dispatcher.dispatch(message("1", "good"), (handler,))
+        assert dispatcher.wait(5)
+        assert ["good"] == received
+        dispatcher.shutdown()
+
+    def test_transport_dispatch(self):
+        transport = stomp.transport.BaseTransport()
+        received = []
+
+        class MessageListener(stomp.ConnectionListener):
+            def on_message(self, frame):
+                received.append((self.internal, threading.current_thread()))
+
+        class InternalListener(MessageListener):
+            internal = True
+
+        transport.set_listener("messages", MessageListener())
+        transport.set_listener("internal", InternalListener())
+        dispatcher = ThreadPoolDispatcher(max_workers=1)
+        transport.set_message_dispatcher(dispatcher)
+        transport.process_frame(message("1", "body"), None)
+        assert dispatcher.wait(5)
+        # the internal listener is called on the receiver thread, before the message is dispatched
+        assert (True, threading.current_thread()) == received[0]
+        assert 2 == len(received)
+        assert threading.current_thread() != received[1][1]
+        dispatcher.shutdown()
+
+
+def checksum_handler(headers, body):
+    if bytes(body[:3]) == b"bad":
+        raise ValueError("bad message")
+    return sum(body)
+
+
+class AckRecorder(object):
+    version = "1.2"
+
+    def __init__(self):
+        self.acks = []
+
+    def ack(self, id, transaction=None, receipt=None):
+        self.acks.append(("ack", id))
+
+    def nack(self, id, transaction=None, receipt=None):
+        self.acks.append(("nack", id))
+
+
+class TestProcessPoolDispatcher(object):
+    def test_acks(self):
+        connection = AckRecorder()
+        dispatcher = ProcessPoolDispatcher(connection, checksum_handler, max_workers=2, shared_memory_threshold=1024)
+        try:
+            dispatcher.on_send(Frame("SUBSCRIBE", {"id": "1", "destination": "/queue/a", "ack": "client-individual"}))
+            dispatcher.on_send(Frame("SUBSCRIBE", {"id": "2", "destination": "/queue/b", "ack": "client"}))
+            dispatcher.on_send(Frame("SUBSCRIBE", {"id": "3", "destination": "/queue/c", "ack": "auto"}))
+
+            dispatcher.on_message(message("1", b"x" * 100000, ack="1-big"))
+            dispatcher.on_message(message("1", b"bad", ack="1-bad"))
+            dispatcher.on_message(message("3", b"auto", ack="3-auto"))
+            for i in range(5):
+                dispatcher.on_message(message("2", b"message", ack="2-%s" % i))
+            assert dispatcher.wait(30)
+
+            individual = sorted(a for a in connection.acks if a[1].startswith("1-"))
+            assert [("ack", "1-big"), ("nack", "1-bad")] == individual
+            cumulative = [a for a in connection.acks if a[1].startswith("2-")]
+            # acks are cumulative, so there may be fewer than 5, but the last one must cover every message
+            assert ("ack", "2-4") == cumulative[-1]
+            assert not [a for a in connection.acks if a[1].startswith("3-")]
+        finally:
+            dispatcher.shutdown()
+
+    def test_submit_errors(self):
+        connection = AckRecorder()
+        executor = ThreadPoolExecutor(1)
+        executor.shutdown()
+        dispatcher = ProcessPoolDispatcher(connection, checksum_handler, executor=executor)
+        dispatcher.on_send(Frame("SUBSCRIBE", {"id": "1", "destination": "/queue/a", "ack": "client"}))
+        with pytest.raises(RuntimeError):
+            dispatcher.on_message(message("1", b"message", ack="1-0"))
+        # the message is nacked, rather than holding up the acks of the messages after it
+        assert [("nack", "1-0")] == connection.acks
+        assert dispatcher.wait(0)
@@ -0,0 +1,55 @@
+import pytest
+
+import stomp
+from stomp.exception import NotConnectedException
+
+from .testutils import *
+
+
+def connected_to(connection, broker):
+    return connection is not None and connection.transport.current_host_and_port == ("127.0.0.1", broker.port)
+
+
+def sent_to(broker):
+    return [frame.body for frames in broker.frames for frame in frames if frame.cmd == "SEND"]
+
+
+class TestFailoverConnection(object):
+    def test_failover_to_standby(self):
+        brokers = [FakeBroker(), FakeBroker()]
+        conn = stomp.FailoverConnection([("127.0.0.1", broker.port) for broker in brokers], retry_sleep=0.05,
+                                        reconnect_sleep_initial=0.01, reconnect_attempts_max=1)
+        listener = stomp.listener.TestListener(print_to_log=True)
+        conn.set_listener("testlistener", listener)
+        try:
+            conn.connect("admin", "password")
+            assert connected_to(conn.primary, brokers[0])
+            assert wait_for(lambda: connected_to(conn.standby, brokers[1]))
+            assert conn.standby.get_listener("testlistener") is listener
+
+            conn.send("/queue/test", "before")
+            assert wait_for(lambda: sent_to(brokers[0]) == ["before"])
+
+            # the first broker goes away - sending continues on the standby straight away
+            lost = conn.primary
+            brokers[0].close()
+            brokers[0].drop()
+            assert wait_for(lambda: connected_to(conn.primary, brokers[1]))
+            # the lost connection is shut down, and no longer has the listeners
+            assert wait_for(lambda: lost.get_listener("testlistener") is None)
+            assert not lost.transport.running
+            conn.send("/queue/test", "after")
+            assert wait_for(lambda: sent_to(brokers[1]) == ["after"])
+            assert 1 == conn.stats["failovers"]
+
+            # with only one broker left, the new standby is a second connection to it
+            assert wait_for(lambda: connected_to(conn.standby, brokers[1]))
+            assert conn.standby is not conn.primary
+            assert 2 == conn.stats["standby_connects"]
+        finally:
+            conn.disconnect()
+            for broker in brokers:
+                broker.close()
+        assert not conn.is_connected()
+        with pytest.raises(NotConnectedException):
+            conn.send("/queue/test", "closed")
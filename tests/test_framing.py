@@ -0,0 +1,118 @@
+from stomp.framing import FrameDecoder, FrameEncoder
+from stomp.utils import Frame, convert_frame, pack
+
+
+def decode_all(decoder, *chunks):
+    frames = []
+    for chunk in chunks:
+        decoder.feed(chunk)
+        frames.extend(decoder.decode())
+    return frames
+
+
+class TestFrameDecoder(object):
+    def test_single_frame(self):
+        decoder = FrameDecoder()
+        assert [b"MESSAGE\ndestination:/queue/a\n\nhello"] == \
+            decode_all(decoder, b"MESSAGE\ndestination:/queue/a\n\nhello\x00")
+        assert 0 == len(decoder)
+
+    def test_multiple_frames_in_one_chunk(self):
+        decoder = FrameDecoder()
+        frames = decode_all(decoder, b"RECEIPT\nreceipt-id:1\n\n\x00\nRECEIPT\nreceipt-id:2\n\n\x00\n\n")
+        assert [b"RECEIPT\nreceipt-id:1\n\n", b"RECEIPT\nreceipt-id:2\n\n"] == frames
+        assert 0 == len(decoder)
+
+    def test_frame_without_preamble_end(self):
+        decoder = FrameDecoder()
+        assert [b"FOO"] == decode_all(decoder, b"FOO\x00")
+
+    def test_one_byte_at_a_time(self):
+        data = b"MESSAGE\r\ncontent-type:text/plain\r\n\r\nHello\n...world!\x00\n"
+        decoder = FrameDecoder()
+        frames = decode_all(decoder, *[data[i:i + 1] for i in range(len(data))])
+        assert [data[:-2]] == frames
+        assert 0 == len(decoder)
+
+    def test_content_length_with_null_bytes(self):
+        body = b"abc\x00\x00def"
+        data = b"MESSAGE\ncontent-length:%d\n\n%s\x00" % (len(body), body)
+        decoder = FrameDecoder()
+        assert [] == decode_all(decoder, data[:20], data[20:-1])
+        assert 1 == decoder.bytes_needed()
+        assert [data[:-1]] == decode_all(decoder, data[-1:])
+
+    def test_content_length_too_short(self):
+        data = b"MESSAGE\ncontent-length:2\n\nabcdef\x00"
+        decoder = FrameDecoder()
+        assert [data[:-1]] == decode_all(decoder, data)
+
+    def test_partial_frame_retained(self):
+        decoder = FrameDecoder()
+        assert [b"ERROR\n\n"] == decode_all(decoder, b"ERROR\n\n\x00MESSAGE\nfoo:")
+        assert len(b"MESSAGE\nfoo:") == len(decoder)
+        assert [b"MESSAGE\nfoo:bar\n\nbody"] == decode_all(decoder, b"bar\n\nbody\x00")
+
+    def test_reset(self):
+        decoder = FrameDecoder()
+        decode_all(decoder, b"MESSAGE\ncontent-length:100\n\n")
+        decoder.reset()
+        assert 0 == len(decoder)
+        assert [b"ERROR\n\n"] == decode_all(decoder, b"ERROR\n\n\x00")
+
+
+class TestFrameEncoder(object):
+    def test_same_output_as_convert_frame(self):
+        encoder = FrameEncoder()
+        for body in ("first message", "second, longer message", ""):
+            for receipt in (None, "receipt-1"):
+                headers = {"destination": "/queue/a", "content-type": "text/plain", "content-length": 1,
+                           "receipt": receipt, "multi": ("1", "2"), "custom": None}
+                expected = pack(convert_frame(Frame("SEND", dict(headers), body)))
+                assert expected == pack(encoder.encode(Frame("SEND", headers, body)))
+        assert 2 == encoder.cache_misses
+        assert 4 == encoder.cache_hits
+
+    def test_values_written_differently(self):
+        encoder = FrameEncoder()
+        for persistent in (True, 1, 1.0, "1", ("1", True), [1]):
+            frame = Frame("SEND", {"destination": "/queue/a", "persistent": persistent}, "body")
+            assert pack(convert_frame(frame)) == pack(encoder.encode(frame))
+        # 1 and "1" are written the same, so share a cached header block
+        assert 5 == encoder.cache_misses
+
+    def test_uncached_commands(self):
+        encoder = FrameEncoder()
+        frame = Frame("SUBSCRIBE", {"destination": "/queue/a", "id": "1", "ack": "auto"})
+        assert pack(convert_frame(frame)) == pack(encoder.encode(frame))
+        assert [b"\n"] == encoder.encode(Frame(None, {}, None))
+        assert 0 == encoder.cache_misses
+
+    def test_lru_eviction(self):
+        encoder = FrameEncoder(cache_size=2)
+        for destination in ("/queue/a", "/queue/b", "/queue/a", "/queue/c", "/queue/b"):
+            encoder.encode(Frame("SEND", {"destination": destination}, "body"))
+        assert 4 == encoder.cache_misses
+        assert 1 == encoder.cache_hits
+
+    def test_per_message_headers(self):
+        encoder = FrameEncoder()
+        for i in range(1000):
+            frame = Frame("SEND", {"destination": "/queue/a", "correlation-id": str(i), "content-length": 4}, "body")
+            assert pack(convert_frame(Frame("SEND", dict(frame.headers), "body"))) == pack(encoder.encode(frame))
+        # after a poor hit rate, frames are converted without the cache
+        assert encoder.probe_frames == encoder.cache_misses
+        assert 1000 - encoder.probe_frames == encoder.cache_bypassed
+
+        encoder = FrameEncoder(varying_headers=["content-length", "correlation-id"])
+        for i in range(1000):
+            frame = Frame("SEND", {"destination": "/queue/a", "correlation-id": str(i), "content-length": 4}, "body")
+            assert pack(convert_frame(Frame("SEND", dict(frame.headers), "body"))) == pack(encoder.encode(frame))
+        assert 1 == encoder.cache_misses
+        assert 999 == encoder.cache_hits
+        assert 0 == encoder.cache_bypassed
+
+    def test_unsorted_headers(self):
+        encoder = FrameEncoder(sort_headers=False)
+        frame = Frame("SEND", {"destination": "/queue/a", "content-length": 4, "a": "1"}, "body")
+        assert b"SEND\ndestination:/queue/a\na:1\ncontent-length:4\n\nbody\x00" == pack(encoder.encode(frame))
@@ -0,0 +1,79 @@
+import socket
+import time
+
+import stomp
+from stomp.hosts import HostSelector
+
+
+class TestHostSelector(object):
+    def test_circuit_breaker(self):
+        selector = HostSelector(failure_threshold=2, cooldown=0.2)
+        (a, b, c) = (("a", 1), ("b", 2), ("c", 3))
+        assert [a, b, c] == selector.order([a, b, c])
+
+        selector.record_connect(a, 0.5)
+        selector.record_connect(b, 0.1)
+        selector.record_rtt(b, 0.1)
+        # c hasn't been measured, so keeps its place ahead of the slower hosts
+        assert [c, b, a] == selector.order([a, b, c])
+
+        selector.record_failure(b)
+        assert [c, a, b] == selector.order([a, b, c])
+        selector.record_failure(b)
+        assert selector.get_state(b)["open"]
+        assert not selector.is_available(b)
+        assert [c, a] == selector.order([a, b, c])
+
+        # once the cooldown is over, one attempt is let through at a time
+        time.sleep(0.25)
+        assert [c, a, b] == selector.order([a, b, c])
+        assert [c, a] == selector.order([a, b, c])
+        selector.record_connect(b, 0.1)
+        assert {"failures": 0, "total_failures": 2, "connects": 2, "connect_latency": 0.1, "receipt_rtt": 0.1,
+                "open": False} == selector.get_state(b)
+        assert [c, b, a] == selector.order([a, b, c])
+
+    def test_shared_by_transports(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(("127.0.0.1", 0))
+        down = ("127.0.0.1", closed.getsockname()[1])
+        closed.close()
+        up = ("127.0.0.1", server.getsockname()[1])
+
+        selector = HostSelector(failure_threshold=1, cooldown=60)
+        try:
+            transport = stomp.transport.Transport([down, up], host_selector=selector)
+            transport.running = True
+            transport.attempt_connection()
+            assert up == transport.current_host_and_port
+            transport.disconnect_socket()
+            assert selector.get_state(down)["open"]
+            assert 1 == selector.get_state(up)["connects"]
+
+            # the next transport doesn't try the host which is down
+            transport = stomp.transport.Transport([down, up], host_selector=selector)
+            transport.running = True
+            transport.attempt_connection()
+            assert up == transport.current_host_and_port
+            assert 1 == selector.get_state(down)["total_failures"]
+
+            # receipt round trip times are recorded against the host
+            future = transport.expect_receipt("1")
+            transport.process_frame(stomp.utils.Frame("RECEIPT", {"receipt-id": "1"}), None)
+            assert future.done()
+            assert selector.get_state(up)["receipt_rtt"] is not None
+            transport.disconnect_socket()
+
+            # when racing connections, the hosts which fail are recorded even though another host won
+            selector = HostSelector(failure_threshold=1, cooldown=60)
+            transport = stomp.transport.Transport([down, up], host_selector=selector, connect_stagger=5)
+            transport.running = True
+            transport.attempt_connection()
+            assert up == transport.current_host_and_port
+            assert selector.get_state(down)["open"]
+            transport.disconnect_socket()
+        finally:
+            server.close()
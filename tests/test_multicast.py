@@ -34,6 +34,23 @@ class TestMulticast(object):
 
         validate_send(conn, 1, 1, 0)
 
+    def testsubscribecallback(self, conn):
+        listener = conn.get_listener("testlistener")
+        queuename = "/queue/test1-%s" % listener.timestamp
+        received = []
+        conn.subscribe(destination=queuename, id=1, ack="auto", callback=received.append)
+        conn.subscribe(destination=queuename + "-other", id=2, ack="auto", callback=lambda frame: None)
+
+        conn.send(body="this is a test", destination=queuename, receipt="123")
+
+        validate_send(conn, 1, 1, 0)
+        assert 1 == len(received)
+        assert b"this is a test" == received[0].body
+        assert "1" == received[0].headers["subscription"]
+
+        conn.unsubscribe(1)
+        assert conn.get_listener("subscription-router").get_handler(1) is None
+
     def testunsubscribe(self, conn):
         listener = conn.get_listener("testlistener")
         queuename = "/queue/test1-%s" % listener.timestamp
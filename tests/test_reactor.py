@@ -0,0 +1,99 @@
+import socket
+import threading
+import time
+
+import stomp
+from stomp.reactor import Reactor
+
+from .testutils import *
+
+
+class ThreadRecordingListener(stomp.listener.TestListener):
+    def __init__(self):
+        stomp.listener.TestListener.__init__(self, print_to_log=True)
+        self.threads = set()
+
+    def on_message(self, frame):
+        self.threads.add(threading.current_thread())
+        stomp.listener.TestListener.on_message(self, frame)
+
+
+class TestReactor(object):
+    def test_many_connections_one_thread(self):
+        broker = FakeBroker()
+        reactor = Reactor()
+        threads_before = threading.active_count()
+        connections = []
+        try:
+            for i in range(20):
+                conn = stomp.Connection12([("127.0.0.1", broker.port)], reactor=reactor)
+                listener = ThreadRecordingListener()
+                conn.set_listener("testlistener", listener)
+                conn.connect(wait=True)
+                conn.subscribe("/queue/test-%s" % i, id=i)
+                connections.append((conn, listener))
+            assert 20 == len(reactor)
+            # just the reactor thread (plus the broker's threads), rather than a receiver thread per connection
+            assert threading.active_count() - threads_before <= 1 + 1 + 20
+
+            for (i, (conn, listener)) in enumerate(connections):
+                conn.send("/queue/test-%s" % i, "message %s" % i)
+            for (i, (conn, listener)) in enumerate(connections):
+                listener.wait_for_message()
+                assert "message %s" % i == listener.message_list[0][1]
+                assert set([reactor.reactor_thread]) == listener.threads
+        finally:
+            for (conn, listener) in connections:
+                conn.disconnect(receipt=None)
+            broker.close()
+
+        deadline = time.monotonic() + 5
+        while reactor.reactor_thread is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert 0 == len(reactor)
+        assert reactor.reactor_thread is None
+        for (conn, listener) in connections:
+            assert 1 == listener.disconnects
+
+    def test_connection_lost(self):
+        broker = FakeBroker()
+        reactor = Reactor()
+        conn = stomp.Connection12([("127.0.0.1", broker.port)], reactor=reactor)
+        listener = ThreadRecordingListener()
+        conn.set_listener("testlistener", listener)
+        try:
+            conn.connect(wait=True)
+            conn.subscribe("/queue/test", id=1)
+            # a large message, received in many reads
+            body = "x" * 1000000
+            conn.send("/queue/test", body)
+            listener.wait_for_message()
+            assert body == listener.message_list[0][1]
+        finally:
+            broker.close()
+        conn.transport.socket.shutdown(socket.SHUT_RDWR)
+        listener.wait_on_disconnected()
+        assert not conn.is_connected()
+
+    def test_listener_error(self):
+        broker = FakeBroker()
+        reactor = Reactor()
+        conn = stomp.Connection12([("127.0.0.1", broker.port)], reactor=reactor)
+        listener = stomp.listener.TestListener(print_to_log=True)
+        conn.set_listener("testlistener", listener)
+
+        class FailingListener(stomp.ConnectionListener):
+            def on_message(self, frame):
+                raise RuntimeError("failed")
+
+        conn.set_listener("failing", FailingListener())
+        try:
+            conn.connect(wait=True)
+            conn.subscribe("/queue/test", id=1)
+            conn.send("/queue/test", "message")
+            # the error closes the connection, rather than the reactor trying to read from it again
+            listener.wait_on_disconnected()
+            assert 0 == len(reactor)
+        finally:
+            conn.transport.stop()
+            broker.close()
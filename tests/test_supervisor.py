@@ -0,0 +1,50 @@
+import time
+
+import stomp
+
+from .testutils import *
+
+
+class TestReconnectSupervisor(object):
+    def test_reconnect_and_resubscribe(self):
+        broker = FakeBroker()
+        conn = stomp.Connection12([("127.0.0.1", broker.port)], reconnect_sleep_initial=0.05, auto_reconnect=True)
+        try:
+            conn.connect("admin", "password", wait=True)
+            for i in range(100):
+                conn.subscribe("/queue/test-%d" % i, id=i, ack="client-individual")
+            conn.unsubscribe(id=0)
+            assert 99 == len(conn.supervisor.subscriptions())
+
+            assert wait_for(lambda: len(broker.frames[0]) == 102)
+            broker.drop()
+            assert wait_for(lambda: conn.supervisor.stats["recoveries"] == 1)
+            assert conn.is_connected()
+
+            frames = broker.frames[1]
+            assert "STOMP" == frames[0].cmd
+            assert "admin" == frames[0].headers["login"]
+            assert ["/queue/test-%d" % i for i in range(1, 100)] == [f.headers["destination"] for f in frames[1:]]
+            assert all(f.headers["ack"] == "client-individual" for f in frames[1:])
+            assert "receipt" in frames[-1].headers
+            assert 99 == conn.supervisor.stats["resubscribed"]
+
+            # a disconnect by the client isn't recovered
+            conn.disconnect(receipt="bye")
+            time.sleep(0.5)
+            assert 2 == len(broker.connections)
+            assert not conn.is_connected()
+        finally:
+            broker.close()
+
+    def test_gives_up_when_broker_is_gone(self):
+        broker = FakeBroker()
+        conn = stomp.Connection12([("127.0.0.1", broker.port)], reconnect_sleep_initial=0.01,
+                                  reconnect_sleep_max=0.05, reconnect_attempts_max=2, auto_reconnect=True)
+        conn.connect(wait=True)
+        conn.subscribe("/queue/test", id=1)
+        broker.close()
+        broker.drop()
+        assert wait_for(lambda: conn.supervisor.stats["failures"] == 1)
+        assert conn.supervisor.recovery_thread is None
+        assert not conn.is_connected()
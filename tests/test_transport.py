@@ -1,8 +1,16 @@
+import mmap
+import os
+import socket
+import threading
+import time
+
 import pytest
 
 import stomp
 from stomp import logging
 
+from .testutils import wait_for
+
 
 @pytest.fixture
 def stomp_transport():
@@ -40,3 +48,698 @@ class TestTransport(object):
         stomp_transport.cleanup()
         stomp_transport.attempt_connection()
         stomp_transport.disconnect_socket()
+
+    def test_receive_into_reusable_buffer(self):
+        transport = stomp.transport.Transport(recv_bytes=16, recv_into=True, recv_bytes_max=64)
+        transport.socket, peer = socket.socketpair()
+        try:
+            peer.sendall(b"x" * 16)
+            assert b"x" * 16 == bytes(transport.receive())
+            assert 1 == transport.recv_stats["allocations"]
+
+            # the previous read filled the buffer, so the next one should be larger
+            peer.sendall(b"y" * 100)
+            assert b"y" * 32 == bytes(transport.receive())
+            assert b"y" * 64 == bytes(transport.receive())
+            assert b"y" * 4 == bytes(transport.receive())
+            assert 3 == transport.recv_stats["allocations"]
+            assert 64 == transport.recv_stats["buffer_size"]
+            assert 4 == transport.recv_stats["calls"]
+            assert 116 == transport.recv_stats["bytes"]
+        finally:
+            peer.close()
+            transport.socket.close()
+
+    def test_send_buffers_without_joining(self):
+        transport = stomp.transport.Transport()
+        transport.socket, peer = socket.socketpair()
+        # force partial writes
+        transport.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        received = bytearray()
+        body = mmap.mmap(-1, 300000)
+        body[:] = b"0123456789" * 30000
+
+        def reader():
+            while True:
+                data = peer.recv(65536)
+                if not data:
+                    break
+                received.extend(data)
+
+        reader_thread = threading.Thread(target=reader)
+        reader_thread.start()
+        try:
+            transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/a", "content-length": 0}, body))
+            transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/b"}, bytearray(b"small")))
+        finally:
+            transport.socket.close()
+            reader_thread.join()
+            peer.close()
+        assert received == b"SEND\ncontent-length:300000\ndestination:/queue/a\n\n" + body[:] + \
+            b"\x00SEND\ndestination:/queue/b\n\nsmall\x00"
+        body.close()
+
+    def test_coalesced_writes(self):
+        transport = stomp.transport.Transport(coalesce_writes=True)
+        transport.socket, peer = socket.socketpair()
+        transport.writer.max_delay = 60.0
+        try:
+            for i in range(10):
+                transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/a"}, "message %s" % i))
+            assert 0 == transport.writer.stats["writes"]
+
+            # a control frame is sent immediately, after the queued frames
+            transport.transmit(stomp.utils.Frame("SUBSCRIBE", {"destination": "/queue/b", "id": "1"}))
+            assert 1 == transport.writer.stats["writes"]
+            assert 11 == transport.writer.stats["frames"]
+
+            # a "sync" header is just a header, and the message is queued
+            conn = stomp.Connection12()
+            conn.transport = transport
+            conn.send("/queue/a", "synced", sync="true")
+            assert 1 == transport.writer.stats["writes"]
+            transport.flush()
+            assert 2 == transport.writer.stats["writes"]
+            conn.send("/queue/a", "now", send_immediately=True)
+            assert 3 == transport.writer.stats["writes"]
+
+            transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/a"}, "last"))
+            transport.flush()
+            assert 4 == transport.writer.stats["writes"]
+
+            peer.settimeout(5)
+            expected = b"".join([b"SEND\ndestination:/queue/a\n\nmessage %d\x00" % i for i in range(10)]) + \
+                b"SUBSCRIBE\ndestination:/queue/b\nid:1\n\n\x00" \
+                b"SEND\ncontent-length:6\ndestination:/queue/a\nsync:true\n\nsynced\x00" \
+                b"SEND\ncontent-length:3\ndestination:/queue/a\n\nnow\x00" \
+                b"SEND\ndestination:/queue/a\n\nlast\x00"
+            received = b""
+            while len(received) < len(expected):
+                received += peer.recv(65536)
+            assert expected == received
+        finally:
+            transport.writer.close()
+            peer.close()
+            transport.socket.close()
+
+    def test_coalesced_write_errors(self):
+        class SendErrorListener(stomp.ConnectionListener):
+            def __init__(self):
+                self.failed = []
+
+            def on_send_error(self, frame, error):
+                self.failed.append(frame.body)
+
+        transport = stomp.transport.Transport(coalesce_writes=True)
+        listener = SendErrorListener()
+        transport.set_listener("send-errors", listener)
+        transport.socket, peer = socket.socketpair()
+        transport.writer.max_delay = 0.0
+        peer.close()
+        transport.socket.close()
+        try:
+            transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/a"}, "first"))
+            assert wait_for(lambda: ["first"] == listener.failed)
+            # the failed write isn't raised to the next caller, whose frame is queued (and reported in turn)
+            transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/a"}, "second"))
+            assert wait_for(lambda: ["first", "second"] == listener.failed)
+            transport.flush()
+            # a frame sent immediately raises its own error
+            with pytest.raises(OSError):
+                transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/a"}, "third"), sync=True)
+        finally:
+            transport.writer.close()
+
+    def test_coalesced_frames_discarded(self):
+        def wait_for_stats(writer, frames):
+            for _ in range(100):
+                if writer.stats["frames"] == frames:
+                    return True
+                time.sleep(0.01)
+            return False
+
+        class SendErrorListener(stomp.ConnectionListener):
+            def __init__(self):
+                self.failed = []
+
+            def on_send_error(self, frame, error):
+                self.failed.append((frame.body, type(error)))
+
+        transport = stomp.transport.Transport(coalesce_writes=True)
+        listener = SendErrorListener()
+        transport.set_listener("send-errors", listener)
+        transport.socket, peer = socket.socketpair()
+        transport.writer.max_frames = 2
+        errors = []
+
+        def blocked_write():
+            try:
+                transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/a"}, "fifth"))
+            except Exception as e:
+                errors.append(e)
+
+        # hold up the writer thread in the middle of a write
+        release = threading.Event()
+        send_buffers = transport.send_buffers
+        transport.send_buffers = lambda buffers: (release.wait(5), send_buffers(buffers))
+        try:
+            for body in ("first", "second", "third", "fourth"):
+                transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/a"}, body))
+            # the queue is full, so this caller waits
+            thread = threading.Thread(target=blocked_write)
+            thread.start()
+            time.sleep(0.1)
+            assert thread.is_alive()
+
+            transport.writer.close()
+            thread.join(5)
+            assert [stomp.exception.ConnectionClosedException] == [type(e) for e in errors]
+            assert [("third", stomp.exception.ConnectionClosedException),
+                    ("fourth", stomp.exception.ConnectionClosedException)] == listener.failed
+            # the frames being written when the writer was closed are still sent
+            release.set()
+            transport.send_buffers = send_buffers
+            assert wait_for_stats(transport.writer, 2)
+
+            # a failed write is reported to the listeners too
+            del listener.failed[:]
+            peer.close()
+            transport.socket.close()
+            transport.writer.max_frames = 1000
+            transport.writer.max_delay = 0.0
+            transport.transmit(stomp.utils.Frame("SEND", {"destination": "/queue/a"}, "lost"))
+            assert wait_for(lambda: listener.failed)
+            assert [("lost", OSError)] == [(body, OSError if issubclass(t, OSError) else t)
+                                           for (body, t) in listener.failed]
+        finally:
+            transport.writer.close()
+            peer.close()
+            transport.socket.close()
+
+    def test_send_many(self):
+        conn = stomp.Connection12()
+        sent = []
+        conn.set_listener("sent", type("SentListener", (stomp.ConnectionListener,), {"on_send": sent.append})())
+        conn.transport.socket, peer = socket.socketpair()
+        try:
+            transaction = conn.send_many([("/queue/a", "one", {"x": "a:b"}), ("/queue/b", b"two", None)],
+                                         transactional=True, receipt="r1")
+            assert ["BEGIN", "SEND", "SEND", "COMMIT"] == [f.cmd for f in sent]
+
+            expected = (b"BEGIN\ntransaction:%(t)s\n\n\x00"
+                        b"SEND\ncontent-length:3\ndestination:/queue/a\ntransaction:%(t)s\nx:a\\cb\n\none\x00"
+                        b"SEND\ncontent-length:3\ndestination:/queue/b\ntransaction:%(t)s\n\ntwo\x00"
+                        b"COMMIT\nreceipt:r1\ntransaction:%(t)s\n\n\x00") % {b"t": transaction.encode()}
+            peer.settimeout(5)
+            received = b""
+            while len(received) < len(expected):
+                received += peer.recv(65536)
+            assert expected == received
+        finally:
+            peer.close()
+            conn.transport.socket.close()
+
+    def test_receipt_futures(self):
+        conn = stomp.Connection12()
+        conn.transport.socket, peer = socket.socketpair()
+        try:
+            future = conn.send("/queue/a", "message", receipt=True)
+            receipt = peer.recv(65536).split(b"receipt:")[1].split(b"\n")[0].decode()
+            assert not future.done()
+            conn.transport.notify("receipt", stomp.utils.Frame("RECEIPT", {"receipt-id": receipt}))
+            assert "RECEIPT" == future.result(0).cmd
+
+            future = conn.send("/queue/a", "message", receipt=True)
+            conn.transport.notify("error", stomp.utils.Frame("ERROR", {"message": "failed"}))
+            with pytest.raises(stomp.exception.ErrorFrameException):
+                future.result(0)
+
+            future = conn.send("/queue/a", "message", receipt=True)
+            conn.transport.notify("disconnected")
+            with pytest.raises(stomp.exception.ConnectionClosedException):
+                future.result(0)
+        finally:
+            peer.close()
+            conn.transport.socket.close()
+
+    def test_confirmed_publisher(self):
+        conn = stomp.Connection12()
+        conn.transport.socket, peer = socket.socketpair()
+        publisher = stomp.ConfirmedPublisher(conn, window=2)
+        try:
+            first = publisher.send("/queue/a", "one")
+            publisher.send("/queue/a", "two")
+            assert 2 == publisher.pending()
+            assert not publisher.wait(0.01)
+
+            third = threading.Thread(target=publisher.send, args=("/queue/a", "three"))
+            third.start()
+            time.sleep(0.1)
+            # the window is full, so the third message hasn't been sent
+            assert third.is_alive()
+
+            peer.settimeout(5)
+            data = peer.recv(65536)
+            receipt = data.split(b"receipt:")[1].split(b"\n")[0].decode()
+            conn.transport.notify("receipt", stomp.utils.Frame("RECEIPT", {"receipt-id": receipt}))
+            third.join(5)
+            assert first.done()
+            assert 2 == publisher.pending()
+
+            conn.transport.notify("error", stomp.utils.Frame("ERROR", {"message": "failed"}))
+            with pytest.raises(stomp.exception.ErrorFrameException):
+                publisher.wait(5)
+            assert 0 == publisher.pending()
+        finally:
+            peer.close()
+            conn.transport.socket.close()
+
+    def test_listener_dispatch(self, stomp_transport):
+        calls = []
+
+        class MessageListener(stomp.ConnectionListener):
+            def __init__(self, name):
+                self.name = name
+
+            def on_message(self, frame):
+                calls.append((self.name, frame.body))
+
+        stomp_transport.set_listener("b", MessageListener("b"))
+        stomp_transport.set_listener("a", MessageListener("a"))
+        stomp_transport.set_listener("c", stomp.ConnectionListener())
+        stomp_transport.notify("message", stomp.utils.Frame("MESSAGE", {}, "1"))
+        assert [("a", "1"), ("b", "1")] == calls
+
+        stomp_transport.remove_listener("a")
+        stomp_transport.notify("message", stomp.utils.Frame("MESSAGE", {}, "2"))
+        assert ("b", "2") == calls[-1]
+        assert 3 == len(calls)
+
+    def test_subscription_router(self):
+        received = []
+        router = stomp.listener.SubscriptionRouter(default_handler=lambda frame: received.append(("default", frame)))
+        router.add_handler("1", lambda frame: received.append(("1", frame)))
+        router.add_handler(2, lambda frame: received.append(("2", frame)))
+        for subscription in ("1", "2", "3"):
+            router.on_message(stomp.utils.Frame("MESSAGE", {"subscription": subscription}))
+        assert ["1", "2", "default"] == [handler for (handler, _) in received]
+
+        router.remove_handler("1")
+        assert router.get_handler("1") is None
+        assert router.get_handler("2") is not None
+
+    def test_subscription_router_unsubscribe(self):
+        conn = stomp.Connection12()
+        conn.transport.socket, peer = socket.socketpair()
+        try:
+            conn.subscribe("/queue/a", id="a:b", callback=lambda frame: None)
+            router = conn.get_listener("subscription-router")
+            assert router.get_handler("a:b") is not None
+            conn.unsubscribe("a:b")
+            assert router.get_handler("a:b") is None
+            assert b"id:a\\cb" in peer.recv(65536)
+        finally:
+            peer.close()
+            conn.transport.socket.close()
+
+        conn = stomp.Connection10()
+        conn.transport.socket, peer = socket.socketpair()
+        try:
+            conn.subscribe("/queue/a", id="a", callback=lambda frame: None)
+            conn.subscribe("/queue/b", id="b", callback=lambda frame: None)
+            router = conn.get_listener("subscription-router")
+            conn.unsubscribe(destination="/queue/a")
+            assert router.get_handler("a") is None
+            assert router.get_handler("b") is not None
+        finally:
+            peer.close()
+            conn.transport.socket.close()
+
+    def test_receive_queue(self):
+        conn = stomp.Connection12(receive_queue_size=2)
+        conn.transport.running = True
+        assert conn.receive(0.01) is None
+
+        def receive_messages():
+            for i in range(3):
+                conn.transport.notify("message", stomp.utils.Frame("MESSAGE", {}, str(i)))
+        receiver = threading.Thread(target=receive_messages)
+        receiver.start()
+        time.sleep(0.1)
+        # the queue is full, so the (pretend) receiver thread is held up
+        assert receiver.is_alive()
+        assert conn.transport.receive_paused
+        assert 2 == len(conn.receive_queue)
+
+        assert "0" == conn.receive(1).body
+        receiver.join(5)
+        assert not conn.transport.receive_paused
+        conn.transport.notify("disconnected")
+        assert ["1", "2"] == [frame.body for frame in conn.messages()]
+        assert conn.receive() is None
+
+        stats = conn.receive_queue.stats
+        assert 3 == stats["queued"]
+        assert 3 == stats["received"]
+        assert 2 == stats["max_depth"]
+        assert 1 == stats["pauses"]
+        assert stats["max_queue_time"] >= 0.1
+
+    def test_flow_control(self):
+        flow = stomp.FlowControlListener(initial_window=5, min_window=2, max_window=50, target_delay=1.0,
+                                         smoothing=1.0)
+        flow.on_connected(stomp.utils.Frame("CONNECTED", {"server": "ActiveMQ/5.18.3"}))
+        assert "activemq.prefetchSize" == flow.get_prefetch_header()
+
+        subscribe = stomp.utils.Frame("SUBSCRIBE", {"id": "1", "destination": "/queue/a", "ack": "client-individual"})
+        flow.on_send(subscribe)
+        assert 5 == subscribe.headers["activemq.prefetchSize"]
+        # subscriptions with automatic acknowledgement aren't changed
+        subscribe = stomp.utils.Frame("SUBSCRIBE", {"id": "2", "destination": "/queue/b", "ack": "auto"})
+        flow.on_send(subscribe)
+        assert "activemq.prefetchSize" not in subscribe.headers
+
+        for i in range(3):
+            flow.on_message(stomp.utils.Frame("MESSAGE", {"subscription": "1", "ack": str(i)}, "body"))
+        flow.on_message(stomp.utils.Frame("MESSAGE", {"subscription": "2", "ack": "x"}, "body"))
+        assert 3 == flow.outstanding("1")
+        assert 3 == flow.outstanding()
+
+        flow.on_send(stomp.utils.Frame("ACK", {"id": "0"}))
+        time.sleep(0.1)
+        flow.on_send(stomp.utils.Frame("NACK", {"id": "1"}))
+        assert 1 == flow.outstanding("1")
+        # about 10 messages per second, so a 1 second target delay gives a window of about 10
+        assert 5 < flow.window("1") <= 10
+
+        flow.on_connected(stomp.utils.Frame("CONNECTED", {"server": "ActiveMQ-Artemis/2.31.2"}))
+        flow.on_disconnected()
+        assert 0 == flow.outstanding()
+        subscribe = stomp.utils.Frame("SUBSCRIBE", {"id": "1", "destination": "/queue/a", "ack": "client"})
+        flow.on_send(subscribe)
+        # the Artemis window is in bytes
+        assert flow.window("1") * 4 == subscribe.headers["consumer-window-size"]
+
+        flow.on_message(stomp.utils.Frame("MESSAGE", {"subscription": "1", "ack": "a"}, "body"))
+        flow.on_message(stomp.utils.Frame("MESSAGE", {"subscription": "1", "ack": "b"}, "body"))
+        flow.on_message(stomp.utils.Frame("MESSAGE", {"subscription": "1", "ack": "c"}, "body"))
+        # cumulative acknowledgement
+        flow.on_send(stomp.utils.Frame("ACK", {"id": "b"}))
+        assert 1 == flow.outstanding("1")
+        flow.on_send(stomp.utils.Frame("UNSUBSCRIBE", {"id": "1"}))
+        assert 0 == flow.outstanding()
+
+    def test_flow_control_window(self):
+        flow = stomp.FlowControlListener(initial_window=1, hold_timeout=5)
+        flow.on_connected(stomp.utils.Frame("CONNECTED", {"server": "ActiveMQ/5.18.3", "version": "1.2"}))
+        # the headers of sent frames have already been escaped
+        flow.on_send(stomp.utils.Frame("SUBSCRIBE", {"id": "sub\\c1", "destination": "/queue/a",
+                                                     "ack": "client-individual"}))
+        flow.on_message(stomp.utils.Frame("MESSAGE", {"subscription": "sub:1", "ack": "id:1"}, "body"))
+        assert 1 == flow.outstanding("sub:1")
+
+        # the window is exhausted, so the next message is held up until the first is acknowledged
+        receiver = threading.Thread(target=flow.on_message,
+                                    args=(stomp.utils.Frame("MESSAGE", {"subscription": "sub:1", "ack": "id:2"}),))
+        receiver.start()
+        time.sleep(0.1)
+        assert receiver.is_alive()
+        flow.on_send(stomp.utils.Frame("ACK", {"id": "id\\c1"}))
+        receiver.join(5)
+        assert not receiver.is_alive()
+        assert 1 == flow.stats["holds"]
+        assert 1 == flow.outstanding("sub:1")
+
+        flow.on_send(stomp.utils.Frame("UNSUBSCRIBE", {"id": "sub\\c1"}))
+        assert 0 == flow.outstanding()
+
+    def test_ack_batcher(self):
+        conn = stomp.Connection12()
+        conn.transport.socket, peer = socket.socketpair()
+        peer.settimeout(5)
+        batcher = stomp.AckBatcher(conn, max_acks=3, max_delay=60)
+        conn.set_ack_batcher(batcher)
+        try:
+            conn.subscribe("/queue/a", id=1, ack="client-individual")
+            conn.subscribe("/queue/b", id=2, ack="client")
+            peer.recv(65536)
+            for i in range(4):
+                for subscription in ("1", "2"):
+                    conn.transport.notify("message", stomp.utils.Frame(
+                        "MESSAGE", {"subscription": subscription, "ack": "%s-%s" % (subscription, i)}))
+
+            conn.ack("1-0")
+            conn.ack("1-1")
+            conn.ack("2-0")
+            conn.ack("2-1")
+            assert 0 == batcher.stats["frames"]
+            conn.ack("1-2")
+            # the batch for subscription 1 is full, so is sent in one write
+            assert [b"1-0", b"1-1", b"1-2"] == [line.split(b":")[1] for line in peer.recv(65536).split(b"\n")
+                                                 if line.startswith(b"id:")]
+
+            conn.ack("2-2")
+            conn.flush_acks()
+            # only the last cumulative ack is sent
+            assert [b"2-2"] == [line.split(b":")[1] for line in peer.recv(65536).split(b"\n")
+                                if line.startswith(b"id:")]
+
+            conn.ack("1-3")
+            conn.unsubscribe(1)
+            data = peer.recv(65536)
+            assert data.index(b"id:1-3") < data.index(b"UNSUBSCRIBE")
+            assert {"acks": 7, "frames": 5, "batches": 3} == batcher.stats
+
+            # a cumulative ack which is already covered (acked out of order) doesn't replace the batched one
+            conn.subscribe("/queue/d", id=4, ack="client")
+            for i in range(3):
+                conn.transport.notify("message", stomp.utils.Frame(
+                    "MESSAGE", {"subscription": "4", "ack": "4-%s" % i}))
+            assert batcher.add({"id": "4-2", "subscription": "4"})
+            assert not batcher.add({"id": "4-0", "subscription": "4"})
+            conn.flush_acks()
+            data = b""
+            while b"4-2" not in data:
+                data += peer.recv(65536)
+            assert [b"4-2"] == [line.split(b":")[1] for line in data.split(b"\n") if line.startswith(b"id:4-")]
+
+            # with a short delay, acks are sent by the flusher thread
+            conn.set_ack_batcher(stomp.AckBatcher(conn, max_acks=100, max_delay=0.01))
+            conn.subscribe("/queue/c", id=3, ack="client-individual")
+            conn.transport.notify("message", stomp.utils.Frame("MESSAGE", {"subscription": "3", "ack": "3-0"}))
+            conn.ack("3-0")
+            data = peer.recv(65536)
+            if b"3-0" not in data:
+                data += peer.recv(65536)
+            assert b"id:3-0" in data
+        finally:
+            conn.set_ack_batcher(None)
+            peer.close()
+            conn.transport.socket.close()
+
+    def test_shared_heartbeat_scheduler(self):
+        class HeartbeatTransport(stomp.transport.BaseTransport):
+            def __init__(self):
+                stomp.transport.BaseTransport.__init__(self)
+                self.connected = True
+                self.sent = []
+
+            def send_buffers(self, buffers):
+                self.sent.append((threading.current_thread(), b"".join(buffers)))
+
+        class TimeoutListener(stomp.ConnectionListener):
+            timeouts = 0
+
+            def on_heartbeat_timeout(self):
+                self.timeouts += 1
+
+        scheduler = stomp.listener.HeartbeatScheduler()
+        transports = [HeartbeatTransport() for _ in range(3)]
+        listeners = [stomp.listener.HeartbeatListener(transport, (50, 50), scheduler=scheduler)
+                     for transport in transports]
+        timeout_listener = TimeoutListener()
+        transports[0].set_listener("timeouts", timeout_listener)
+        for listener in listeners:
+            listener.on_connected(stomp.utils.Frame("CONNECTED", {"heart-beat": "50,50"}))
+        assert 3 == len(scheduler)
+        try:
+            deadline = time.monotonic() + 0.5
+            while time.monotonic() < deadline:
+                # keep the last two connections alive
+                for listener in listeners[1:]:
+                    listener.on_heartbeat()
+                time.sleep(0.01)
+
+            # one thread times the heartbeats for all the connections, and a few workers send them
+            threads = set()
+            for transport in transports:
+                assert len(transport.sent) >= 1
+                assert set([b"\n"]) == set([data for (_, data) in transport.sent])
+                threads.update([thread for (thread, _) in transport.sent])
+            assert scheduler.scheduler_thread not in threads
+            assert len(threads) <= scheduler.max_workers
+
+            assert len(transports[1].sent) >= 5
+            assert wait_for(lambda: timeout_listener.timeouts == 1)
+            assert not transports[0].is_connected()
+            assert transports[1].is_connected()
+        finally:
+            for listener in listeners:
+                listener.on_disconnected()
+        assert 0 == len(scheduler)
+        time.sleep(0.1)
+        assert scheduler.scheduler_thread is None
+
+    def test_blocked_heartbeat(self):
+        release = threading.Event()
+
+        class HeartbeatTransport(stomp.transport.BaseTransport):
+            def __init__(self, blocked):
+                stomp.transport.BaseTransport.__init__(self)
+                self.connected = True
+                self.blocked = blocked
+                self.sent = 0
+
+            def send_buffers(self, buffers):
+                self.sent += 1
+                if self.blocked:
+                    release.wait(5)
+
+        scheduler = stomp.listener.HeartbeatScheduler(max_workers=2)
+        transports = [HeartbeatTransport(True), HeartbeatTransport(False)]
+        listeners = [stomp.listener.HeartbeatListener(transport, (50, 0), scheduler=scheduler)
+                     for transport in transports]
+        for listener in listeners:
+            listener.on_connected(stomp.utils.Frame("CONNECTED", {"heart-beat": "0,50"}))
+        try:
+            time.sleep(0.5)
+            # the connection whose socket is stuck doesn't hold up the other, or queue up more heartbeats
+            assert 1 == transports[0].sent
+            assert transports[1].sent >= 5
+        finally:
+            release.set()
+            for listener in listeners:
+                listener.on_disconnected()
+
+    def test_interleave_addresses(self):
+        addresses = [(socket.AF_INET6, 1), (socket.AF_INET6, 2), (socket.AF_INET, 3), (socket.AF_INET6, 4)]
+        assert [1, 3, 2, 4] == [a[1] for a in stomp.transport.interleave_addresses(addresses)]
+        assert [] == stomp.transport.interleave_addresses([])
+
+    def test_race_connections(self):
+        servers = []
+        for _ in range(2):
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.bind(("127.0.0.1", 0))
+            server.listen(5)
+            servers.append(server)
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        (slow, fast) = [("127.0.0.1", server.getsockname()[1]) for server in servers]
+
+        cancelled = []
+
+        def setup(sock, host_and_port):
+            if host_and_port == slow:
+                # e.g. a TLS handshake with an overloaded broker, which never replies
+                start = time.monotonic()
+                sock.settimeout(5)
+                sock.recv(1)
+                cancelled.append(time.monotonic() - start)
+            return sock
+
+        try:
+            start = time.monotonic()
+            (sock, host_and_port) = stomp.transport.race_connections([slow, fast], 0.05, setup_fc=setup)
+            assert time.monotonic() - start < 1
+            assert fast == host_and_port
+            sock.close()
+            # the losing attempt is cancelled, rather than left waiting for its timeout
+            assert wait_for(lambda: cancelled)
+            assert cancelled[0] < 1
+
+            # a refused connection moves straight on to the next host, and is reported as failed
+            failed = []
+            (sock, host_and_port) = stomp.transport.race_connections([("127.0.0.1", closed_port), fast], 10,
+                                                                     failed_fc=failed.append)
+            assert fast == host_and_port
+            assert [("127.0.0.1", closed_port)] == failed
+            sock.close()
+
+            with pytest.raises(OSError):
+                stomp.transport.race_connections([("127.0.0.1", closed_port)], 0.05)
+
+            transport = stomp.transport.Transport([("127.0.0.1", closed_port), fast], connect_stagger=0.05)
+            transport.running = True
+            transport.attempt_connection()
+            assert fast == transport.current_host_and_port
+            transport.socket.close()
+        finally:
+            for server in servers:
+                server.close()
+
+    def test_ssl_context_cache_and_resumption(self, tmp_path):
+        import shutil
+        import ssl
+        import subprocess
+        if not shutil.which("openssl"):
+            pytest.skip("openssl not available")
+        cert_file = str(tmp_path / "cert.pem")
+        key_file = str(tmp_path / "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj",
+                        "/CN=localhost", "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key_file, "-out", cert_file], check=True, capture_output=True)
+
+        cache = stomp.transport.SSLContextCache()
+        context = cache.get(ca_certs=cert_file)
+        assert context is cache.get(ca_certs=cert_file)
+        assert context is not cache.get()
+        assert {"loads": 2, "hits": 1} == cache.stats
+        # changing a file reloads the context
+        stat = os.stat(cert_file)
+        os.utime(cert_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        assert context is not cache.get(ca_certs=cert_file)
+
+        # the least recently used contexts are dropped
+        cache = stomp.transport.SSLContextCache(max_contexts=2)
+        context = cache.get(ca_certs=cert_file, password="secret")
+        assert context is cache.get(ca_certs=cert_file, password=b"secret")
+        unused = cache.get()
+        assert context is cache.get(ca_certs=cert_file, password="secret")
+        cache.get(ca_certs=cert_file)
+        assert context is cache.get(ca_certs=cert_file, password="secret")
+        assert unused is not cache.get()
+        assert {"loads": 4, "hits": 3} == cache.stats
+
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.maximum_version = ssl.TLSVersion.TLSv1_2
+        server_context.load_cert_chain(cert_file, key_file)
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+
+        def serve():
+            while True:
+                try:
+                    (conn, _) = server.accept()
+                except OSError:
+                    return
+                try:
+                    with server_context.wrap_socket(conn, server_side=True) as tls_conn:
+                        tls_conn.recv(1)
+                except OSError:
+                    pass
+
+        threading.Thread(target=serve, daemon=True).start()
+        try:
+            transport = stomp.transport.Transport([("127.0.0.1", server.getsockname()[1])])
+            transport.set_ssl([("127.0.0.1", server.getsockname()[1])], ca_certs=cert_file)
+            for _ in range(3):
+                transport.running = True
+                transport.attempt_connection()
+                transport.disconnect_socket()
+            assert 3 == transport.ssl_stats["handshakes"]
+            assert 2 == transport.ssl_stats["resumed"]
+        finally:
+            server.close()
@@ -1,3 +1,4 @@
+import array
 import importlib
 
 import pytest
@@ -42,6 +43,54 @@ class TestUtils(object):
             " foo ": " bar",
         } == parse_headers(lines)
 
+    def test_lazy_headers(self):
+        lines = [
+            r"h1:foo\c\\bar  ",
+            r"h1:2nd h1 ignored",
+            r"h\c2:baz\r\nquux",
+            r" foo : bar",
+            r"no-separator",
+        ]
+        headers = LazyHeaders("\r\n".join(lines))
+        assert parse_headers(lines) == headers
+        assert headers == parse_headers(lines)
+        assert "h:2" in headers
+        assert r"foo:\bar  " == headers["h1"]
+        assert "missing" not in headers
+        assert headers.get("missing") is None
+        assert 3 == len(headers)
+        assert ["h1", "h:2", " foo "] == list(headers)
+        assert "{'h1': 'foo:\\\\bar  ', 'h:2': 'baz\\r\\nquux', ' foo ': ' bar'}" == repr(headers)
+
+    def test_lazy_headers_copy(self):
+        headers = LazyHeaders("a:1\nb:2")
+        copied = copy.copy(headers)
+        headers["a"] = "changed"
+        del headers["b"]
+        assert {"a": "changed"} == headers
+        assert {"a": "1", "b": "2"} == copied
+        assert {"a": "changed"} == headers.copy()
+        assert {} == LazyHeaders()
+
+    def test_lazy_headers_read_from_threads(self):
+        import threading
+        for _ in range(50):
+            headers = LazyHeaders(r"id:ID\\chost\c1")
+            values = []
+            barrier = threading.Barrier(4)
+
+            def read():
+                barrier.wait()
+                values.append(headers["id"])
+
+            threads = [threading.Thread(target=read) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert [r"ID\chost:1"] * 4 == values
+            assert r"ID\chost:1" == headers.copy()["id"]
+
     def test_calculate_heartbeats(self):
         chb = (3000, 5000)
         shb = map(str, reversed(chb))
@@ -75,6 +124,54 @@ class TestUtils(object):
             )
             assert str(f) == str(Frame("MESSAGE", {"content-type": "text/plain"}, b"hello world!"))
 
+    def test_parse_frame_lazy_body(self):
+        f = parse_frame(b"MESSAGE\ncontent-type:text/plain\n\nmar\xd0\xba\xd0\xbe", encoding="utf-8")
+        assert b"mar\xd0\xba\xd0\xbe" == f.raw_body
+        assert "marко" == f.body
+        assert f.body is f.body
+
+        body = b"x" * (BODY_VIEW_THRESHOLD + 1)
+        f = parse_frame(b"MESSAGE\n\n" + body, encoding="utf-8")
+        assert isinstance(f.raw_body, memoryview)
+        assert f.raw_body.readonly
+        assert body == f.raw_body
+        assert body.decode() == f.body
+
+        f = parse_frame(b"MESSAGE\n\n\x00\x01")
+        assert b"\x00\x01" == f.body
+
+        f.body = "replaced"
+        assert "replaced" == f.body
+        assert "replaced" == f.raw_body
+
+    def test_frame_original_headers(self):
+        f = parse_frame(b"MESSAGE\ntestheader:originalheader\n\n")
+        assert not hasattr(f, "__dict__")
+        assert {"testheader": "originalheader"} == f.original_headers
+        f.headers["testheader"] = "modifiedheader"
+        assert "modifiedheader" == f.headers["testheader"]
+        assert "originalheader" == f.original_headers["testheader"]
+
+        f = Frame("SEND", {"a": "1"})
+        assert {"a": "1"} == f.original_headers
+        f.headers["a"] = "2"
+        assert {"a": "1"} == f.original_headers
+
+        # the headers aren't copied, unless changed (with set_header) before the original headers are read
+        headers = {"a": "1", "b": "2"}
+        f = Frame("SEND", headers)
+        assert f.headers is headers
+        f.set_header("a", "2")
+        f.set_header("c", "3")
+        assert f.headers is headers
+        assert {"a": "2", "b": "2", "c": "3"} == f.headers
+        assert {"a": "1", "b": "2"} == f.original_headers
+
+        f = parse_frame(b"MESSAGE\na:1\n\n")
+        f.set_header("a", "2")
+        assert {"a": "2"} == f.headers
+        assert {"a": "1"} == f.original_headers
+
     def test_clean_default_headers(self):
         Frame('test').headers["foo"] = "bar"
         assert Frame('test').headers == {}
@@ -86,10 +183,15 @@ class TestUtils(object):
     def test_decode(self):
         assert decode(None) is None
         assert "test" == decode(b"test")
+        assert "test" == decode(memoryview(b"test"))
 
     def test_encode(self):
         assert b"test" == encode("test")
         assert b"test" == encode(b"test")
+        data = bytearray(b"test")
+        assert data is encode(data)
+        view = encode(memoryview(array.array("i", [1, 2])))
+        assert 8 == len(view)
         with pytest.raises(TypeError):
             encode(None)
 
@@ -9,6 +9,7 @@ from subprocess import run, PIPE
 
 import pytest
 
+from stomp.framing import FrameDecoder
 from stomp.utils import *
 from stomp import logging
 
@@ -199,6 +200,125 @@ class StubStompServer(object):
         logging.info("run loop completed")
 
 
+class FakeBroker(object):
+    """
+    Just enough of a STOMP server to test against. Records the frames received on each connection, sends receipts
+    (and heartbeats, if `heartbeat` is set), rejects sends to /queue/error, and delivers sent messages to the
+    subscribers of the destination on the same connection. Can drop all of its connections (as if restarted).
+
+    :param str heartbeat: the heart-beat header sent in CONNECTED (the broker sends heartbeats at the first interval)
+    """
+
+    def __init__(self, heartbeat="0,0"):
+        self.heartbeat = heartbeat
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(50)
+        self.port = self.server.getsockname()[1]
+        self.connections = []
+        self.frames = []
+        self.heartbeats_received = 0
+        self.__write_lock = threading.Lock()
+        thread = threading.Thread(target=self.accept_loop)
+        thread.daemon = True
+        thread.start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                (conn, _) = self.server.accept()
+            except OSError:
+                return
+            frames = []
+            self.connections.append(conn)
+            self.frames.append(frames)
+            thread = threading.Thread(target=self.handle, args=(conn, frames))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, conn, frames):
+        decoder = FrameDecoder()
+        subscriptions = {}
+        message_id = 0
+        closed = threading.Event()
+        try:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                if data == b"\n":
+                    self.heartbeats_received += 1
+                decoder.feed(data)
+                for raw in decoder.decode():
+                    frame = parse_frame(raw, "utf-8")
+                    if frame is None or frame.cmd == "heartbeat":
+                        continue
+                    frames.append(frame)
+                    headers = frame.headers
+                    if frame.cmd in ("CONNECT", "STOMP"):
+                        self.write(conn, "CONNECTED", {"version": "1.2", "heart-beat": self.heartbeat})
+                        interval = int(self.heartbeat.split(",")[0])
+                        if interval:
+                            thread = threading.Thread(target=self.send_heartbeats, args=(conn, interval, closed))
+                            thread.daemon = True
+                            thread.start()
+                    elif frame.cmd == "SUBSCRIBE":
+                        subscriptions[headers["id"]] = headers["destination"]
+                    elif frame.cmd == "SEND" and headers["destination"] == "/queue/error":
+                        self.write(conn, "ERROR", {"message": "rejected", "receipt-id": headers.get("receipt")})
+                        continue
+                    elif frame.cmd == "SEND":
+                        for (id, destination) in list(subscriptions.items()):
+                            if destination == headers["destination"]:
+                                message_id += 1
+                                self.write(conn, "MESSAGE", {"destination": destination, "subscription": id,
+                                                             "message-id": message_id, "ack": message_id},
+                                           frame.body)
+                    if "receipt" in headers:
+                        self.write(conn, "RECEIPT", {"receipt-id": headers["receipt"]})
+                    if frame.cmd == "DISCONNECT":
+                        return
+        except OSError:
+            pass
+        finally:
+            closed.set()
+            conn.close()
+
+    def send_heartbeats(self, conn, interval, closed):
+        while not closed.wait(interval / 1000.0):
+            try:
+                with self.__write_lock:
+                    conn.sendall(b"\n")
+            except OSError:
+                return
+
+    def write(self, conn, cmd, headers, body=""):
+        with self.__write_lock:
+            conn.sendall(pack(convert_frame(Frame(cmd, headers, body))))
+
+    def drop(self):
+        for conn in list(self.connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        try:
+            # wakes up the accept loop
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.02)
+    return condition()
+
+
 class StubStdin(object):
     pass
 